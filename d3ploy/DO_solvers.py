@@ -5,6 +5,8 @@ This file manages Deterministic-optimizing libaries for the D3ploy cyclus module
 import numpy as np
 import statsmodels.tsa.holtwinters as hw
 
+from d3ploy.timeseries import window
+
 
 def polyfit_regression(ts, back_steps=10, degree=1, steps=1):
     """
@@ -23,30 +25,27 @@ def polyfit_regression(ts, back_steps=10, degree=1, steps=1):
     --------
     x : The predicted value from the fit polynomial.
     """
-    time = range(1, len(ts) + 1)
-    timeseries = np.array(list(ts.values()))
-    fit = np.polyfit(time[-back_steps:],
-                     timeseries[-back_steps:], deg=degree)
+    timeseries = window(ts, back_steps)
+    time = np.arange(len(ts) - len(timeseries) + 1, len(ts) + 1)
+    fit = np.polyfit(time, timeseries, deg=degree)
     eq = np.poly1d(fit)
     x = eq(len(ts) + steps)
     return x
 
 
-def exp_smoothing(ts, back_steps=10, degree=1, steps=1):
+def smoothing_window(timeseries):
     """
-    Predicts next value using simple exponential smoothing.
+    Adjusts the window of values fitted by the exponential smoothing
+    methods around the lengths statsmodels cannot fit.
     Parameters:
     -----------
-    ts: Array of floats
-        An array of times series data to be used for the polyfit regression
+    timeseries: Array of floats
+        The values to be fitted
     Returns:
     --------
-
-    x : The predicted value from the exponential smoothing method.
-
+    timeseries : The values to fit.
     """
-    timeseries = np.array(list(ts.values()))
-    timeseries = timeseries[-back_steps:]
+    # exponential smoothing errors when there is only one datapoint
     if len(timeseries) == 1:
         timeseries = [np.inf,0]
     # exponential smoothing errors when there are five datapoints
@@ -54,6 +53,23 @@ def exp_smoothing(ts, back_steps=10, degree=1, steps=1):
     # https://github.com/statsmodels/statsmodels/issues/4878
     elif len(timeseries) == 5:
         timeseries = np.append(np.mean(timeseries), timeseries)
+    return timeseries
+
+
+def exp_smoothing(ts, back_steps=10, degree=1, steps=1):
+    """
+    Predicts next value using simple exponential smoothing.
+    Parameters:
+    -----------
+    ts: Array of floats
+        An array of times series data to be used for the polyfit regression
+    Returns:
+    --------
+
+    x : The predicted value from the exponential smoothing method.
+
+    """
+    timeseries = smoothing_window(window(ts, back_steps))
     model = hw.SimpleExpSmoothing(timeseries)
     model_fit = model.fit()
     x = model_fit.predict(len(timeseries), len(timeseries) + steps - 1)
@@ -72,16 +88,7 @@ def holt_winters(ts, back_steps=10, degree=1, steps=1):
     --------
     x : The predicted value from the holt-winters method.
     """
-    timeseries = np.array(list(ts.values()))
-    timeseries = timeseries[-back_steps:]
-    # exponential smoothing errors when there is only one datapoint
-    if len(timeseries) == 1:
-        timeseries = [np.inf,0]
-    # exponential smoothing errors when there are five datapoints
-    # average is appended to the beginning of the timeseries for minimal impact
-    # https://github.com/statsmodels/statsmodels/issues/4878
-    elif len(timeseries) == 5:
-        timeseries = np.append(np.mean(timeseries), timeseries)
+    timeseries = smoothing_window(window(ts, back_steps))
     model = hw.ExponentialSmoothing(timeseries)
     model_fit = model.fit()
     x = model_fit.predict(len(timeseries), len(timeseries) + steps - 1)
@@ -89,26 +96,54 @@ def holt_winters(ts, back_steps=10, degree=1, steps=1):
 
 
 def fft(ts, back_steps=10, degree=1, steps=1):
-    timeseries = np.array(list(ts.values()))
-    timeseries = timeseries[-back_steps:]
-    n = timeseries.size
+    """
+    Predicts next value by extrapolating the harmonics of the
+    detrended values.
+    Parameters:
+    -----------
+    ts: Array of floats
+        An array of times series data to be used for the fft
+    Returns:
+    --------
+    x : The predicted value from the fft method.
+    """
+    timeseries = window(ts, back_steps)
+    return fft_batch(timeseries[np.newaxis, :], degree=degree,
+                     steps=steps)[0]
+
+
+def fft_batch(windows, degree=1, steps=1):
+    """
+    Predicts next value of many time series at once with the fft method.
+    Parameters:
+    -----------
+    windows: 2-D array of floats
+        One row per time series, all of the same length
+    Returns:
+    --------
+    x : Array with the predicted value of each time series.
+    """
+    windows = np.atleast_2d(np.asarray(windows, dtype=float))
+    n = windows.shape[1]
     n_harm = 100                    # number of harmonics in model
     t = np.arange(0, n)
-    if len(t) == 1: 
-        p = [np.inf,0]
+    # find linear trend in x, only its leading coefficient is used
+    if n == 1:
+        slope = np.full(windows.shape[0], np.inf)
+    elif degree == 1:
+        tc = t - t.mean()
+        slope = (windows @ tc) / (tc @ tc)
     else:
-        p = np.polyfit(t, timeseries, degree) # find linear trend in x
-    x_notrend = timeseries - p[0] * t        # detrended x
-    x_freqdom = np.fft.fft(x_notrend)  # detrended x in frequency domain
+        slope = np.polyfit(t, windows.T, degree)[0]
+    x_notrend = windows - slope[:, np.newaxis] * t      # detrended x
+    x_freqdom = np.fft.fft(x_notrend, axis=1)  # detrended x in frequency domain
     f = np.fft.fftfreq(n)              # frequencies
-    indexes = list(range(n))
-    # sort indexes by frequency, lower -> higher
-    indexes.sort(key=lambda i: np.absolute(f[i]))
-    t = np.arange(0, n + steps)
-    restored_sig = np.zeros(t.size)
-    for i in indexes[:1 + n_harm * 2]:
-        ampli = np.absolute(x_freqdom[i]) / n   # amplitude
-        phase = np.angle(x_freqdom[i])          # phase
-        restored_sig += ampli * np.cos(2 * np.pi * f[i] * t + phase)
-    fft_fit = restored_sig + p[0] * t
-    return fft_fit[-1]
+    # indexes sorted by frequency, lower -> higher
+    indexes = np.argsort(np.absolute(f), kind='stable')[:1 + n_harm * 2]
+    ampli = np.absolute(x_freqdom[:, indexes]) / n   # amplitude
+    phase = np.angle(x_freqdom[:, indexes])          # phase
+    # the restored signal is only needed at the predicted time
+    t_pred = n + steps - 1
+    restored_sig = np.sum(
+        ampli * np.cos(2 * np.pi * f[indexes] * t_pred + phase), axis=1)
+    return restored_sig + slope * t_pred
@@ -1,21 +1,40 @@
 import numpy
 from pmdarima.arima import auto_arima
 import d3ploy.NO_solvers as no
+from d3ploy.timeseries import as_array
+
+
+def select_model(data, period=5):
+    """
+    Selects the seasonal ARIMA model of the data with a stepwise
+    search and fits it.
+    Parameters:
+    -----------
+    data: Array of floats
+        The values to be fitted
+    period: int
+        The period of the seasonal component
+    Returns:
+    --------
+    model : The fitted pmdarima ARIMA model.
+    """
+    stepwise_model = auto_arima(data, start_p=1, start_q=1,
+                                max_p=5, max_q=5, m=period,
+                                start_P=0, seasonal=True,
+                                d=1, D=1, trace=False,
+                                error_action='ignore',
+                                suppress_warnings=True,
+                                stepwise=True)
+    stepwise_model.fit(data)
+    return stepwise_model
 
 
 def stepwise_seasonal(ts, period=5):
-    data = list(ts.values())
+    data = as_array(ts)
     if len(data) == 1:
         return no.predict_ma(ts)
     try:
-        stepwise_model = auto_arima(data, start_p=1, start_q=1,
-                                    max_p=5, max_q=5, m=period,
-                                    start_P=0, seasonal=True,
-                                    d=1, D=1, trace=True,
-                                    error_action='ignore',
-                                    suppress_warnings=True,
-                                    stepwise=True)
-        stepwise_model.fit(data)
+        stepwise_model = select_model(data, period)
         future_forecast = stepwise_model.predict(n_periods=1)[-1]
     except:
         return no.predict_ma(ts)
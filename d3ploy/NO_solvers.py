@@ -9,6 +9,8 @@ import math
 import statsmodels.api as sm
 from arch import arch_model
 
+from d3ploy.timeseries import window
+
 
 def predict_ma(ts, steps=5, std_dev=0, back_steps=5):
     """
@@ -25,8 +27,7 @@ def predict_ma(ts, steps=5, std_dev=0, back_steps=5):
     -------
     x : The moving average calculated by the function.
     """
-    supply = np.array(list(ts.values()))
-    x = np.average(supply[-1*back_steps:])
+    x = np.average(window(ts, back_steps))
     return x
 
 
@@ -45,8 +46,7 @@ def predict_arma(ts, steps=5, std_dev=0, back_steps=5):
     --------
     x : Predicted value for the time series at chosen timestep (time).
     """
-    v = list(ts.values())
-    v = v[-1*back_steps:]
+    v = window(ts, back_steps)
     try:
         fit = sm.tsa.ARMA(v, (1, 0)).fit(disp=-1)
         forecast = fit.forecast(steps)
@@ -62,8 +62,7 @@ def predict_arch(ts, steps=1, std_dev=0, back_steps=2):
     currently available time series data. This method impliments an ARCH
     calculation to perform the prediciton.
     """
-    v = list(ts.values())
-    v = v[-1*back_steps:]
+    v = window(ts, back_steps)
     try:
         model = arch_model(v)
         fit = model.fit(disp="off", show_warning=False)
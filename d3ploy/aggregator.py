@@ -0,0 +1,174 @@
+"""
+This file contains the aggregator of the time series reported by the
+facilities. A single aggregator per simulation subscribes once to the
+time series of each commodity and sums the values reported at each
+timestep, so that a record made by a facility costs one addition however
+many deployment institutions follow the commodity. The institutions read
+the totals through views, and merge the new totals into their own time
+series once per decision. The totals of a time series keep the
+largest window the institutions following it read, so that an
+institution can merge totals as old as its predictors read. The
+aggregator is dropped, and its listeners removed, when the last
+institution using it releases it.
+"""
+from d3ploy.timeseries import TimeSeries, HistoryError
+
+# id of the listeners of a simulation -> [listeners, aggregator, number
+# of users]. The listeners (a defaultdict) can not be weakly referenced
+# nor hold attributes, so the entries are counted instead.
+_AGGREGATORS = {}
+
+
+def aggregator(listeners):
+    """ Returns the aggregator of the time series listeners of a
+    simulation (lib.TIME_SERIES_LISTENERS), creating it if needed. Each
+    call must be matched by a call of release. """
+    key = id(listeners)
+    if key not in _AGGREGATORS:
+        _AGGREGATORS[key] = [listeners, Aggregator(listeners), 0]
+    entry = _AGGREGATORS[key]
+    entry[2] += 1
+    return entry[1]
+
+
+def release(listeners):
+    """ Releases the aggregator of the time series listeners, dropping
+    it and removing its listeners once it is released by all its
+    users. """
+    entry = _AGGREGATORS.get(id(listeners))
+    if entry is None:
+        return
+    entry[2] -= 1
+    if entry[2] <= 0:
+        del _AGGREGATORS[id(listeners)]
+        entry[1].unsubscribe()
+
+
+class Aggregator(object):
+    """
+    Totals per timestep of the time series of the commodities.
+
+    Parameters
+    ----------
+    listeners: dict
+        key: name of a time series
+        value: list of the listeners of the time series
+    """
+
+    def __init__(self, listeners):
+        self.listeners = listeners
+        self.totals = {}
+        # number of timesteps the totals keep, 0 for the whole history
+        self.histories = {}
+        self.subscribed = {}
+        self.calls = {}
+        # names of the time series whose listener counts its calls
+        self.counted = set()
+
+    def listener(self, totals, counted):
+        """ Returns the listener adding the reported values to totals,
+        counting its calls if counted is set """
+        add = totals.add
+        if not counted:
+            def listener(agent, time, value, name):
+                add(time, value)
+            return listener
+        calls = self.calls
+
+        def counted_listener(agent, time, value, name):
+            calls[name] += 1
+            add(time, value)
+        return counted_listener
+
+    def subscribe(self, name, counted=False, history=0):
+        """ Subscribes to the time series name, once, and returns the
+        totals of its values, which keep at least the last history
+        timesteps (the whole history if history is 0). If the listeners
+        of the time series have been cleared, e.g. by a new simulation,
+        the totals are reset. """
+        listeners = self.listeners[name]
+        current = self.subscribed.get(name)
+        if current not in listeners:
+            self.totals[name] = TimeSeries(retain=history)
+            self.histories[name] = history
+            self.calls[name] = 0
+            self.counted.discard(name)
+            current = None
+        elif 0 < self.histories[name] < history or (
+                history == 0 and self.histories[name] > 0):
+            self.totals[name].set_retention(history)
+            self.histories[name] = history
+        if current is None or (counted and name not in self.counted):
+            listener = self.listener(self.totals[name],
+                                     counted or name in self.counted)
+            if current is None:
+                listeners.append(listener)
+            else:
+                listeners[listeners.index(current)] = listener
+            self.subscribed[name] = listener
+            if counted:
+                self.counted.add(name)
+        return self.totals[name]
+
+    def unsubscribe(self):
+        """ Removes the listeners of the aggregator and drops the
+        totals. """
+        for name, listener in self.subscribed.items():
+            listeners = self.listeners.get(name, ())
+            if listener in listeners:
+                listeners.remove(listener)
+        self.subscribed = {}
+        self.totals = {}
+        self.histories = {}
+        self.calls = {}
+        self.counted = set()
+
+    def view(self, name, time, counted=False, history=0):
+        """ Returns a view of the totals of the time series name for
+        an institution entering the simulation at time, whose
+        predictors read the last history timesteps of the time series
+        (the whole history if history is 0). """
+        return TotalsView(self, name,
+                          self.subscribe(name, counted, history), time)
+
+
+class TotalsView(object):
+    """
+    Read-only view of the totals of a time series for one institution.
+    The values reported before the view was made are not merged.
+    """
+
+    def __init__(self, aggregator, name, totals, time):
+        self.aggregator = aggregator
+        self.name = name
+        self.totals = totals
+        self.time = time
+        # total at self.time already merged, None if it was not set
+        self.merged = totals.get(time)
+        self.seen_calls = aggregator.calls[name]
+
+    def merge(self, series, time):
+        """ Adds the values reported since the last merge, up to time,
+        to series. """
+        if self.time < self.totals.offset:
+            raise HistoryError('the totals of %s older than %i timesteps '
+                               'are not kept' % (self.name,
+                                                 self.totals.retain))
+        get = self.totals.get
+        value = get(self.time)
+        if value is not None and (self.merged is None or
+                                  value != self.merged):
+            series.add(self.time, value - (self.merged or 0.0))
+        for t in range(self.time + 1, time + 1):
+            value = get(t)
+            if value is not None:
+                series.add(t, value)
+        self.time = time
+        self.merged = get(time)
+
+    def calls(self):
+        """ Returns the number of calls of the listener since the last
+        time, if it is counted. """
+        calls = self.aggregator.calls[self.name]
+        n, self.seen_calls = calls - self.seen_calls, calls
+        return n
@@ -0,0 +1,179 @@
+"""
+This file contains a cache of the outputs of cyclus simulations on local
+disk. The outputs are stored under a hash of the canonical input of the
+simulation and of the versions of d3ploy, cyclus and cycamore, so that a
+simulation is only run again if its input or the code running it has
+changed. The metrics computed from an output can be stored with it, and
+the least recently used outputs are removed when the cache grows over its
+maximum size.
+"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+
+OUTPUT = 'output.sqlite'
+METRICS = 'metrics.json'
+
+
+def canonical_input(scenario):
+    """ Returns a canonical text of a cyclus input: a JSON dictionary, or
+    the text of a JSON or XML input. """
+    if isinstance(scenario, str):
+        if scenario.lstrip().startswith('<'):
+            return ET.canonicalize(scenario, strip_text=True)
+        scenario = json.loads(scenario)
+    return json.dumps(scenario, sort_keys=True, separators=(',', ':'))
+
+
+def d3ploy_version():
+    """ Returns the version of d3ploy: a hash of its source files, which
+    changes with the code of the archetypes even if the version number
+    of the package does not. """
+    sha = hashlib.sha256()
+    for name in sorted(glob.glob(os.path.join(os.path.dirname(__file__),
+                                              '*.py'))):
+        sha.update(os.path.basename(name).encode('utf-8'))
+        with open(name, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def cyclus_versions(cyclus=('cyclus',)):
+    """ Returns the versions of cyclus and cycamore: the output of
+    `cyclus --version` and a hash of the cycamore library found in the
+    paths cyclus loads archetypes from. """
+    run = list(cyclus)
+    versions = {'cyclus': subprocess.check_output(
+        run + ['--version'], universal_newlines=True).strip()}
+    prefix = subprocess.check_output(
+        run + ['--install-path'], universal_newlines=True).strip()
+    paths = glob.glob(os.path.join(prefix, 'lib*', 'cyclus'))
+    paths += [p for p in os.environ.get('CYCLUS_PATH', '').split(':') if p]
+    sha = hashlib.sha256()
+    for path in paths:
+        for name in sorted(glob.glob(os.path.join(path, 'cycamore', '*'))):
+            if os.path.isfile(name):
+                with open(name, 'rb') as f:
+                    sha.update(f.read())
+    versions['cycamore'] = sha.hexdigest()
+    return versions
+
+
+class Cache(object):
+    """
+    Cache of the outputs of cyclus simulations.
+
+    Parameters
+    ----------
+    directory: str
+        Directory of the cache, with one subdirectory per output.
+    max_size: int
+        Maximum size of the cache in bytes.
+    versions: dict
+        Versions of the codes running the simulations. By default, the
+        ones of d3ploy, cyclus and cycamore.
+    """
+
+    def __init__(self, directory, max_size=10 * 2**30, versions=None):
+        self.directory = directory
+        self.max_size = max_size
+        if versions is None:
+            versions = {'d3ploy': d3ploy_version()}
+            versions.update(cyclus_versions())
+        self.versions = versions
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, scenario):
+        """ Returns the key of the output of a scenario """
+        text = json.dumps({'input': canonical_input(scenario),
+                           'versions': self.versions}, sort_keys=True)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """ Returns the name of the output file of a key, or None if it is
+        not in the cache. """
+        output_file = os.path.join(self.path(key), OUTPUT)
+        with self.lock:
+            if not os.path.exists(output_file):
+                return None
+            # the modification time of an entry is its last use
+            os.utime(self.path(key))
+        return output_file
+
+    def put(self, key, output_file):
+        """ Moves an output file into the cache and returns its new name.
+        """
+        tmp = tempfile.mkdtemp(prefix='.', dir=self.directory)
+        shutil.move(output_file, os.path.join(tmp, OUTPUT))
+        with self.lock:
+            if os.path.exists(self.path(key)):
+                shutil.rmtree(tmp)
+            else:
+                os.rename(tmp, self.path(key))
+            self.evict(keep=key)
+        return os.path.join(self.path(key), OUTPUT)
+
+    def get_metrics(self, key, name):
+        """ Returns the metrics summary of an output stored under name, or
+        None. """
+        try:
+            with open(os.path.join(self.path(key), METRICS)) as f:
+                return json.load(f).get(name)
+        except (OSError, ValueError):
+            return None
+
+    def put_metrics(self, key, name, summary):
+        """ Stores a metrics summary (a JSON serializable object) of an
+        output under name. """
+        metrics_file = os.path.join(self.path(key), METRICS)
+        with self.lock:
+            if not os.path.isdir(self.path(key)):
+                return
+            try:
+                with open(metrics_file) as f:
+                    summaries = json.load(f)
+            except (OSError, ValueError):
+                summaries = {}
+            summaries[name] = summary
+            with open(metrics_file + '.tmp', 'w') as f:
+                json.dump(summaries, f)
+            os.replace(metrics_file + '.tmp', metrics_file)
+
+    def entries(self):
+        """ Returns the (last use, size, key) of the entries of the cache
+        """
+        entries = []
+        for key in os.listdir(self.directory):
+            if key.startswith('.'):
+                continue
+            path = self.path(key)
+            size = sum(os.path.getsize(os.path.join(path, name))
+                       for name in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, key))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """ Removes the least recently used entries until the cache is
+        smaller than its maximum size. """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total -= size
@@ -0,0 +1,898 @@
+"""
+This file contains the engine shared by the demand driven and supply
+driven deployment institutions. For each of its commodities, the
+institution predicts the amount provided by its facilities (the supply
+of DemandDrivenDeploymentInst, the capacity of SupplyDrivenDeploymentInst)
+and the amount required (the demand, or the supply), and deploys or
+decommissions facilities so that the provided amount meets the required
+amount. Each timestep decision() runs the stages of the pipeline of the
+institution, each stage handling all the commodities at once:
+
+collect -> forecast -> diff -> deploy -> decommission -> record
+"""
+
+import abc
+import collections
+import itertools
+from time import perf_counter
+from cyclus.agents import Institution
+from cyclus import lib
+import cyclus.typesystem as ts
+import d3ploy.solver as solver
+import d3ploy.deployment_inst as di
+from d3ploy.timeseries import TimeSeries
+from d3ploy.aggregator import aggregator, release
+from d3ploy.registry import ChildRegistry
+from d3ploy.recorder import Recorder
+from d3ploy.profiler import Profiler
+from d3ploy.predictors import make_predictor, predict_batch, \
+    make_executor
+
+# the timesteps kept in the bounded histories besides the windows of the
+# predictors: the stages read the current timestep and write the next one
+HISTORY_MARGIN = 2
+
+
+class DecisionStep(object):
+    """
+    The values the stages of one decision() call pass to each other.
+    Each dictionary is keyed by commodity.
+    """
+
+    def __init__(self, time):
+        self.time = time
+        self.provided = {}
+        # after the diff stage the required amounts include the buffer
+        self.required = {}
+        self.diff = {}
+        # the lowest difference over the lookahead horizon
+        self.planned = {}
+        self.deployed = {}
+
+
+class DeploymentEngine(Institution):
+    """
+    Base class of the deployment institutions. Subclasses name the
+    provided and required amounts, tell which time series hold them
+    and can change the stages of the pipeline. A subclass must override
+    the abstract methods (drive only if it overrides driven), or its
+    definition raises a TypeError.
+    """
+
+    # the names of the provided and required amounts, used in the
+    # recorded time series and outputs
+    provided_label = 'supply'
+    required_label = 'demand'
+
+    # the stages of decision(), the methods 'stage_' + name
+    stages = ('collect', 'forecast', 'diff', 'deploy', 'decommission',
+              'record')
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        missing = [name for name in vars(DeploymentEngine)
+                   if getattr(getattr(cls, name), '__isabstractmethod__',
+                              False)]
+        if cls.driven is DeploymentEngine.driven and 'drive' in missing:
+            missing.remove('drive')
+        if missing:
+            raise TypeError('%s does not override the abstract methods %s '
+                            'of DeploymentEngine' % (cls.__name__,
+                                                     ', '.join(missing)))
+
+    facility_commod = ts.MapStringString(
+        doc="A map of facilities and each of their corresponding" +
+        " output commodities",
+        tooltip="Map of facilities and output commodities in the " +
+        "institution",
+        alias=['facility_commod', 'facility', 'commod'],
+        uilabel="Facility and Commodities"
+    )
+
+    facility_capacity = ts.MapStringDouble(
+        doc="A map of facilities and each of their corresponding" +
+        " capacities",
+        tooltip="Map of facilities and capacities in the " +
+        "institution",
+        alias=['facility_capacity', 'facility', 'capacity'],
+        uilabel="Facility and Capacities"
+    )
+
+    facility_pref = ts.MapStringString(
+        doc="A map of facilities and each of their corresponding" +
+        " preferences",
+        tooltip="Map of facilities and preferences in the " +
+        "institution",
+        alias=['facility_pref', 'facility', 'pref'],
+        uilabel="Facility and Preferences",
+        default={}
+    )
+
+    facility_constraintcommod = ts.MapStringString(
+        doc="A map of facilities and each of their corresponding" +
+        " constraint commodity",
+        tooltip="Map of facilities and constraint commodities in the " +
+        "institution",
+        alias=['facility_constraintcommod', 'facility', 'constraintcommod'],
+        uilabel="Facility and Constraint Commodities",
+        default={}
+    )
+
+    facility_constraintval = ts.MapStringDouble(
+        doc="A map of facilities and each of their corresponding" +
+        " constraint values",
+        tooltip="Map of facilities and constraint values in the " +
+        "institution",
+        alias=['facility_constraintval', 'facility', 'constraintval'],
+        uilabel="Facility and Constraint Commodity Values",
+        default={}
+    )
+
+    facility_sharing = ts.MapStringDouble(
+        doc="A map of facilities that share a commodity",
+        tooltip="Map of facilities and percentages of sharing",
+        alias=['facility_sharing', 'facility', 'percentage'],
+        uilabel="Facility and Percentages",
+        default={}
+    )
+
+    calc_method = ts.String(
+        doc="This is the calculated method used to determine the " +
+        "provided and required amounts (supply and demand, or capacity " +
+        "and supply) for the commodities of this institution. Currently " +
+        "this can be ma for moving average, or arma for autoregressive " +
+        "moving average.",
+        tooltip="Calculation method used to predict supply/demand",
+        uilabel="Calculation Method")
+
+    record = ts.Bool(
+        doc="Indicates whether or not the institution should record it's " +
+        "predictions and deployments to CSV files. The output files are " +
+        "named after each commodity of the institution and the id of the " +
+        "institution, e.g. POWER_12.csv.",
+        tooltip="Boolean to indicate whether or not to record output to CSV files.",
+        uilabel="Record to CSV",
+        default=False)
+
+    record_interval = ts.Int(
+        doc="The number of timesteps between writes of the recorded rows " +
+        "to the output files. The rows are also written at the end of the " +
+        "simulation. If this is set to '0' they are only written at the " +
+        "end of the simulation.",
+        tooltip="Timesteps between writes of the recorded output",
+        uilabel="Record Interval",
+        default=100)
+
+    installed_cap = ts.Bool(
+        doc="True if facility deployment is governed by installed capacity. " +
+        "False if deployment is governed by actual commodity supply " +
+        "(capacity for the supply driven institution)",
+        tooltip="Boolean to indicate whether or not to use installed" +
+                "capacity as supply",
+        uilabel="installed cap",
+        default=False)
+
+    steps = ts.Int(
+        doc="The number of timesteps forward to predict the provided and " +
+        "required amounts",
+        tooltip="The number of predicted steps forward",
+        uilabel="Timesteps for Prediction",
+        default=1
+    )
+
+    back_steps = ts.Int(
+        doc="This is the number of steps backwards from the current time step" +
+        "that will be used to make the prediction. If this is set to '0'" +
+        "then the calculation will use all values in the time series.",
+        tooltip="",
+        uilabel="Back Steps",
+        default=5)
+
+    buffer_type = ts.MapStringString(
+        doc="Indicates whether the buffer is a relative or absolute value," +
+        "rel: % value, abs: double value, for each commodity",
+        tooltip="Buffer as a relative or absolute value for," +
+        "each commodity",
+        alias=[
+            'buffer_type',
+            'commod',
+            'type'],
+        uilabel="Buffer type",
+        default={})
+
+    degree = ts.Int(
+        doc="The degree of the fitting polynomial.",
+        tooltip="The degree of the fitting polynomial, if using calc methods" +
+                " poly, fft, holtz-winter and exponential smoothing." +
+                " Additionally, degree is used to as the 'period' input to " +
+                "the stepwise_seasonal method.",
+        uilabel="Degree Polynomial Fit / Period for stepwise_seasonal",
+        default=1
+    )
+
+    os_time = ts.Int(
+        doc="The number of oversupply timesteps before decommission",
+        tooltip="",
+        uilabel="Oversupply Time Limit",
+        default=120
+    )
+
+    os_int = ts.Int(
+        doc="The number of facilities over capacity " +
+            "for a given commodity that is allowed. i.e If this" +
+            " value is 1. One facility capacity over demand is considered" +
+            " an oversupplied situtation.",
+        tooltip="",
+        uilabel="Oversupply Fac Limit",
+        default=1
+    )
+
+    refit_interval = ts.Int(
+        doc="The number of timesteps between refits of the models of the " +
+            "arma, arch, exp_smoothing, holt_winters and sw_seasonal calc " +
+            "methods. Each refit starts from the last fitted parameters " +
+            "(sw_seasonal reruns its model order search), and between " +
+            "refits the prediction is updated recursively from them. If " +
+            "this is set to '1' the models are refitted every timestep.",
+        tooltip="Timesteps between model refits",
+        uilabel="Refit Interval",
+        default=1
+    )
+
+    refit_tol = ts.Double(
+        doc="Refit the arma, arch and sw_seasonal models before " +
+            "refit_interval timesteps have passed when the latest value " +
+            "is more than " +
+            "this many standard deviations away from its one step " +
+            "prediction. If this is set to '0' the models are only " +
+            "refitted every refit_interval timesteps.",
+        tooltip="Residual drift that triggers a model refit",
+        uilabel="Refit Tolerance",
+        default=0
+    )
+
+    parallel_workers = ts.Int(
+        doc="The number of worker processes that predict the provided " +
+            "and required amounts of the commodities with the arma, arch, " +
+            "exp_smoothing, holt_winters and sw_seasonal calc methods in " +
+            "parallel. The predictions are the same as when they are " +
+            "made one by one. If this is set to '0' no worker processes " +
+            "are started.",
+        tooltip="Number of worker processes for the predictions",
+        uilabel="Parallel Workers",
+        default=0
+    )
+
+    deploy_method = ts.String(
+        doc="How facilities with the same preference and no sharing " +
+            "percentages are deployed. 'greedy' deploys the prototypes " +
+            "with the largest capacity first, 'optimal' deploys the " +
+            "prototypes that meet the lack in supply (or capacity) with " +
+            "the least overshoot and, among those, the least facilities.",
+        tooltip="Deployment method, greedy or optimal",
+        uilabel="Deployment Method",
+        default="greedy"
+    )
+
+    lookahead = ts.Int(
+        doc="The number of timesteps the institution plans for. If this " +
+            "is greater than 0, when the provided amount of a commodity " +
+            "does not meet the required amount, the institution deploys " +
+            "enough facilities for the whole horizon at once, accounting " +
+            "for the capacity of the facilities retiring during the " +
+            "horizon and for the facilities deployed by the previous " +
+            "plans that do not provide their amount yet, and only " +
+            "decommissions facilities if the commodity " +
+            "is oversupplied during the whole horizon. If this is '0' " +
+            "the institution only reacts to the predicted difference.",
+        tooltip="Timesteps of the deployment planning horizon",
+        uilabel="Lookahead",
+        default=0
+    )
+
+    bounded_history = ts.Bool(
+        doc="If true, the time series of the supply, demand (or " +
+            "capacity) and installed capacity of the commodities only " +
+            "keep the last values the predictors read instead of the " +
+            "whole history. The calc methods reading the whole history " +
+            "(back_steps of 0, sw_seasonal) can not be used with it.",
+        tooltip="Only keep the history the predictors read",
+        uilabel="Bounded History",
+        default=False
+    )
+
+    spill_history = ts.Bool(
+        doc="If true and bounded_history is set, the values dropped from " +
+            "the time series are written to CSV files named after the " +
+            "time series, the commodity and the id of the institution " +
+            "(e.g. supply_POWER_12_history.csv), which hold the whole " +
+            "time series at the end of the simulation.",
+        tooltip="Write the dropped history to CSV files",
+        uilabel="Spill History",
+        default=False
+    )
+
+    profile = ts.Bool(
+        doc="If true, the time spent in each stage of the decision and " +
+            "in the forecast and deployment of each commodity, and " +
+            "the number of calls of the time series listeners are " +
+            "recorded each timestep in the d3ploy_timing and " +
+            "d3ploy_listener_calls tables, and a summary of the " +
+            "run is written to d3ploy_profile_<id>.json.",
+        tooltip="Profile the institution",
+        uilabel="Profile",
+        default=False
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commodity_supply = {}
+        self.commodity_demand = {}
+        self.installed_capacity = {}
+        # the capacity deployed each of the last lookahead timesteps
+        self.pending = {}
+        self.provided_predictors = {}
+        self.required_predictors = {}
+        self.executor = None
+        self.registry = ChildRegistry()
+        # views of the shared totals of the reported time series, and
+        # the time series they are merged into
+        self.views = []
+        self.fac_commod = {}
+        self.commod_os = {}
+        self.fresh = True
+        self.ended = False
+
+    def setup(self):
+        """
+        Prepares the inputs of a subclass before the institution enters
+        the simulation for the first time.
+        """
+        pass
+
+    def enter_notify(self):
+        super().enter_notify()
+        if self.fresh:
+            self.setup()
+            # convert input into dictionary
+            self.commodity_dict = di.build_dict(
+                self.facility_commod,
+                self.facility_capacity,
+                self.facility_pref,
+                self.facility_constraintcommod,
+                self.facility_constraintval,
+                self.facility_sharing)
+            for commod, proto_dict in self.commodity_dict.items():
+                self.commod_os[commod] = 0
+                protos = proto_dict.keys()
+                for proto in protos:
+                    self.fac_commod[proto] = commod
+            self.commod_list = list(self.commodity_dict.keys())
+            for commod in self.commod_list:
+                self.installed_capacity[commod] = TimeSeries()
+                self.installed_capacity[commod][0] = 0.
+                self.pending[commod] = collections.deque(
+                    maxlen=self.lookahead)
+            for commod, commod_dict in self.commodity_dict.items():
+                for proto, proto_dict in commod_dict.items():
+                    if proto_dict['constraint_commod'] != '0':
+                        self.commod_list.append(
+                            proto_dict['constraint_commod'])
+            for commod, commod_dict in self.commodity_dict.items():
+                tot = 0
+                for proto, proto_dict in commod_dict.items():
+                    tot += proto_dict['share']
+                if tot != 0 and tot != 100:
+                    print("Share preferences do not add to 100")
+                    raise Exception()
+            self.buffer_dict = di.build_buffer_dict(self.buffer(),
+                                                    self.commod_list)
+            self.buffer_type_dict = di.build_buffer_type_dict(
+                self.buffer_type, self.commod_list)
+            if self.profile:
+                self.profiler = Profiler(
+                    'd3ploy_profile_' + str(self.id()) + '.json',
+                    {'calc_method': self.calc_method,
+                     'commodities': list(self.commodity_dict)})
+            for commod in self.commod_list:
+                if commod in self.commodity_supply:
+                    continue
+                self.commodity_supply[commod] = TimeSeries()
+                self.commodity_demand[commod] = TimeSeries()
+            for commod in self.commodity_dict:
+                if self.installed_cap:
+                    provided = self.installed_capacity[commod]
+                else:
+                    provided = self.provided_series(commod)
+                self.provided_predictors[commod] = self.predictor(
+                    provided, self.provided_steps())
+                self.required_predictors[commod] = self.predictor(
+                    self.required_series(commod), self.steps)
+            # the shared totals keep the windows of the predictors
+            shared = aggregator(lib.TIME_SERIES_LISTENERS)
+            windows = self.windows()
+            for commod in self.commodity_supply:
+                for name, series in [('supply', self.commodity_supply),
+                                     ('demand', self.commodity_demand)]:
+                    history = windows.get(id(series[commod]), 0)
+                    if history > 0 or id(series[commod]) not in windows:
+                        history += HISTORY_MARGIN
+                    self.views.append((
+                        shared.view(name + commod, self.context.time,
+                                    self.profile, history),
+                        series[commod]))
+            if self.bounded_history:
+                self.bound_histories()
+            self.executor = make_executor(self.parallel_workers)
+            self.pipeline = [getattr(self, 'stage_' + stage)
+                             for stage in self.stages]
+            if self.profile:
+                self.pipeline = [
+                    self.profiler.timed(stage, func)
+                    for stage, func in zip(self.stages, self.pipeline)]
+                self.pipeline.append(self.stage_profile)
+            if self.record:
+                self.recorder = Recorder(
+                    '_' + str(self.id()),
+                    ['time', 'facilities', self.provided_label,
+                     self.required_label, 'calc_' + self.provided_label,
+                     'calc_' + self.required_label, 'diff',
+                     'installed_capacity', 'deployed'],
+                    self.record_interval)
+            self.commod_mins = solver.find_mins(self.commodity_dict)
+            for child in self.children:
+                self.registry.add(child)
+                if child.prototype not in self.fac_commod:
+                    continue
+                itscommod = self.fac_commod[child.prototype]
+                self.installed_capacity[itscommod][0] += \
+                    self.commodity_dict[itscommod][child.prototype]['cap']
+            self.fresh = False
+
+    def bound_histories(self):
+        """
+        Makes the time series of the commodities only keep the last
+        values their predictors read.
+        """
+        windows = self.windows()
+        if 0 in windows.values():
+            raise ValueError(
+                'calc_method ' + self.calc_method + ' with ' +
+                'back_steps ' + str(self.back_steps) + ' reads ' +
+                'the whole history, it can not be used with ' +
+                'bounded_history')
+        for label, series_dict in [('supply', self.commodity_supply),
+                                   ('demand', self.commodity_demand),
+                                   ('installed_capacity',
+                                    self.installed_capacity)]:
+            for commod, series in series_dict.items():
+                spill = None
+                if self.spill_history:
+                    spill = (label + '_' + commod + '_' + str(self.id()) +
+                             '_history.csv')
+                series.set_retention(
+                    windows.get(id(series), 0) + HISTORY_MARGIN, spill)
+
+    def windows(self):
+        """
+        Returns the number of last timesteps the predictors read from
+        each time series, keyed by the id of the series, 0 if a
+        predictor reads the whole series.
+        """
+        windows = {}
+        for commod in self.commodity_dict:
+            for predictor in [self.provided_predictors[commod],
+                              self.required_predictors[commod]]:
+                history = max(predictor.history(), 0)
+                key = id(predictor.series)
+                if windows.get(key) == 0 or history == 0:
+                    windows[key] = 0
+                else:
+                    windows[key] = max(windows.get(key, 0), history)
+        return windows
+
+    def build_notify(self, child):
+        """
+        Registers a facility deployed by the institution.
+        """
+        self.registry.add(child)
+
+    def decom_notify(self, child):
+        """
+        Removes a decommissioned facility from the registry.
+        """
+        self.registry.remove(child)
+
+    def decision(self):
+        """
+        This is the tock method for decision the institution. Here the
+        institution runs the stages of its pipeline, which determine the
+        difference between the provided and required amounts and make
+        the decision to deploy or decommission facilities.
+        """
+        step = DecisionStep(self.context.time)
+        for stage in self.pipeline:
+            stage(step)
+        if step.time >= self.context.sim_dur - 1:
+            self.end_simulation()
+
+    def end_simulation(self):
+        """
+        Tears the institution down after its decision at the last
+        timestep of the simulation: writes the buffered records, the
+        profile summary and the spilled histories, shuts the worker
+        processes down and releases the shared aggregator.
+        """
+        if self.ended:
+            return
+        self.ended = True
+        if self.record:
+            self.recorder.flush()
+        if self.profile:
+            self.profiler.write()
+        if self.bounded_history and self.spill_history:
+            for series_dict in [self.commodity_supply, self.commodity_demand,
+                                self.installed_capacity]:
+                for series in series_dict.values():
+                    if series.spill is not None:
+                        series.spill_all()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        release(lib.TIME_SERIES_LISTENERS)
+
+    def stage_collect(self, step):
+        """
+        Merges the values reported by the facilities since the last
+        decision into the time series of the commodities, and makes sure
+        they have a value at the current time, even if no facility
+        reported one.
+        """
+        time = step.time
+        for view, series in self.views:
+            view.merge(series, time)
+        for commod in self.commodity_dict:
+            if time not in self.commodity_demand[commod]:
+                self.commodity_demand[commod][time] = \
+                    self.current_demand(commod, time)
+            if time not in self.commodity_supply[commod]:
+                self.commodity_supply[commod][time] = 0.0
+
+    def stage_forecast(self, step):
+        """
+        Predicts the provided and required amounts of all the
+        commodities. The predictions of the commodities are made
+        together, so that predictors which can be batched (ma, poly, fft,
+        and exp_smoothing and holt_winters between refits) are evaluated
+        with one vectorized call for all the commodities. If profile is
+        set, the time of the predictions of each commodity is profiled.
+        """
+        commods = list(self.commodity_dict)
+        predicted = [commod for commod in commods if not self.driven(commod)]
+        times = None
+        if self.profile:
+            times = [0.] * (len(commods) + len(predicted))
+        predictions = predict_batch(
+            [self.provided_predictors[commod] for commod in commods] +
+            [self.required_predictors[commod] for commod in predicted],
+            self.executor, times)
+        step.provided = dict(zip(commods, predictions[:len(commods)]))
+        step.required = dict(zip(predicted, predictions[len(commods):]))
+        if self.profile:
+            for commod, seconds in zip(commods + predicted, times):
+                self.profiler.add('forecast', commod, seconds)
+        for commod in commods:
+            if commod not in step.required:
+                step.required[commod] = self.drive(commod, step.time)
+
+    def stage_diff(self, step):
+        """
+        Calculates the difference between the provided and required
+        amounts of all the commodities and records the predictions. With
+        a lookahead horizon, also calculates the lowest difference over
+        the horizon.
+        """
+        if self.lookahead > 0:
+            retired = self.retirement_ledger(step.time)
+        for commod in self.commodity_dict:
+            diff, provided, required = self.calc_diff(
+                commod, step.provided[commod], step.required[commod])
+            if self.lookahead > 0:
+                step.planned[commod] = self.plan_diff(
+                    commod, step.time, step.provided[commod],
+                    step.required[commod], retired[commod])
+            step.diff[commod] = diff
+            step.required[commod] = required
+            lib.record_time_series('calc_' + self.provided_label + commod,
+                                   self, provided)
+            lib.record_time_series('calc_' + self.required_label + commod,
+                                   self, required)
+
+    def stage_deploy(self, step):
+        """
+        Deploys facilities for the commodities whose provided amount
+        does not meet the required amount, and updates the installed
+        capacity. If profile is set, the time of each commodity is
+        profiled.
+        """
+        time = step.time
+        for commod in self.commodity_dict:
+            start = perf_counter()
+            diff = step.diff[commod]
+            if diff < 0:
+                # the builds of the last timesteps may cover the lack
+                diff = step.planned.get(commod, diff)
+            built = 0.
+            if diff < 0:
+                if self.installed_cap:
+                    deploy_dict, self.commodity_dict = solver.deploy_solver(
+                        self.installed_capacity, self.commodity_dict, commod,
+                        diff, time, self.deploy_method)
+                else:
+                    deploy_dict, self.commodity_dict = solver.deploy_solver(
+                        self.commodity_supply, self.commodity_dict, commod,
+                        diff, time, self.deploy_method)
+                for proto, num in deploy_dict.items():
+                    self.schedule_builds(proto, num)
+                step.deployed[commod] = deploy_dict
+                # update installed capacity dict
+                self.installed_capacity[commod][time + 1] = \
+                    self.installed_capacity[commod][time]
+                for proto, num in deploy_dict.items():
+                    built += self.commodity_dict[commod][proto]['cap'] * num
+                self.installed_capacity[commod][time + 1] += built
+            else:
+                self.installed_capacity[commod][time + 1] = \
+                    self.installed_capacity[commod][time]
+            self.pending[commod].append(built)
+            if self.profile:
+                self.profiler.add('deploy', commod, perf_counter() - start)
+
+    def schedule_builds(self, proto, num):
+        """
+        Schedules the builds of num facilities of a prototype and records
+        them in the d3ploy_deployed table, as one row of the prototype
+        and the number of facilities.
+        """
+        if num <= 0:
+            return
+        for i in range(num):
+            self.context.schedule_build(self, proto)
+        self.record_row('d3ploy_deployed', [('Prototype', proto, ts.STRING),
+                                            ('Count', int(num), ts.INT)])
+
+    def record_row(self, table, fields):
+        """
+        Records a row of the id of the institution, the current time and
+        the fields, a list of (name, value, type), in a table of the
+        output.
+        """
+        datum = self.context.new_datum(table)
+        datum.add_val('AgentId', self.id(), type=ts.INT)
+        datum.add_val('Time', self.context.time, type=ts.INT)
+        for name, value, type_ in fields:
+            datum.add_val(name, value, type=type_)
+        datum.record()
+
+    def stage_decommission(self, step):
+        """
+        Decommissions the oldest facilities of the commodities that have
+        been oversupplied for more than os_time timesteps, and removes
+        the capacity of the facilities exiting the simulation from the
+        installed capacity.
+        """
+        time = step.time
+        for commod in self.commodity_dict:
+            diff = step.planned.get(commod, step.diff[commod])
+            os_limit = self.commod_mins[commod] * self.os_int
+            if diff > os_limit:
+                self.commod_os[commod] += 1
+            else:
+                self.commod_os[commod] = 0
+            if diff > os_limit and self.commod_os[commod] > self.os_time:
+                solver.decommission_oldest(self, self.commodity_dict[commod],
+                                           diff, commod, time)
+        for child in self.registry.exiting(time):
+            itscommod = self.fac_commod[child.prototype]
+            self.installed_capacity[itscommod][time + 1] -= \
+                self.commodity_dict[itscommod][child.prototype]['cap']
+
+    def stage_record(self, step):
+        """
+        Records the observed and predicted amounts of each commodity,
+        the difference, the installed capacity and the deployed
+        prototypes, if record is set.
+        """
+        if not self.record:
+            return
+        time = step.time
+        facilities = len(self.children)
+        for commod in self.commodity_dict:
+            deployed = ' '.join(
+                proto + ':' + str(num)
+                for proto, num in step.deployed.get(commod, {}).items())
+            self.recorder.append(commod, [
+                time, facilities,
+                self.provided_series(commod)[time],
+                self.required_series(commod)[time],
+                step.provided[commod], step.required[commod],
+                step.diff[commod],
+                self.installed_capacity[commod][time + 1],
+                deployed])
+        self.recorder.step(time)
+
+    def stage_profile(self, step):
+        """
+        Records the time spent in each stage and in each commodity of the
+        forecast and deploy stages in the d3ploy_timing table, and the
+        number of listener calls in the d3ploy_listener_calls table,
+        if profile is set. The commodity of the time of a whole stage
+        is empty.
+        """
+        for view, series in self.views:
+            self.profiler.count(view.name, view.calls())
+        times, commod_times, calls = self.profiler.step()
+        timing = [((stage, ''), seconds) for stage, seconds in times.items()]
+        for (stage, commod), seconds in timing + list(commod_times.items()):
+            self.record_row('d3ploy_timing', [
+                ('Stage', stage, ts.STRING),
+                ('Commodity', commod, ts.STRING),
+                ('CalcMethod', self.calc_method, ts.STRING),
+                ('Seconds', seconds, ts.DOUBLE)])
+        for name, n in calls.items():
+            self.record_row('d3ploy_listener_calls', [
+                ('TimeSeries', name, ts.STRING),
+                ('Calls', n, ts.INT)])
+
+    def calc_diff(self, commod, provided, required):
+        """
+        This function calculates the difference between the provided
+        and required amounts of a commodity.
+        Parameters
+        ----------
+        commod : str
+            The commodity the difference is calculated for.
+        provided : double
+            The predicted provided amount of the commodity.
+        required : double
+            The predicted required amount of the commodity, before the
+            buffer is added.
+        Returns
+        -------
+        diff : double
+            This is the difference between the provided and required
+            amounts.
+        provided : double
+            The provided amount of the commodity.
+        required : double
+            The required amount of the commodity, with the buffer.
+        """
+        if self.buffer_type_dict[commod] == 'rel':
+            required = required * (1 + self.buffer_dict[commod])
+        elif self.buffer_type_dict[commod] == 'abs':
+            required = required + self.buffer_dict[commod]
+        else:
+            raise Exception(
+                'You can only choose rel or abs types for buffer type')
+        diff = provided - required
+        return diff, provided, required
+
+    def retirement_ledger(self, time):
+        """
+        Returns, for each commodity, the capacity of the facilities
+        retired by the end of each timestep of the lookahead horizon,
+        from the exit times of the children.
+        """
+        exits = {commod: [0.] * self.lookahead
+                 for commod in self.commodity_dict}
+        for k in range(self.lookahead):
+            for child in self.registry.exiting(time + k):
+                commod = self.fac_commod.get(child.prototype)
+                if commod is not None:
+                    exits[commod][k] += \
+                        self.commodity_dict[commod][child.prototype]['cap']
+        return {commod: list(itertools.accumulate(retired))
+                for commod, retired in exits.items()}
+
+    def plan_diff(self, commod, time, provided, required, retired):
+        """
+        Returns the lowest difference between the provided and required
+        amounts of a commodity over the lookahead horizon. The capacity
+        deployed during the last lookahead timesteps is credited to the
+        provided amount, as far as the installed capacity exceeds it:
+        the facilities scheduled by the previous plans may not provide
+        their amount yet, and would otherwise be deployed again.
+        Parameters
+        ----------
+        commod : str
+            The commodity.
+        time : int
+            The current timestep.
+        provided : double
+            The predicted provided amount.
+        required : double
+            The predicted required amount, before the buffer is added.
+        retired : list of double
+            The capacity retired by the end of each timestep of the
+            horizon.
+        """
+        ahead = self.required_ahead(commod, time, required)
+        installed = self.installed_capacity[commod][time]
+        provided += min(sum(self.pending[commod]),
+                        max(installed - provided, 0.))
+        return min(self.calc_diff(commod, provided - retired[k],
+                                  ahead[k])[0]
+                   for k in range(self.lookahead))
+
+    def required_ahead(self, commod, time, required):
+        """
+        Returns the required amount of a commodity at each timestep of
+        the lookahead horizon, by default the predicted one.
+        """
+        return [required] * self.lookahead
+
+    def predictor(self, series, steps):
+        """
+        Returns the predictor of the calc method of the institution
+        for a time series.
+        """
+        return make_predictor(self.calc_method, series,
+                              steps=steps,
+                              back_steps=self.back_steps,
+                              degree=self.degree,
+                              std_dev=self.std_dev(),
+                              refit_interval=self.refit_interval,
+                              refit_tol=self.refit_tol)
+
+    def provided_steps(self):
+        """
+        Returns the number of timesteps forward the provided amount is
+        predicted.
+        """
+        return self.steps
+
+    def current_demand(self, commod, time):
+        """
+        Returns the demand of a commodity at `time` when no facility
+        reported it.
+        """
+        return 0.0
+
+    def driven(self, commod):
+        """
+        True if the required amount of the commodity is given by the
+        institution (see drive) instead of being predicted.
+        """
+        return False
+
+    @abc.abstractmethod
+    def drive(self, commod, time):
+        """
+        Returns the required amount of a driven commodity at the next
+        timestep.
+        """
+
+    @abc.abstractmethod
+    def provided_series(self, commod):
+        """
+        Returns the time series of the amount of a commodity provided
+        by the facilities.
+        """
+
+    @abc.abstractmethod
+    def required_series(self, commod):
+        """
+        Returns the time series of the amount of a commodity required.
+        """
+
+    @abc.abstractmethod
+    def buffer(self):
+        """
+        Returns the map of the buffers of the commodities.
+        """
+
+    @abc.abstractmethod
+    def std_dev(self):
+        """
+        Returns the standard deviation adjustment of the predictions.
+        """
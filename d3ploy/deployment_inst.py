@@ -11,6 +11,7 @@ import cyclus.typesystem as ts
 import d3ploy.solver as solver
 import d3ploy.NO_solvers as no
 import d3ploy.DO_solvers as do
+from d3ploy.expression import Expression
 
 
 def build_dict(
@@ -29,6 +30,8 @@ def build_dict(
             facility_dict[key].update({'pref': facility_pref[key]})
         else:
             facility_dict[key].update({'pref': '0'})
+        facility_dict[key].update(
+            {'pref_expr': Expression(facility_dict[key]['pref'])})
         if key in facility_constraintcommod.keys():
             facility_dict[key].update(
                 {'constraint_commod': facility_constraintcommod[key]})
@@ -13,6 +13,7 @@ import scipy as sp
 from cyclus.agents import Institution, Agent
 from cyclus import lib
 import cyclus.typesystem as ts
+from d3ploy.expression import Expression
 
 class DeterministicInst(Institution):
     """
@@ -51,6 +52,7 @@ class DeterministicInst(Institution):
         
     def enter_notify(self):
         super().enter_notify() 
+        self.demand_expr = Expression(self.demand_eq)
         for proto in self.prototypes:
             self.construct.append(0)
 
@@ -132,6 +134,5 @@ class DeterministicInst(Institution):
         -------
         demand : The calculated demand at a given timestep.
         """
-        t = time
-        demand = eval(self.demand_eq)
+        demand = self.demand_expr(time)
         return demand
@@ -0,0 +1,132 @@
+"""
+This file manages the equations given as strings to the D3ploy cyclus
+modules (demand equations and facility preferences). Equations are parsed
+once, checked against a whitelist of operations and compiled, and can then
+be evaluated for a scalar `t' or for a NumPy array of times in one call.
+"""
+import ast
+import math
+import numpy as np
+
+FUNCTIONS = {'exp', 'log', 'log10', 'log2', 'sqrt', 'sin', 'cos', 'tan',
+             'arcsin', 'arccos', 'arctan', 'asin', 'acos', 'atan', 'sinh',
+             'cosh', 'tanh', 'abs', 'absolute', 'fabs', 'floor', 'ceil',
+             'round', 'minimum', 'maximum', 'where', 'heaviside', 'sign',
+             'power', 'pow', 'pi', 'e'}
+
+NAMESPACE = {'np': np, 'numpy': np, 'math': math, 'pi': math.pi,
+             'e': math.e, 'abs': abs, 'min': min, 'max': max, 'pow': pow,
+             'round': round}
+
+_NODES = tuple(getattr(ast, name) for name in (
+    'Expression', 'BinOp', 'UnaryOp', 'BoolOp', 'Compare', 'IfExp',
+    'Call', 'Name', 'Load', 'Attribute', 'Constant',
+    'Add', 'Sub', 'Mult', 'Div', 'FloorDiv', 'Mod', 'Pow', 'USub', 'UAdd',
+    'And', 'Or', 'Not', 'Eq', 'NotEq', 'Lt', 'LtE', 'Gt', 'GtE'))
+
+
+class Expression(object):
+    """
+    A compiled equation of the time `t'.
+
+    Parameters
+    ----------
+    source: str
+        The equation, e.g. '1000*t' or '10000/(1+np.exp(t-40))'. It may
+        use `t', numbers, arithmetic and comparison operators and the
+        functions in FUNCTIONS (through `np.' or `math.' or directly).
+    """
+
+    def __init__(self, source):
+        self.source = str(source)
+        try:
+            tree = ast.parse(self.source.strip(), mode='eval')
+        except SyntaxError as err:
+            raise ValueError('Invalid equation %r: %s' % (self.source, err))
+        names = check(tree, self.source)
+        self.is_constant = 't' not in names
+        self._code = compile(tree, '<equation>', 'eval')
+        self._table = np.zeros(0)
+        if self.is_constant:
+            self._value = self._eval(0)
+
+    def _eval(self, t):
+        namespace = dict(NAMESPACE)
+        namespace['t'] = t
+        return eval(self._code, {'__builtins__': {}}, namespace)
+
+    def __call__(self, t):
+        """ Evaluates the equation at time(s) `t'. A scalar `t' gives the
+        same value as eval(source); an array gives a float array of the
+        same shape. """
+        if isinstance(t, (np.ndarray, list, tuple)):
+            return self.evaluate(np.asarray(t, dtype=float))
+        if self.is_constant:
+            return self._value
+        if 0 <= t < self._table.size and t == int(t):
+            return self._table[int(t)]
+        return self._eval(t)
+
+    def evaluate(self, times):
+        """ Evaluates the equation for an array of times in one call. """
+        times = np.asarray(times, dtype=float)
+        if self.is_constant:
+            return np.full(times.shape, self._value, dtype=float)
+        try:
+            values = self._eval(times)
+        except (TypeError, ValueError):
+            # math functions and conditionals only take scalars
+            values = [self._eval(t) for t in times.ravel()]
+            return np.array(values, dtype=float).reshape(times.shape)
+        return np.broadcast_to(
+            np.asarray(values, dtype=float), times.shape).copy()
+
+    @property
+    def table_size(self):
+        """ The number of timesteps for which values are precomputed. """
+        return self._table.size
+
+    def precompute(self, duration):
+        """ Evaluates the equation once for the timesteps
+        0, ..., duration - 1 so later scalar calls are table lookups. """
+        if not self.is_constant and duration > self._table.size:
+            self._table = self.evaluate(np.arange(duration))
+        return self._table
+
+
+def check(tree, source):
+    """ Checks that a parsed equation only uses whitelisted operations.
+
+    Parameters
+    ----------
+    tree: ast.Expression
+        the parsed equation
+    source: str
+        the equation, for error messages
+
+    Returns
+    -------
+    names: set
+        the bare names used in the equation
+    """
+    names = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _NODES):
+            raise ValueError('Operation %s is not allowed in equation %r'
+                             % (type(node).__name__, source))
+        if isinstance(node, ast.Attribute):
+            if (not isinstance(node.value, ast.Name) or
+                    node.value.id not in ('np', 'numpy', 'math') or
+                    node.attr not in FUNCTIONS):
+                raise ValueError('Attribute %r is not allowed in equation %r'
+                                 % (node.attr, source))
+        elif isinstance(node, ast.Name):
+            if node.id != 't' and node.id not in NAMESPACE:
+                raise ValueError('Name %r is not allowed in equation %r'
+                                 % (node.id, source))
+            names.add(node.id)
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, (ast.Name, ast.Attribute)):
+                raise ValueError('Call is not allowed in equation %r'
+                                 % source)
+    return names
@@ -0,0 +1,105 @@
+"""
+This file computes the metrics of the supply and demand of the
+commodities of simulation runs (cumulative undersupply and oversupply,
+chi2 goodness of fit and the number of timesteps supply is under demand)
+on arrays of aligned time series, one row per run, in one vectorized pass.
+"""
+import numpy as np
+
+METRICS = [('undersupply', float),
+           ('oversupply', float),
+           ('chi2', float),
+           ('under_count', int)]
+
+
+def align(all_dicts):
+    """ Aligns the supply and demand dictionaries of many runs on one
+    time grid.
+    Parameters
+    ----------
+    all_dicts: list of dict
+        dictionaries containing two timeseries dictionaries
+        (dict_supply and dict_demand), as returned by the tester
+        functions
+    Returns
+    -------
+    supply, demand: 2-D arrays
+        one row per run, one column per timestep, NaN where the
+        dictionary has no value
+    chi2_mask, count_mask: 2-D boolean arrays
+        the timesteps the chi2 goodness of fit and the number of
+        timesteps supply is under demand are computed over: from the
+        first timestep of the demand to the number of demand values,
+        and the first number of demand values timesteps
+    """
+    times = [np.fromiter(all_dict[key].keys(), dtype=float)
+             for all_dict in all_dicts
+             for key in ['dict_supply', 'dict_demand']]
+    end = int(max([t.max() for t in times if t.size] + [0])) + 2
+    shape = (len(all_dicts), end)
+    supply = np.full(shape, np.nan)
+    demand = np.full(shape, np.nan)
+    chi2_mask = np.zeros(shape, dtype=bool)
+    count_mask = np.zeros(shape, dtype=bool)
+    for i, all_dict in enumerate(all_dicts):
+        for key, array in [('dict_supply', supply), ('dict_demand', demand)]:
+            series = all_dict[key]
+            t = np.fromiter(series.keys(), dtype=float).astype(int)
+            array[i, t] = np.fromiter(series.values(), dtype=float,
+                                      count=len(series))
+        dict_demand = all_dict['dict_demand']
+        if dict_demand:
+            start = int(next(iter(dict_demand)))
+            chi2_mask[i, max(start, 0):len(dict_demand) + 1] = True
+            count_mask[i, :len(dict_demand)] = True
+    return supply, demand, chi2_mask, count_mask
+
+
+def evaluate(supply, demand, demand_driven=True, chi2_mask=None,
+             count_mask=None):
+    """ Computes the metrics of many runs at once.
+    Parameters
+    ----------
+    supply, demand: 2-D arrays (or 1-D for one run)
+        one row per run, one column per timestep, NaN where there is
+        no value
+    demand_driven: bool
+        if false, the number of timesteps supply is over demand is
+        counted instead of under demand
+    chi2_mask, count_mask: 2-D boolean arrays
+        the timesteps the chi2 goodness of fit and the number of
+        timesteps supply is under demand are computed over (all if None)
+    Returns
+    -------
+    table: structured array
+        one row per run, with the fields undersupply, oversupply, chi2
+        and under_count
+    """
+    supply = np.atleast_2d(np.asarray(supply, dtype=float))
+    demand = np.atleast_2d(np.asarray(demand, dtype=float))
+    both = ~np.isnan(supply) & ~np.isnan(demand)
+    diff = np.where(both, demand - supply, 0.)
+    if chi2_mask is None:
+        chi2_mask = np.ones(supply.shape, dtype=bool)
+    if count_mask is None:
+        count_mask = np.ones(supply.shape, dtype=bool)
+    table = np.zeros(supply.shape[0], dtype=METRICS)
+    table['undersupply'] = np.where(diff >= 0, diff, 0.).sum(axis=1)
+    table['oversupply'] = np.where(diff < 0, -diff, 0.).sum(axis=1)
+    fit = both & chi2_mask & (demand != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = np.where(fit, diff ** 2 / demand, 0.)
+    table['chi2'] = chi2.sum(axis=1)
+    if demand_driven:
+        under = diff > 0
+    else:
+        under = diff < 0
+    table['under_count'] = (under & both & count_mask).sum(axis=1)
+    return table
+
+
+def evaluate_dicts(all_dicts, demand_driven=True):
+    """ Computes the metrics of the supply and demand dictionaries of
+    many runs, see align and evaluate. """
+    supply, demand, chi2_mask, count_mask = align(all_dicts)
+    return evaluate(supply, demand, demand_driven, chi2_mask, count_mask)
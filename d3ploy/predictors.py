@@ -0,0 +1,725 @@
+"""
+This file manages the stateful predictors of the D3ploy cyclus modules.
+A predictor is bound to one time series (the supply, demand or capacity
+history of one commodity) and keeps the state of its calc method between
+timesteps, so that each timestep only the new observations are ingested
+instead of refitting from the whole history.
+"""
+import functools
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import statsmodels.api as sm
+import statsmodels.tsa.holtwinters as hw
+from arch import arch_model
+
+import d3ploy.NO_solvers as no
+import d3ploy.DO_solvers as do
+import d3ploy.ML_solvers as ml
+from d3ploy.timeseries import as_array
+
+# the last values of a series can still be updated by the listeners
+# (and the installed capacity by the institution), so they are not
+# folded into the running state until they are this old
+FREEZE_LAG = 2
+
+# a warm started exponential smoothing fit whose smoothing parameter is
+# this close to 0 or 1 is stuck on a bound and is fitted again from scratch
+BOUND_TOL = 1e-4
+
+
+class Predictor(object):
+    """
+    Base class of the stateful predictors.
+
+    Parameters
+    ----------
+    series: TimeSeries
+        The time series the predictor forecasts.
+    steps: int
+        The number of timesteps forward to predict.
+    back_steps: int
+        The number of values used for the prediction (all if 0).
+    degree: int
+        The degree of the fitting polynomial (or the period of
+        sw_seasonal).
+    std_dev: float
+        The standard deviation adjustment of the prediction.
+    refit_interval: int
+        The number of timesteps between refits of the fitted models.
+    refit_tol: float
+        Refit the arma and arch models early when the latest value is
+        more than this many standard deviations away from its one step
+        prediction (never if 0).
+    """
+
+    def __init__(self, series, steps=1, back_steps=5, degree=1, std_dev=0.,
+                 refit_interval=1, refit_tol=0.):
+        self.series = series
+        self.steps = steps
+        self.back_steps = back_steps
+        self.degree = degree
+        self.std_dev = std_dev
+        self.refit_interval = refit_interval
+        self.refit_tol = refit_tol
+
+    # fitting the model is expensive enough to be worth predicting
+    # in a worker process of predict_batch
+    parallel = False
+
+    def predict(self):
+        """ Returns the prediction of the series `steps` ahead. """
+        raise NotImplementedError
+
+    def window(self):
+        """ Returns the values the prediction is made from. """
+        return self.series.tail(self.back_steps)
+
+    def history(self):
+        """ Returns the number of last values of the series the
+        predictor reads, or 0 if it reads the whole series. """
+        return self.back_steps
+
+    def reads(self):
+        """ Returns the number of last values of the series the next
+        prediction reads, or 0 if it reads the whole series. """
+        return self.history()
+
+    def detached(self):
+        """ Returns a copy of the predictor whose series only holds the
+        values the next prediction reads. This is what is sent to the
+        worker processes of predict_batch. """
+        copy = object.__new__(type(self))
+        copy.__dict__.update(self.__dict__)
+        copy.series = self.series.recent(self.reads())
+        return copy
+
+    def batch_key(self):
+        """ Returns a key shared by the predictors whose windows can be
+        predicted together with predict_batch, or None if the prediction
+        can not be batched this timestep. """
+        return None
+
+    def batch_window(self):
+        """ Returns the row of the predictor in the 2-D array given to
+        predict_batch, its window by default. """
+        return self.window()
+
+    def predict_batch(self, windows):
+        """ Returns the predictions of the rows of the 2-D array
+        `windows`, made with the parameters of this predictor. """
+        raise NotImplementedError
+
+
+class StatelessPredictor(Predictor):
+    """
+    Predictor calling a calc method on the whole series every timestep.
+    The arguments of the calc method are bound once, when the predictor
+    is made.
+    """
+
+    def __init__(self, calc_method, series, **kwargs):
+        super().__init__(series, **kwargs)
+        self.calc_method = calc_method
+        func = STATELESS[calc_method]
+        if calc_method in ['arma', 'ma', 'arch']:
+            self.func = functools.partial(func, series, steps=self.steps,
+                                          std_dev=self.std_dev,
+                                          back_steps=self.back_steps)
+        elif calc_method in ['poly', 'exp_smoothing', 'holt_winters',
+                             'fft']:
+            self.func = functools.partial(func, series,
+                                          back_steps=self.back_steps,
+                                          degree=self.degree,
+                                          steps=self.steps)
+        else:
+            self.func = functools.partial(func, series, period=self.degree)
+
+    def predict(self):
+        return self.func()
+
+    def history(self):
+        if self.calc_method == 'sw_seasonal':
+            return 0
+        return self.back_steps
+
+
+class MovingAverage(Predictor):
+    """
+    Moving average of the last `back_steps` values. When all values are
+    used (back_steps=0), a running sum is kept instead of summing the
+    whole history every timestep.
+    """
+
+    def __init__(self, series, **kwargs):
+        super().__init__(series, **kwargs)
+        self.frozen = 0
+        self.frozen_sum = 0.
+
+    def batch_key(self):
+        if self.back_steps > 0:
+            return (MovingAverage, min(self.back_steps, len(self.series)))
+        return None
+
+    def predict_batch(self, windows):
+        return windows.mean(axis=1)
+
+    def predict(self):
+        if self.back_steps > 0 or not self.series.is_dense():
+            return no.predict_ma(self.series, back_steps=self.back_steps)
+        values = as_array(self.series)
+        n = len(values)
+        frozen_to = n - FREEZE_LAG
+        if frozen_to > self.frozen:
+            self.frozen_sum += values[self.frozen:frozen_to].sum()
+            self.frozen = frozen_to
+        return (self.frozen_sum + values[self.frozen:].sum()) / n
+
+
+class PolyFit(Predictor):
+    """
+    Least squares polynomial fit of the last `back_steps` values.
+
+    For a window of fixed length the prediction is a fixed linear
+    combination of the values in the window, so the weights are computed
+    once per window length and each timestep costs one dot product. When
+    all values are used (back_steps=0), running sums of the normal
+    equations are kept instead.
+    """
+
+    def __init__(self, series, **kwargs):
+        super().__init__(series, **kwargs)
+        self.weights = {}
+        self.frozen = 0
+        self.frozen_xy = np.zeros(self.degree + 1)
+        self.frozen_xx = np.zeros(2 * self.degree + 1)
+
+    def window_weights(self, w):
+        if w not in self.weights:
+            # fit in window coordinates scaled to (0, 1], the prediction
+            # does not depend on the affine change of the time coordinate
+            u = np.arange(1, w + 1) / w
+            lhs = np.vander(u, self.degree + 1)
+            at = np.vander([(w + self.steps) / w], self.degree + 1)
+            self.weights[w] = (at @ np.linalg.pinv(lhs))[0]
+        return self.weights[w]
+
+    def batch_key(self):
+        w = min(self.back_steps, len(self.series))
+        if w > self.degree:
+            return (PolyFit, w, self.degree, self.steps)
+        return None
+
+    def predict_batch(self, windows):
+        return windows @ self.window_weights(windows.shape[1])
+
+    def predict(self):
+        n = len(self.series)
+        if self.back_steps > 0:
+            w = min(self.back_steps, n)
+        else:
+            w = n
+        if w <= self.degree or (self.back_steps == 0 and
+                                not self.series.is_dense()):
+            return do.polyfit_regression(self.series,
+                                         back_steps=self.back_steps,
+                                         degree=self.degree, steps=self.steps)
+        if self.back_steps > 0:
+            return float(self.window_weights(w) @
+                         self.series.tail(self.back_steps))
+        return self.predict_all(as_array(self.series))
+
+    def moments(self, values, start, stop):
+        x = np.arange(start + 1, stop + 1, dtype=float)
+        xy = np.vander(x, self.degree + 1, increasing=True).T @ \
+            values[start:stop]
+        xx = np.vander(x, 2 * self.degree + 1, increasing=True).sum(axis=0)
+        return xy, xx
+
+    def predict_all(self, values):
+        n = len(values)
+        frozen_to = n - FREEZE_LAG
+        if frozen_to > self.frozen:
+            xy, xx = self.moments(values, self.frozen, frozen_to)
+            self.frozen_xy += xy
+            self.frozen_xx += xx
+            self.frozen = frozen_to
+        xy, xx = self.moments(values, self.frozen, n)
+        xy += self.frozen_xy
+        xx += self.frozen_xx
+        # solve the normal equations with the time scaled by n
+        k = np.arange(self.degree + 1)
+        scale = float(n) ** -k
+        gram = np.array([xx[j:j + self.degree + 1] for j in k])
+        gram *= np.outer(scale, scale)
+        coef = np.linalg.lstsq(gram, xy * scale, rcond=None)[0]
+        return float(coef @ (((n + self.steps) / n) ** k))
+
+
+class Fft(Predictor):
+    """
+    Extrapolation of the harmonics of the last `back_steps` values,
+    like fft. The windows of many series are predicted at once with
+    fft_batch.
+    """
+
+    def predict(self):
+        return do.fft(self.series, back_steps=self.back_steps,
+                      degree=self.degree, steps=self.steps)
+
+    def batch_key(self):
+        if self.back_steps > 0:
+            return (Fft, min(self.back_steps, len(self.series)),
+                    self.degree, self.steps)
+        return None
+
+    def predict_batch(self, windows):
+        return do.fft_batch(windows, degree=self.degree, steps=self.steps)
+
+
+class ExpSmoothing(Predictor):
+    """
+    Simple exponential smoothing. The model is refitted every
+    `refit_interval` timesteps, each fit starting from the parameters of
+    the previous one. In between, the level is updated recursively with
+    the fitted smoothing parameter as new values come in. Like the
+    running sums of MA and Poly, the level only folds in the values
+    older than FREEZE_LAG, and the latest values are applied on top of
+    it at each prediction. With refit_interval=1 the model is cold
+    fitted every timestep like exp_smoothing. Between refits, the levels
+    of many series are updated at once by predict_batch.
+    """
+
+    model = hw.SimpleExpSmoothing
+    parallel = True
+
+    def __init__(self, series, **kwargs):
+        super().__init__(series, **kwargs)
+        self.alpha = None
+        # the level after the first `frozen` values of the series
+        self.frozen = 0
+        self.frozen_level = np.nan
+        self.fit_n = 0
+        # the initial level and the window of the last fit
+        self.initial = np.nan
+        self.window_start = np.zeros(0)
+
+    def warm(self):
+        """ True if the next fit starts from the last fitted parameters.
+        With refit_interval=1 every fit is a cold fit, as in the
+        stateless calc methods. """
+        return (self.alpha is not None and self.refit_interval > 1 and
+                np.isfinite(self.frozen_level))
+
+    def smooth(self, level, values):
+        """ Returns the level updated with the values, in order. """
+        alpha = self.alpha
+        for y in values:
+            level = alpha * y + (1 - alpha) * level
+        return level
+
+    def fit(self):
+        v = self.series.tail(self.back_steps)
+        timeseries = do.smoothing_window(v)
+        model = self.model(timeseries)
+        try:
+            if not self.warm():
+                raise ValueError('no previous fit')
+            # the level starts where the last fit had smoothed the values
+            # the window slid over since then
+            slid = max(len(self.window_start) + len(self.series) -
+                       self.fit_n - len(timeseries), 0)
+            start = self.smooth(self.initial, self.window_start[:slid])
+            model_fit = model.fit(start_params=[self.alpha, start],
+                                  use_brute=False)
+            alpha = model_fit.params['smoothing_level']
+            if not (BOUND_TOL < alpha < 1 - BOUND_TOL):
+                # stuck on a bound, search the parameters again
+                raise ValueError('smoothing parameter on a bound')
+        except (TypeError, ValueError):
+            model_fit = model.fit()
+        self.alpha = model_fit.params['smoothing_level']
+        self.initial = model_fit.params['initial_level']
+        self.window_start = timeseries
+        n = len(self.series)
+        latest = min(FREEZE_LAG, len(v))
+        self.frozen_level = self.smooth(
+            self.initial, timeseries[:len(timeseries) - latest])
+        self.frozen = n - latest
+        self.fit_n = n
+        x = model_fit.predict(len(timeseries), len(timeseries) +
+                              self.steps - 1)
+        return x[-1]
+
+    def refit_due(self):
+        return (self.alpha is None or not np.isfinite(self.frozen_level) or
+                len(self.series) - self.fit_n >= self.refit_interval)
+
+    def unfrozen(self):
+        """ Folds the values older than FREEZE_LAG into the frozen level
+        and returns the later values. """
+        n = len(self.series)
+        values = self.series.tail(n - self.frozen)
+        frozen_to = n - FREEZE_LAG
+        if frozen_to > self.frozen:
+            self.frozen_level = self.smooth(
+                self.frozen_level, values[:frozen_to - self.frozen])
+            values = values[frozen_to - self.frozen:]
+            self.frozen = frozen_to
+        return values
+
+    def predict(self):
+        if self.refit_due():
+            return self.fit()
+        values = self.unfrozen()
+        return self.smooth(self.frozen_level, values)
+
+    def batch_key(self):
+        if self.refit_due():
+            return None
+        n = len(self.series)
+        return (ExpSmoothing, min(n - self.frozen, FREEZE_LAG))
+
+    def batch_window(self):
+        values = self.unfrozen()
+        return np.concatenate([[self.alpha, self.frozen_level], values])
+
+    def predict_batch(self, windows):
+        """ Returns the levels of the rows of `windows`: the smoothing
+        parameter, the frozen level and the later values of a series. """
+        alpha = windows[:, 0]
+        level = windows[:, 1]
+        for y in windows[:, 2:].T:
+            level = alpha * y + (1 - alpha) * level
+        return level
+
+    def reads(self):
+        if self.back_steps <= 0:
+            return 0
+        # the values after the frozen level update it
+        return max(self.back_steps, len(self.series) - self.frozen)
+
+
+class HoltWinters(ExpSmoothing):
+    """
+    Holt-Winters exponential smoothing, with the same refitting and
+    recursive updates as ExpSmoothing. As configured by holt_winters the
+    model has no trend or seasonal component, so its level is updated
+    like the one of simple exponential smoothing.
+    """
+
+    model = hw.ExponentialSmoothing
+
+
+class RefitPredictor(Predictor):
+    """
+    Base class of the predictors of fitted models that are refitted every
+    `refit_interval` timesteps (or earlier, when the latest value drifts
+    more than `refit_tol` standard deviations from its one step
+    prediction), each fit starting from the parameters of the previous
+    one. In between, the forecast is updated by filtering the new values
+    with the fitted parameters. With refit_interval=1 and refit_tol=0 the
+    model is cold fitted every timestep like the stateless calc method.
+    """
+
+    # errors of the fits that fall back to the moving average
+    errors = (ValueError, np.linalg.LinAlgError)
+    parallel = True
+
+    def __init__(self, series, **kwargs):
+        super().__init__(series, **kwargs)
+        self.params = None
+        self.fit_n = 0
+        self.one_step = None
+        self.scale = 0.
+
+    def warm(self):
+        """ True if the next fit starts from the last fitted parameters.
+        With refit_interval=1 every fit is a cold fit, as in the
+        stateless calc methods. """
+        return self.params is not None and self.refit_interval > 1
+
+    def refit_due(self, v):
+        n = len(self.series)
+        if self.params is None or n - self.fit_n >= self.refit_interval:
+            return True
+        if self.refit_tol > 0 and self.one_step is not None:
+            drift = abs(v[-1] - self.one_step)
+            return drift > self.refit_tol * self.scale
+        return False
+
+    def fallback(self):
+        """ Returns the prediction used when the fit fails. """
+        return no.predict_ma(self.series, self.steps, self.std_dev,
+                             self.back_steps)
+
+    def predict(self):
+        v = self.window()
+        try:
+            if self.refit_due(v):
+                x = self.fit(v)
+                self.fit_n = len(self.series)
+            else:
+                x = self.filter(v)
+        except self.errors:
+            x = np.nan
+        if math.isnan(x):
+            self.params = None
+            self.one_step = None
+            x = self.fallback()
+        return x
+
+    def fit(self, v):
+        """ Fits the model to the window `v` and returns the forecast. """
+        raise NotImplementedError
+
+    def filter(self, v):
+        """ Returns the forecast of the window `v` with the parameters
+        of the last fit. """
+        raise NotImplementedError
+
+
+class Arma(RefitPredictor):
+    """
+    ARMA(1, 0) model of predict_arma, refitted with warm starts. Between
+    refits the AR(1) forecast and its standard error are computed in
+    closed form from the last fitted parameters.
+    """
+
+    def fit(self, v):
+        model = sm.tsa.ARMA(v, (1, 0))
+        if self.warm():
+            fit = model.fit(disp=-1, start_params=self.params)
+        else:
+            fit = model.fit(disp=-1)
+        self.params = np.asarray(fit.params)
+        self.sigma2 = fit.sigma2
+        self.scale = math.sqrt(self.sigma2)
+        return self.filter(v)
+
+    def filter(self, v):
+        mu, phi = self.params
+        h = np.arange(self.steps)
+        forecast = mu + phi ** (h + 1) * (v[-1] - mu)
+        stderr = np.sqrt(self.sigma2 * np.cumsum(phi ** (2 * h)))
+        self.one_step = forecast[0]
+        return forecast[-1] + stderr[-1] * self.std_dev
+
+
+class Arch(RefitPredictor):
+    """
+    Constant mean GARCH model of predict_arch, refitted with warm starts.
+    Between refits the forecast is made by filtering the window with the
+    last fitted parameters instead of maximizing the likelihood again.
+    """
+
+    errors = (Exception,)
+
+    def fit(self, v):
+        model = arch_model(v)
+        if self.warm():
+            fit = model.fit(disp="off", show_warning=False,
+                            starting_values=self.params)
+        else:
+            fit = model.fit(disp="off", show_warning=False)
+        self.params = np.asarray(fit.params)
+        self.scale = np.std(v)
+        return self.mean(v, fit.forecast(horizon=self.steps))
+
+    def filter(self, v):
+        model = arch_model(v)
+        return self.mean(v, model.forecast(self.params, horizon=self.steps))
+
+    def mean(self, v, forecast):
+        step = 'h.' + str(self.steps)
+        # the mean of the constant mean model is the same at every horizon
+        self.one_step = self.params[0]
+        return forecast.mean.get(step)[len(v) - self.steps]
+
+
+class StepwiseSeasonal(RefitPredictor):
+    """
+    Seasonal ARIMA model of stepwise_seasonal. The stepwise search for
+    the model order is only run every `refit_interval` timesteps (or
+    earlier, when the one step prediction error exceeds `refit_tol`
+    standard deviations of the in-sample residuals). In between, the
+    selected model is updated with the new values.
+    """
+
+    errors = (Exception,)
+
+    def window(self):
+        return as_array(self.series)
+
+    def history(self):
+        return 0
+
+    def fallback(self):
+        return no.predict_ma(self.series)
+
+    def fit(self, v):
+        if len(v) == 1:
+            raise ValueError('stepwise_seasonal needs two values')
+        self.model = ml.select_model(v, self.degree)
+        self.params = self.model.order + self.model.seasonal_order
+        self.scale = np.std(self.model.resid())
+        self.n = len(v)
+        return self.forecast()
+
+    def filter(self, v):
+        if len(v) > self.n:
+            self.model.update(v[self.n:])
+            self.n = len(v)
+        return self.forecast()
+
+    def forecast(self):
+        self.one_step = self.model.predict(n_periods=1)[-1]
+        return self.one_step
+
+
+STATELESS = {'ma': no.predict_ma,
+             'arma': no.predict_arma,
+             'arch': no.predict_arch,
+             'poly': do.polyfit_regression,
+             'exp_smoothing': do.exp_smoothing,
+             'holt_winters': do.holt_winters,
+             'fft': do.fft,
+             'sw_seasonal': ml.stepwise_seasonal}
+
+PREDICTORS = {'ma': MovingAverage,
+              'arma': Arma,
+              'arch': Arch,
+              'sw_seasonal': StepwiseSeasonal,
+              'poly': PolyFit,
+              'fft': Fft,
+              'exp_smoothing': ExpSmoothing,
+              'holt_winters': HoltWinters}
+
+
+def make_predictor(calc_method, series, **kwargs):
+    """ Returns the predictor of `series` for a calc method.
+
+    Parameters
+    ----------
+    calc_method: str
+        One of the calc methods of the deployment institutions.
+    series: TimeSeries
+        The time series to predict.
+    kwargs:
+        The parameters of Predictor.
+    """
+    if calc_method in PREDICTORS:
+        return PREDICTORS[calc_method](series, **kwargs)
+    elif calc_method in STATELESS:
+        return StatelessPredictor(calc_method, series, **kwargs)
+    raise ValueError('The input calc_method is not valid. Check again.')
+
+
+def make_executor(workers):
+    """ Returns a process pool of `workers` processes for predict_batch,
+    or None if `workers` is 0. The institution shuts the pool down at
+    the end of the simulation.
+
+    The workers are started from a fresh python interpreter (with the
+    forkserver method, or spawn where it is not available) instead of
+    being forked from the cyclus process, which holds the kernel and its
+    threads. They only receive the predictors and their windows.
+
+    Parameters
+    ----------
+    workers: int
+        The number of worker processes.
+    """
+    if workers <= 0:
+        return None
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+    else:
+        context = multiprocessing.get_context('spawn')
+    context.set_executable(interpreter())
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+def interpreter():
+    """ Returns the python interpreter the worker processes are started
+    with: the one running the program, or the python3 of the path if
+    the program is not a python interpreter (e.g. cyclus). """
+    name = os.path.basename(sys.executable or '')
+    if name.startswith('python'):
+        return sys.executable
+    return shutil.which('python3') or shutil.which('python')
+
+
+def forecast(predictor):
+    """ Returns the prediction of a detached predictor together with its
+    state, updated by the prediction, except the series, and the time the
+    prediction took. This is what the worker processes of predict_batch
+    run. """
+    start = time.perf_counter()
+    x = predictor.predict()
+    seconds = time.perf_counter() - start
+    state = dict(vars(predictor))
+    del state['series']
+    return x, state, seconds
+
+
+def predict_batch(predictors, executor=None, times=None):
+    """ Returns the predictions of a list of predictors. The windows of
+    the predictors that share a batch key are stacked into a 2-D array
+    and predicted with one vectorized call, the others are predicted one
+    by one. If an executor is given, the predictors of the fitted models
+    are predicted in its worker processes, which are only sent the
+    values each predictor reads. Each predictor is given the same values
+    in a worker as in this process, and the results are collected in
+    order, so the predictions do not depend on the executor.
+
+    Parameters
+    ----------
+    predictors: list of Predictor
+        The predictors, e.g. of the supply of every commodity of an
+        institution.
+    executor: concurrent.futures.Executor
+        The process pool of the institution, or None.
+    times: list of float
+        If given, filled with the time spent on each predictor. The time
+        of a vectorized call is split evenly between its predictors, the
+        time of a prediction in a worker is measured in the worker.
+    """
+    predictions = [None] * len(predictors)
+    if times is None:
+        times = [0.] * len(predictors)
+    groups = {}
+    futures = {}
+    for i, predictor in enumerate(predictors):
+        start = time.perf_counter()
+        key = predictor.batch_key()
+        if key is not None:
+            groups.setdefault(key, []).append(i)
+        elif executor is not None and predictor.parallel:
+            futures[i] = executor.submit(forecast, predictor.detached())
+        else:
+            predictions[i] = predictor.predict()
+        times[i] = time.perf_counter() - start
+    for indexes in groups.values():
+        start = time.perf_counter()
+        if len(indexes) == 1:
+            predictions[indexes[0]] = predictors[indexes[0]].predict()
+        else:
+            windows = np.stack([predictors[i].batch_window()
+                                for i in indexes])
+            batch = predictors[indexes[0]].predict_batch(windows)
+            for i, x in zip(indexes, batch):
+                predictions[i] = float(x)
+        share = (time.perf_counter() - start) / len(indexes)
+        for i in indexes:
+            times[i] += share
+    for i, future in futures.items():
+        predictions[i], state, seconds = future.result()
+        predictors[i].__dict__.update(state)
+        times[i] += seconds
+    return predictions
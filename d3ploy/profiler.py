@@ -0,0 +1,97 @@
+"""
+This file contains the profiler of the deployment institutions. The
+profiler times the stages of decision(), and the forecast and deployment
+of each commodity, and counts the calls of the time series listeners of
+an institution each timestep, and writes a summary of the whole run to a
+JSON file when the institution tears down at the end of the simulation. An institution only wraps its stages with the
+profiler, and has the calls of its listeners counted, if profiling is
+enabled, so it costs nothing otherwise.
+"""
+import json
+import time
+
+
+class Profiler(object):
+    """
+    Timer of the stages and of the commodities of the stages, and
+    counter of the listener calls of an institution.
+
+    Parameters
+    ----------
+    file_name: str
+        The name of the file of the summary.
+    info: dict
+        Written in the summary, e.g. the calc method of the institution.
+    """
+
+    def __init__(self, file_name, info=None):
+        self.file_name = file_name
+        self.info = dict(info or {})
+        self.step_times = {}
+        # keyed by (stage, commodity)
+        self.step_commod_times = {}
+        self.step_calls = {}
+        self.total_times = {}
+        self.total_commod_times = {}
+        self.total_calls = {}
+        self.steps = 0
+
+    def timed(self, name, func):
+        """ Returns func, adding the time it takes to the time of name """
+        def run(*args):
+            start = time.perf_counter()
+            result = func(*args)
+            self.step_times[name] = (self.step_times.get(name, 0.) +
+                                     time.perf_counter() - start)
+            return result
+        return run
+
+    def add(self, name, commod, seconds):
+        """ Adds seconds to the time of a commodity in the stage name """
+        key = (name, commod)
+        self.step_commod_times[key] = (self.step_commod_times.get(key, 0.) +
+                                       seconds)
+
+    def count(self, name, n):
+        """ Adds n calls of the listeners of the time series name """
+        if n:
+            self.step_calls[name] = self.step_calls.get(name, 0) + n
+
+    def step(self):
+        """ Ends a timestep and returns the time of each stage, the time
+        of each commodity in the stages, keyed by (stage, commodity), and
+        the number of calls of each listener during the timestep """
+        times, self.step_times = self.step_times, {}
+        commod_times, self.step_commod_times = self.step_commod_times, {}
+        calls, self.step_calls = self.step_calls, {}
+        for name, seconds in times.items():
+            self.total_times[name] = self.total_times.get(name, 0.) + seconds
+        for key, seconds in commod_times.items():
+            self.total_commod_times[key] = (
+                self.total_commod_times.get(key, 0.) + seconds)
+        for name, n in calls.items():
+            self.total_calls[name] = self.total_calls.get(name, 0) + n
+        self.steps += 1
+        return times, commod_times, calls
+
+    def summary(self):
+        steps = max(self.steps, 1)
+        summary = dict(self.info)
+        summary.update({
+            'steps': self.steps,
+            'total_time': sum(self.total_times.values()),
+            'stages': {name: {'total': seconds, 'mean': seconds / steps}
+                       for name, seconds in self.total_times.items()},
+            'commodities': {},
+            'listener_calls': dict(self.total_calls)})
+        for (name, commod), seconds in self.total_commod_times.items():
+            summary['commodities'].setdefault(name, {})[commod] = {
+                'total': seconds, 'mean': seconds / steps}
+        return summary
+
+    def write(self):
+        """ Writes the summary of the run """
+        if self.steps == 0:
+            return
+        with open(self.file_name, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
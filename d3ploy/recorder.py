@@ -0,0 +1,70 @@
+"""
+This file contains the recorder of the deployment institutions. The
+recorder keeps the rows recorded each timestep in memory and writes them
+to one CSV file per commodity in bulk, every `interval` timesteps and
+when the institution flushes it at the end of the simulation, instead of
+opening a file for every row.
+"""
+import csv
+
+
+class Recorder(object):
+    """
+    Buffered writer of the rows of the commodities of an institution.
+
+    Parameters
+    ----------
+    prefix: str
+        Appended to the commodity name to make the file name, e.g. the
+        id of the institution, so that institutions sharing a commodity
+        write separate files.
+    columns: list of str
+        The names of the columns of the rows.
+    interval: int
+        The number of timesteps between writes. If 0, the rows are only
+        written by flush.
+    """
+
+    def __init__(self, prefix, columns, interval=100):
+        self.prefix = prefix
+        self.columns = list(columns)
+        self.interval = interval
+        self.rows = {}
+        self.written = set()
+        self.last_flush = None
+
+    def file_name(self, commod):
+        return commod + self.prefix + '.csv'
+
+    def append(self, commod, row):
+        """ Buffers a row of a commodity. """
+        self.rows.setdefault(commod, []).append(row)
+
+    def step(self, time):
+        """ Writes the buffered rows if `interval` timesteps have passed
+        since the last write. """
+        if self.last_flush is None:
+            self.last_flush = time
+        if self.interval > 0 and time - self.last_flush >= self.interval:
+            self.flush()
+            self.last_flush = time
+
+    def flush(self):
+        """ Writes the buffered rows to the files of the commodities. The
+        first write of a file replaces its content and writes the header.
+        """
+        for commod, rows in self.rows.items():
+            if not rows:
+                continue
+            name = self.file_name(commod)
+            if name in self.written:
+                mode = 'a'
+            else:
+                mode = 'w'
+            with open(name, mode, newline='') as f:
+                writer = csv.writer(f)
+                if mode == 'w':
+                    writer.writerow(self.columns)
+                writer.writerows(rows)
+            self.written.add(name)
+            self.rows[commod] = []
@@ -0,0 +1,88 @@
+"""
+This file contains the registry of the facilities deployed by the
+deployment institutions. It indexes the children of an institution by
+prototype and by exit time, so that the facilities exiting at a timestep
+and the oldest facilities of a commodity are found without scanning all
+the children.
+"""
+import heapq
+from collections import OrderedDict
+
+
+class ChildRegistry(object):
+    """
+    Index of the children of an institution, maintained from the
+    build and decommission notifications of the institution.
+
+    The children of each prototype are kept in the order they entered
+    the simulation, and the children are bucketed by the timestep they
+    exit the simulation (children with an infinite lifetime are not
+    bucketed).
+    """
+
+    def __init__(self):
+        # prototype -> agent id -> agent, in enter order
+        self.protos = {}
+        # exit time -> agent id -> agent
+        self.exits = {}
+        # agent id -> exit time the agent is bucketed at
+        self.exit_times = {}
+
+    def __len__(self):
+        return len(self.exit_times)
+
+    def __contains__(self, agent):
+        return agent.id() in self.exit_times
+
+    def add(self, agent):
+        """ Registers a child that entered the simulation. """
+        agent_id = agent.id()
+        if agent_id in self.exit_times:
+            return
+        proto = str(agent.prototype)
+        self.protos.setdefault(proto, OrderedDict())[agent_id] = agent
+        self.exit_times[agent_id] = None
+        self.reschedule(agent)
+
+    def remove(self, agent):
+        """ Removes a child that was decommissioned. """
+        agent_id = agent.id()
+        if agent_id not in self.exit_times:
+            return
+        self.unschedule(agent_id)
+        del self.exit_times[agent_id]
+        proto = str(agent.prototype)
+        del self.protos[proto][agent_id]
+        if not self.protos[proto]:
+            del self.protos[proto]
+
+    def reschedule(self, agent):
+        """ Moves a child to the bucket of its exit time, e.g. after its
+        lifetime was changed. """
+        agent_id = agent.id()
+        self.unschedule(agent_id)
+        exit_time = agent.exit_time
+        if exit_time >= 0:
+            self.exits.setdefault(exit_time, {})[agent_id] = agent
+            self.exit_times[agent_id] = exit_time
+
+    def unschedule(self, agent_id):
+        exit_time = self.exit_times.get(agent_id)
+        if exit_time is None:
+            return
+        del self.exits[exit_time][agent_id]
+        if not self.exits[exit_time]:
+            del self.exits[exit_time]
+        self.exit_times[agent_id] = None
+
+    def exiting(self, time):
+        """ Returns the children that exit the simulation at `time`. """
+        return list(self.exits.get(time, {}).values())
+
+    def oldest(self, protos):
+        """ Iterates over the children of the prototypes `protos`, from
+        the oldest to the newest. """
+        children = [self.protos[proto].values() for proto in protos
+                    if proto in self.protos]
+        return heapq.merge(*children,
+                           key=lambda agent: (agent.enter_time, agent.id()))
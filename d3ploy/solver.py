@@ -3,15 +3,19 @@ import copy
 import math
 from collections import defaultdict
 from collections import OrderedDict
+from functools import lru_cache
 import numpy as np
 
+from d3ploy.expression import Expression
+
 """
 This solver.py file contains auxillary functions that
 aid `timeseries_inst.py'.
 """
 
 
-def deploy_solver(commodity_supply, commodity_dict, commod, diff, time):
+def deploy_solver(commodity_supply, commodity_dict, commod, diff, time,
+                  method='greedy'):
     """ This function optimizes prototypes to deploy to minimize over
         deployment of prototypes.
     Paramters:
@@ -35,6 +39,11 @@ def deploy_solver(commodity_supply, commodity_dict, commod, diff, time):
         lack in supply
     time: int
         time of evaluation
+    method: str
+        how facilities with the same preference and no sharing are
+        deployed: 'greedy' deploys the largest prototypes first and
+        'optimal' minimizes the overshoot and then the number of
+        deployed prototypes
 
     Returns:
     --------
@@ -84,19 +93,60 @@ def deploy_solver(commodity_supply, commodity_dict, commod, diff, time):
                     # it gets in here if there is a share percentage defined
                     return sharing_deploy(update_proto_commod, diff), \
                         commodity_dict
-                else:
+                elif method == 'optimal':
+                    return optimal_deployment(update_proto_commod,
+                                              diff), commodity_dict
+                elif method == 'greedy':
                     # otherwise it minimizes the deployment
                     return minimize_number_of_deployment(update_proto_commod,
                                                          diff), commodity_dict
+                else:
+                    raise ValueError('The deploy method must be greedy '
+                                     'or optimal.')
+
+
+# number of timesteps ahead for which time dependent preferences
+# are evaluated at once
+PREF_HORIZON = 100
+
+
+def preference_expr(val_dict):
+    """ Returns the compiled preference equation of a prototype, which
+    build_dict stores in its dictionary (compiled and stored there on
+    the first call otherwise). """
+    if 'pref_expr' not in val_dict:
+        val_dict['pref_expr'] = Expression(val_dict['pref'])
+    return val_dict['pref_expr']
 
 
 def evaluate_preference(proto_commod, time):
-    t = time
+    """ Evaluates the preference of each prototype at `time`. Constant
+        preferences are evaluated once, and time dependent preferences
+        are evaluated for the next PREF_HORIZON timesteps at once and
+        looked up afterwards.
+    Parameters:
+    ----------
+    proto_commod: dictionary
+        key: prototype name
+        value: dictionary
+            key: 'cap', 'pref', 'constraint_commod', 'constraint', 'share'
+            value
+    time: int
+        time of evaluation
+
+    Returns:
+    --------
+    eval_pref_fac: dictionary
+        key: prototype name
+        value: preference value
+    """
     eval_pref_fac = {}
     for proto, val_dict in proto_commod.items():
-        t = time
-        pref = eval(val_dict['pref'])
-        eval_pref_fac[proto] = pref
+        expr = preference_expr(val_dict)
+        if (not expr.is_constant and time == int(time) and
+                expr.table_size <= time):
+            expr.precompute(int(time) + PREF_HORIZON)
+        eval_pref_fac[proto] = expr(time)
     return eval_pref_fac
 
 
@@ -139,18 +189,9 @@ def preference_deploy(proto_commod, pref_fac, diff):
                    key=pref_fac.get, reverse=True)[0]
     if pref_fac[proto] < 0:
         return deploy_dict
-    if diff >= proto_commod[proto]['cap']:
-        deploy_dict[proto] = 1
-        diff -= proto_commod[proto]['cap']
-        while diff > proto_commod[proto]['cap']:
-            deploy_dict[proto] += 1
-            diff -= proto_commod[proto]['cap']
-        if diff == 0:
-            return deploy_dict
-        else:
-            deploy_dict[proto] += 1
-    elif diff > 0:
-        deploy_dict[proto] = 1
+    if diff > 0:
+        # the number of prototypes whose capacity meets diff
+        deploy_dict[proto] = ceil_div(diff, proto_commod[proto]['cap'])
     return deploy_dict
 
 
@@ -180,12 +221,12 @@ def minimize_number_of_deployment(proto_commod, remainder):
     key_list = sorted(cap_dict, key=cap_dict.get, reverse=True)
     for proto in key_list:
         # if diff still smaller than the proto capacity,
-        if remainder >= proto_commod[proto]['cap']:
-            deploy_dict[proto] = 1
-            remainder -= proto_commod[proto]['cap']
-            while remainder > proto_commod[proto]['cap']:
-                deploy_dict[proto] += 1
-                remainder -= proto_commod[proto]['cap']
+        cap = proto_commod[proto]['cap']
+        if remainder >= cap:
+            # deploy until the remainder is at most one prototype
+            # capacity, so it can be met by a smaller prototype
+            deploy_dict[proto] = max(1, ceil_div(remainder, cap) - 1)
+            remainder -= deploy_dict[proto] * cap
     if remainder == 0:
         return deploy_dict
 
@@ -201,6 +242,124 @@ def minimize_number_of_deployment(proto_commod, remainder):
     return deploy_dict
 
 
+# the largest deficit, in capacity units, for which optimal_deployment
+# is solved exactly
+MAX_UNITS = 10 ** 6
+
+
+def optimal_deployment(proto_commod, remainder):
+    """ This function deploys facilities to meet the lack in capacity
+    with the least overshoot and, among the deployments with the least
+    overshoot, the least number of facilities.
+
+    The capacities are discretized in units of their greatest common
+    divisor if they are all integers (the solution is then exact), or
+    of a hundredth of the smallest capacity otherwise, rounding the
+    capacities down and the remainder up, so that the deployment always
+    meets the remainder. As the rounding can add overshoot, the greedy
+    deployment (minimize_number_of_deployment) is returned instead when
+    its actual capacities overshoot less.
+
+    Parameters
+    ----------
+    proto_commod: dictionary
+        key: prototype name
+        value: dictionary
+            key: 'cap', 'pref', 'constraint_commod', 'constraint', 'share'
+            value
+    remainder: float
+        amount of capacity that is needed
+
+    Returns:
+    --------
+    deploy_dict: dictionary
+        key: prototype name
+        value: number of prototype to deploy
+    """
+    if remainder <= 0:
+        return {}
+    protos = sorted(proto_commod)
+    caps = [proto_commod[proto]['cap'] for proto in protos]
+    if all(float(cap).is_integer() for cap in caps):
+        unit = float(np.gcd.reduce([int(cap) for cap in caps]))
+    else:
+        unit = min(caps) / 100.
+    units = tuple(max(1, int(math.floor(cap / unit + 1e-9)))
+                  for cap in caps)
+    counts = optimal_counts(units, ceil_div(remainder, unit))
+    deploy_dict = {proto: num for proto, num in zip(protos, counts)
+                   if num > 0}
+    greedy = minimize_number_of_deployment(proto_commod, remainder)
+    if deployment_cost(proto_commod, greedy) < \
+            deployment_cost(proto_commod, deploy_dict):
+        return greedy
+    return deploy_dict
+
+
+def deployment_cost(proto_commod, deploy_dict):
+    """ Returns the total capacity and the number of the facilities of
+    a deployment, which optimal_deployment minimizes in this order. """
+    return (sum(num * proto_commod[proto]['cap']
+                for proto, num in deploy_dict.items()),
+            sum(deploy_dict.values()))
+
+
+@lru_cache(maxsize=4096)
+def optimal_counts(units, deficit):
+    """ Returns the number of prototypes of each integer capacity in
+    `units` whose total capacity is the smallest one that meets
+    `deficit`, using the least number of prototypes.
+
+    Deficits above MAX_UNITS are first reduced by deploying the largest
+    prototype, and the rest is solved exactly.
+
+    Parameters
+    ----------
+    units: tuple of int
+        prototype capacities
+    deficit: int
+        amount of capacity that is needed
+
+    Returns:
+    --------
+    counts: list of int
+        number of prototypes of each capacity
+    """
+    largest = int(np.argmax(units))
+    pre = max(0, -(-(deficit - MAX_UNITS) // units[largest]))
+    deficit -= pre * units[largest]
+    # the least overshoot is smaller than the smallest capacity
+    size = deficit + min(units)
+    # fewest[s]: least number of prototypes whose total capacity is s,
+    # updated in place for each prototype so only one row is kept
+    fewest = np.full(size, np.inf)
+    fewest[0] = 0
+    for cap in units:
+        # any number of prototypes of capacity cap can be added: along
+        # each residue class modulo cap, take the running minimum of
+        # count - multiple and add the multiple back
+        rows = -(-size // cap)
+        grid = np.full(rows * cap, np.inf)
+        grid[:size] = fewest
+        grid = grid.reshape(rows, cap)
+        multiple = np.arange(rows)[:, np.newaxis]
+        grid = np.minimum.accumulate(grid - multiple, axis=0) + multiple
+        fewest = grid.ravel()[:size]
+    total = deficit + int(np.argmax(np.isfinite(fewest[deficit:])))
+    # walk back from total: num prototypes of capacity cap belong to a
+    # deployment with the fewest prototypes if removing them lowers the
+    # count by num, and once a capacity can not be removed it can not
+    # be removed further down either
+    counts = [0] * len(units)
+    for i, cap in enumerate(units):
+        num = np.arange(total // cap + 1)
+        counts[i] = int(np.count_nonzero(
+            fewest[total - num * cap] == fewest[total] - num)) - 1
+        total -= counts[i] * cap
+    counts[largest] += pre
+    return counts
+
+
 def find_mins(commod_dict):
     """ This function updates the commod_min
     dictionary to contain the minimum capacity facility
@@ -232,6 +391,12 @@ def decommission_oldest(agent, commod_dict, diff, commod, time):
     """ Decommissions the oldest agents that produce
         a capacity less than the difference. 
 
+        The agents are considered in the order they entered the
+        simulation (by id for the same entry time). Before the child
+        registry they were considered in the order of agent.children,
+        which cyclus does not sort by age, so the agents decommissioned,
+        and the deployments that follow, can differ from older versions.
+
     Parameters:
     ----------
     agent: cyclus institution
@@ -250,13 +415,16 @@ def decommission_oldest(agent, commod_dict, diff, commod, time):
         key: commodity
         value: min capacity
     """
-    for agt in agent.children:
-        if str(agt.prototype) not in commod_dict.keys():
-            continue
+    min_cap = min(val_dict['cap'] for val_dict in commod_dict.values())
+    for agt in agent.registry.oldest(commod_dict.keys()):
+        if diff <= min_cap:
+            # no remaining agent has a capacity less than the difference
+            break
         if commod_dict[agt.prototype]['cap'] < diff:
             life_x = time - agt.enter_time + 1
             try:
                 agt.lifetime_force(life_x)
+                agent.registry.reschedule(agt)
             except:
                 print('Could not adjust lifetime of agent ' + str(agt.id()))
             diff -= commod_dict[agt.prototype]['cap']
@@ -291,7 +459,33 @@ def sharing_deploy(proto_commod, remainder):
         remain[proto] = proto_dict['share'] * remainder / 100.0
         deploy_dict[proto] = 0
     for proto in remain:
-        while remain[proto] > 0:
-            deploy_dict[proto] += 1
-            remain[proto] -= proto_commod[proto]['cap']
+        if remain[proto] > 0:
+            deploy_dict[proto] = ceil_div(remain[proto],
+                                          proto_commod[proto]['cap'])
     return deploy_dict
+
+
+def ceil_div(amount, cap):
+    """ Returns the smallest number of prototypes of capacity `cap`
+    whose total capacity is at least `amount`.
+
+    Parameters:
+    ----------
+    amount: float
+        amount of capacity that is needed
+    cap: float
+        prototype capacity
+
+    Returns:
+    --------
+    num: int
+        number of prototypes
+    """
+    num = math.ceil(amount / cap)
+    # correct the rounding of the division, so that exact multiples
+    # of cap give exactly amount / cap prototypes
+    if (num - 1) * cap >= amount:
+        num -= 1
+    elif num * cap < amount:
+        num += 1
+    return num
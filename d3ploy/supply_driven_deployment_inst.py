@@ -6,131 +6,18 @@ than supply. Time series predicition methods can be used
 in this archetype.
 """
 
-import random
-import copy
-import math
-from collections import defaultdict
-import numpy as np
-import scipy as sp
-
-from cyclus.agents import Institution, Agent
-from cyclus import lib
 import cyclus.typesystem as ts
-import d3ploy.solver as solver
-import d3ploy.NO_solvers as no
-import d3ploy.DO_solvers as do
-import d3ploy.ML_solvers as ml
-import d3ploy.deployment_inst as di
-
-CALC_METHODS = {}
+import d3ploy.deployment_engine as engine
 
 
-class SupplyDrivenDeploymentInst(Institution):
+class SupplyDrivenDeploymentInst(engine.DeploymentEngine):
     """
     This institution deploys facilities based on demand curves using
     time series methods.
     """
 
-    facility_commod = ts.MapStringString(
-        doc="A map of facilities and each of their corresponding" +
-        " output commodities",
-        tooltip="Map of facilities and output commodities in the " +
-        "institution",
-        alias=['facility_commod', 'facility', 'commod'],
-        uilabel="Facility and Commodities"
-    )
-
-    facility_capacity = ts.MapStringDouble(
-        doc="A map of facilities and each of their corresponding" +
-        " capacities",
-        tooltip="Map of facilities and capacities in the " +
-        "institution",
-        alias=['facility_capacity', 'facility', 'capacity'],
-        uilabel="Facility and Capacities"
-    )
-
-    facility_pref = ts.MapStringString(
-        doc="A map of facilities and each of their corresponding" +
-        " preferences",
-        tooltip="Map of facilities and preferences in the " +
-        "institution",
-        alias=['facility_pref', 'facility', 'pref'],
-        uilabel="Facility and Preferences",
-        default={}
-    )
-
-    facility_constraintcommod = ts.MapStringString(
-        doc="A map of facilities and each of their corresponding" +
-        " constraint commodity",
-        tooltip="Map of facilities and constraint commodities in the " +
-        "institution",
-        alias=['facility_constraintcommod', 'facility', 'constraintcommod'],
-        uilabel="Facility and Constraint Commodities",
-        default={}
-    )
-
-    facility_constraintval = ts.MapStringDouble(
-        doc="A map of facilities and each of their corresponding" +
-        " constraint values",
-        tooltip="Map of facilities and constraint values in the " +
-        "institution",
-        alias=['facility_constraintval', 'facility', 'constraintval'],
-        uilabel="Facility and Constraint Commodity Values",
-        default={}
-    )
-
-    facility_sharing = ts.MapStringDouble(
-        doc="A map of facilities that share a commodity",
-        tooltip="Map of facilities and percentages of sharing",
-        alias=['facility_sharing', 'facility', 'percentage'],
-        uilabel="Facility and Percentages",
-        default={}
-    )
-
-    calc_method = ts.String(
-        doc="This is the calculated method used to determine " +
-        "the supply and capacity for the commodities of " +
-        "this institution. Currently this can be ma for " +
-        "moving average, or arma for autoregressive " +
-        "moving average.",
-        tooltip="Calculation method used to predict supply/capacity",
-        uilabel="Calculation Method"
-    )
-
-    record = ts.Bool(
-        doc="Indicates whether or not the institution " +
-        "should record it's output to text file outputs." +
-        "The output files match the name of the " +
-        "demand commodity of the institution.",
-        tooltip="Boolean to indicate whether or not to record output to text file.",
-        uilabel="Record to Text",
-        default=False)
-
-    installed_cap = ts.Bool(
-        doc="True if facility deployment is governed by installed capacity. " +
-        "False if deployment is governed by actual commodity capacity",
-        tooltip="Boolean to indicate whether or not to use installed" +
-                "capacity as supply",
-        uilabel="installed cap",
-        default=False)
-
-    steps = ts.Int(
-        doc="The number of timesteps forward to predict supply and capacity",
-        tooltip="The number of predicted steps forward",
-        uilabel="Timesteps for Prediction",
-        default=1
-    )
-
-    back_steps = ts.Int(
-        doc="This is the number of steps backwards " +
-            "from the current time step that will " +
-            "be used to make the prediction. If " +
-            "this is set to '0' then the calculation " +
-            "will use all values in the time series.",
-        tooltip="",
-        uilabel="Back Steps",
-        default=5
-    )
+    provided_label = 'capacity'
+    required_label = 'supply'
 
     capacity_std_dev = ts.Double(
         doc="The standard deviation adjustment for the capacity side.",
@@ -139,17 +26,6 @@ class SupplyDrivenDeploymentInst(Institution):
         default=0
     )
 
-    buffer_type = ts.MapStringString(
-        doc="Indicates whether the buffer is a relative or absolute value," +
-        "rel: % value, abs: double value, for each commodity",
-        tooltip="Capacity buffer as a rel or avs value for each commodity",
-        alias=[
-            'buffer_type',
-            'commod',
-            'type'],
-        uilabel="Capacity Buffer type",
-        default={})
-
     capacity_buffer = ts.MapStringDouble(
         doc="Capacity buffer size: relative or absolute value ",
         tooltip="Capacity buffer amount",
@@ -158,49 +34,10 @@ class SupplyDrivenDeploymentInst(Institution):
         default={}
     )
 
-    degree = ts.Int(
-        doc="The degree of the fitting polynomial.",
-        tooltip="The degree of the fitting polynomial, if using calc methods" +
-                " poly, fft, holtz-winter and exponential smoothing." +
-                " Additionally, degree is used to as the 'period' input to " +
-                "the stepwise_seasonal method.",
-        uilabel="Degree Polynomial Fit / Period for stepwise_seasonal",
-        default=1
-    )
-
-    os_time = ts.Int(
-        doc="The number of oversupply timesteps before decommission",
-        tooltip="",
-        uilabel="Oversupply Time Limit",
-        default=120
-    )
-
-    os_int = ts.Int(
-        doc="The number of facilities over capacity " +
-            "for a given commodity that is allowed. i.e If this" +
-            " value is 1. One facility capacity over demand is considered" +
-            " an oversupplied situtation.",
-        tooltip="",
-        uilabel="Oversupply Fac Limit",
-        default=1
-    )
-
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.commodity_capacity = {}
-        self.commodity_supply = {}
-        self.installed_capacity = {}
-        self.fac_commod = {}
-        self.commod_os = {}
-        self.fresh = True
-        CALC_METHODS['ma'] = no.predict_ma
-        CALC_METHODS['arma'] = no.predict_arma
-        CALC_METHODS['arch'] = no.predict_arch
-        CALC_METHODS['poly'] = do.polyfit_regression
-        CALC_METHODS['exp_smoothing'] = do.exp_smoothing
-        CALC_METHODS['holt_winters'] = do.holt_winters
-        CALC_METHODS['fft'] = do.fft
-        CALC_METHODS['sw_seasonal'] = ml.stepwise_seasonal
+        # the capacity of the commodities is reported as their demand
+        self.commodity_capacity = self.commodity_demand
 
     def print_variables(self):
         print('commodities: %s' % self.commodity_dict)
@@ -210,211 +47,21 @@ class SupplyDrivenDeploymentInst(Institution):
         print('back_steps: %i' % self.back_steps)
         print('capacity_std_dev: %f' % self.capacity_std_dev)
 
-    def enter_notify(self):
-        super().enter_notify()
-        if self.fresh:
-            # convert list of strings to dictionary
-            self.commodity_dict = di.build_dict(
-                self.facility_commod,
-                self.facility_capacity,
-                self.facility_pref,
-                self.facility_constraintcommod,
-                self.facility_constraintval,
-                self.facility_sharing)
-            for commod, proto_dict in self.commodity_dict.items():
-                self.commod_os[commod] = 0
-                protos = proto_dict.keys()
-                for proto in protos:
-                    self.fac_commod[proto] = commod
-            commod_list = list(self.commodity_dict.keys())
-            for commod in commod_list:
-                self.installed_capacity[commod] = defaultdict(float)
-                self.installed_capacity[commod][0] = 0.
-            for commod, commod_dict in self.commodity_dict.items():
-                tot = 0
-                for proto, proto_dict in commod_dict.items():
-                    tot += proto_dict['share']
-                if tot != 0 and tot != 100:
-                    print("Share preferences do not add to 100")
-                    raise Exception()
-            self.buffer_dict = di.build_buffer_dict(self.capacity_buffer,
-                                                    commod_list)
-            self.buffer_type_dict = di.build_buffer_type_dict(
-                self.buffer_type, commod_list)
-            for commod in self.commodity_dict:
-                # swap supply and demand for supply_inst
-                # change demand into capacity
-                lib.TIME_SERIES_LISTENERS["supply" +
-                                          commod].append(self.extract_supply)
-                lib.TIME_SERIES_LISTENERS["demand" +
-                                          commod].append(self.extract_capacity)
-                self.commodity_capacity[commod] = defaultdict(float)
-                self.commodity_supply[commod] = defaultdict(float)
-            self.commod_mins = solver.find_mins(self.commodity_dict)
-            for child in self.children:
-                itscommod = self.fac_commod[child.prototype]
-                self.installed_capacity[itscommod][0] += self.commodity_dict[itscommod][child.prototype]['cap']
-            self.fresh = False
-
-    def decision(self):
-        """
-        This is the tock method for decision the institution. Here the institution determines the difference
-        in supply and capacity and makes the the decision to deploy facilities or not.
-        """
-        time = self.context.time
-        for commod, proto_dict in self.commodity_dict.items():
-            diff, capacity, supply = self.calc_diff(commod, time)
-            lib.record_time_series('calc_supply' + commod, self, supply)
-            lib.record_time_series('calc_capacity' + commod, self, capacity)
-            if diff < 0:
-                if self.installed_cap:
-                    deploy_dict, self.commodity_dict = solver.deploy_solver(
-                        self.installed_capacity, self.commodity_dict, commod, diff, time)
-                else:
-                    deploy_dict, self.commodity_dict = solver.deploy_solver(
-                        self.commodity_supply, self.commodity_dict, commod, diff, time)
-                for proto, num in deploy_dict.items():
-                    for i in range(num):
-                        self.context.schedule_build(self, proto)
-                # update installed capacity dict
-                self.installed_capacity[commod][time + 1] = \
-                    self.installed_capacity[commod][time]
-                for proto, num in deploy_dict.items():
-                    self.installed_capacity[commod][time + 1] += \
-                        self.commodity_dict[commod][proto]['cap'] * num
-            else:
-                self.installed_capacity[commod][time +
-                                                1] = self.installed_capacity[commod][time]
-            os_limit = self.commod_mins[commod] * self.os_int
-            if diff > os_limit:
-                self.commod_os[commod] += 1
-            else:
-                self.commod_os[commod] = 0
-            if diff > os_limit and self.commod_os[commod] > self.os_time:
-                solver.decommission_oldest(self, self.commodity_dict[commod], diff, commod, time)
-            if self.record:
-                out_text = "Time " + str(time) + \
-                    " Deployed " + str(len(self.children))
-                out_text += " capacity " + \
-                    str(self.commodity_capacity[commod][time])
-                out_text += " supply " + \
-                    str(self.commodity_supply[commod][time]) + "\n"
-                with open(commod + ".txt", 'a') as f:
-                    f.write(out_text)
-        for child in self.children:
-            if child.exit_time == time:
-                itscommod = self.fac_commod[child.prototype]
-                self.installed_capacity[itscommod][time +
-                                                   1] -= self.commodity_dict[itscommod][child.prototype]['cap']
+    def provided_series(self, commod):
+        return self.commodity_capacity[commod]
 
-    def calc_diff(self, commod, time):
-        """
-        This function calculates the different in capacity and supply for a given facility
-        Parameters
-        ----------
-        time : int
-            This is the time step that the difference is being calculated for.
-        Returns
-        -------
-        diff : double
-            This is the difference between capacity and supply at [time]
-        capacity : double
-            The calculated capacity of the capacity commodity at [time].
-        supply : double
-            The calculated supply of the supply commodity at [time]
-        """
-        if time not in self.commodity_supply[commod]:
-            self.commodity_supply[commod][time] = 0.0
-        if time not in self.commodity_capacity[commod]:
-            self.commodity_capacity[commod][time] = 0.0
-        capacity = self.predict_capacity(commod)
-
-        if self.buffer_type_dict[commod] == 'rel':
-            supply = self.predict_supply(
-                commod, time) * (1 + self.buffer_dict[commod])
-        elif self.buffer_type_dict[commod] == 'abs':
-            supply = self.predict_supply(
-                commod, time) + self.buffer_dict[commod]
-        else:
-            raise Exception(
-                'You can only choose rel or abs types for buffer type')
-
-        diff = capacity - supply
-        return diff, capacity, supply
-
-    def predict_capacity(self, commod):
-        def target(incommod):
-            if self.installed_cap:
-                return self.installed_capacity[incommod]
-            else:
-                return self.commodity_capacity[incommod]
-        if self.calc_method in ['arma', 'ma', 'arch']:
-            capacity = CALC_METHODS[self.calc_method](target(commod),
-                                                      steps=self.steps,
-                                                      std_dev=self.capacity_std_dev,
-                                                      back_steps=self.back_steps)
-        elif self.calc_method in ['poly', 'exp_smoothing', 'holt_winters', 'fft']:
-            capacity = CALC_METHODS[self.calc_method](
-                target(commod), back_steps=self.back_steps, degree=self.degree)
-        elif self.calc_method in ['sw_seasonal']:
-            capacity = CALC_METHODS[self.calc_method](
-                target(commod), period=self.degree)
-        else:
-            raise ValueError(
-                'The input calc_method is not valid. Check again.')
-        return capacity
+    def required_series(self, commod):
+        return self.commodity_supply[commod]
 
-    def predict_supply(self, commod, time):
+    def provided_steps(self):
+        # the capacity has always been predicted one step forward
+        # with the poly, exp_smoothing, holt_winters and fft methods
         if self.calc_method in ['arma', 'ma', 'arch']:
-            supply = CALC_METHODS[self.calc_method](self.commodity_supply[commod],
-                                                    steps=self.steps,
-                                                    std_dev=self.capacity_std_dev,
-                                                    back_steps=self.back_steps)
-        elif self.calc_method in ['poly', 'exp_smoothing', 'holt_winters', 'fft']:
-            supply = CALC_METHODS[self.calc_method](self.commodity_supply[commod],
-                                                    back_steps=self.back_steps,
-                                                    degree=self.degree,
-                                                    steps=self.steps)
-        elif self.calc_method in ['sw_seasonal']:
-            supply = CALC_METHODS[self.calc_method](
-                self.commodity_supply[commod], period=self.degree)
-        else:
-            raise ValueError(
-                'The input calc_method is not valid. Check again.')
-        return supply
+            return self.steps
+        return 1
 
-    def extract_capacity(self, agent, time, value, commod):
-        """
-        Gather information on the available capacity of a commodity over the
-        lifetime of the simulation.
-        Parameters
-        ----------
-        agent : cyclus agent
-            This is the agent that is making the call to the listener.
-        time : int
-            Timestep that the call is made.
-        value : object
-            This is the value of the object being recorded in the time
-            series.
-        """
-        commod = commod[6:]
-        self.commodity_capacity[commod][time] += value
-        # update commodities
-        # self.commodity_dict[commod] = {agent.prototype: value}
+    def buffer(self):
+        return self.capacity_buffer
 
-    def extract_supply(self, agent, time, value, commod):
-        """
-        Gather information on the capacity of a commodity over the
-        lifetime of the simulation.
-        Parameters
-        ----------
-        agent : cyclus agent
-            This is the agent that is making the call to the listener.
-        time : int
-            Timestep that the call is made.
-        value : object
-            This is the value of the object being recorded in the time
-            series.
-        """
-        commod = commod[6:]
-        self.commodity_supply[commod][time] += value
+    def std_dev(self):
+        return self.capacity_std_dev
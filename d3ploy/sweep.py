@@ -0,0 +1,196 @@
+"""
+This file runs sweeps of cyclus simulations of a scenario over a grid of
+input parameters of the deployment institutions (e.g. calc_method,
+back_steps, steps, buffers, degree), a bounded number of simulations at a
+time, each in its own temporary directory, and computes the metrics of
+each run as soon as it finishes.
+"""
+import copy
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from d3ploy.metrics import METRICS, evaluate_dicts
+
+INSTITUTIONS = ['DemandDrivenDeploymentInst', 'SupplyDrivenDeploymentInst']
+
+# the names of the keys of the items of the map inputs
+MAP_KEYS = {'supply_buffer': ['commod', 'buffer'],
+            'capacity_buffer': ['commod', 'buffer']}
+
+
+def parameter_grid(**params):
+    """ Returns every combination of the values of the parameters
+    Parameters
+    ----------
+    params: lists of values of the parameters, e.g.
+        calc_method=['ma', 'poly'], back_steps=[2, 5]
+    Returns
+    -------
+    grid: list of dict
+    """
+    names = sorted(params)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[params[n] for n in names])]
+
+
+def input_value(name, value):
+    """ Converts a parameter to its value in a cyclus JSON input """
+    if isinstance(value, dict):
+        keys = MAP_KEYS.get(name, ['key', 'val'])
+        return {'item': [{keys[0]: k, keys[1]: str(v)}
+                         for k, v in value.items()]}
+    if isinstance(value, bool):
+        return str(int(value))
+    return str(value)
+
+
+def institutions(scenario):
+    """ Yields the configurations of the deployment institutions of a
+    scenario """
+    regions = scenario['simulation'].get('region', [])
+    if isinstance(regions, dict):
+        regions = [regions]
+    for region in regions:
+        insts = region.get('institution', [])
+        if isinstance(insts, dict):
+            insts = [insts]
+        for inst in insts:
+            for archetype, config in inst.get('config', {}).items():
+                if archetype in INSTITUTIONS:
+                    yield config
+
+
+def make_input(template, params):
+    """ Returns a copy of a scenario with the parameters set in all its
+    deployment institutions """
+    scenario = copy.deepcopy(template)
+    configs = list(institutions(scenario))
+    if not configs:
+        raise ValueError('The scenario has no deployment institution.')
+    for config in configs:
+        for name, value in params.items():
+            config[name] = input_value(name, value)
+    return scenario
+
+
+def input_hash(scenario):
+    """ Returns a hash of the canonical JSON of a scenario """
+    text = json.dumps(scenario, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def run_cyclus(scenario, output_file, cyclus=('cyclus',), env=None):
+    """ Runs a scenario in a temporary directory, so that the files
+    written during the simulation do not clash with the ones of other
+    runs, and moves its output database to output_file. """
+    with tempfile.TemporaryDirectory(prefix='d3ploy_') as tmp:
+        input_file = os.path.join(tmp, 'input.json')
+        with open(input_file, 'w') as f:
+            json.dump(scenario, f)
+        tmp_output = os.path.join(tmp, 'output.sqlite')
+        subprocess.check_output(list(cyclus) + ['-o', tmp_output, input_file],
+                                cwd=tmp, env=env, universal_newlines=True,
+                                stderr=subprocess.STDOUT)
+        # move to the output directory, then rename, so that an output
+        # file is never partially written
+        partial = output_file + '.' + os.path.basename(tmp)
+        shutil.move(tmp_output, partial)
+        os.replace(partial, output_file)
+    return output_file
+
+
+def sweep(template, grid, extract, output_dir='.', workers=None,
+          demand_driven=True, cyclus=('cyclus',), env=None, cache=None,
+          summary=None):
+    """ Runs a scenario for every set of parameters of a grid and yields
+    the metrics of each run as soon as it finishes.
+    Parameters
+    ----------
+    template: dict
+        the cyclus JSON input of the scenario
+    grid: list of dict
+        the parameters of the deployment institutions of each run, see
+        parameter_grid
+    extract: function
+        called with the name of an output file, returns the supply and
+        demand dictionaries of the commodity to evaluate, e.g.
+        lambda f: tester.supply_demand_dict_driving(f, '1000*t', 'fuel')
+    output_dir: str
+        directory of the output databases, named after the hash of their
+        input. The runs whose output is already there are not run again.
+        Not used if there is a cache.
+    workers: int
+        maximum number of simulations running at the same time (the
+        number of processors if None)
+    demand_driven: bool
+        passed to the metrics
+    cyclus: sequence of str
+        the command running cyclus
+    env: dict
+        environment of the simulations. By default the current one, with
+        the current directory in the PYTHONPATH.
+    cache: d3ploy.cache.Cache
+        cache of the output databases, only the runs which are not in the
+        cache are run
+    summary: str
+        name under which the metrics of the runs are stored in the
+        cache. The metrics found there are not computed again, so the name
+        should change with extract and demand_driven.
+    Yields
+    ------
+    params: dict
+        the parameters of the run
+    output_file: str
+        name of the output database
+    row: numpy record
+        the metrics of the run, see metrics.evaluate
+    """
+    if env is None:
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.getcwd() + ':' + env.get('PYTHONPATH', '')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if cache is None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    def run(params):
+        scenario = make_input(template, params)
+        if cache is None:
+            output_file = os.path.join(output_dir,
+                                       input_hash(scenario) + '.sqlite')
+            if not os.path.exists(output_file):
+                run_cyclus(scenario, output_file, cyclus, env)
+            return output_file, None
+        key = cache.key(scenario)
+        output_file = cache.get(key)
+        if output_file is None:
+            with tempfile.TemporaryDirectory(prefix='d3ploy_') as tmp:
+                output_file = os.path.join(tmp, 'output.sqlite')
+                run_cyclus(scenario, output_file, cyclus, env)
+                output_file = cache.put(key, output_file)
+        return output_file, key
+
+    # the simulations run in subprocesses, threads only wait for them
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run, params): params for params in grid}
+        for future in as_completed(futures):
+            output_file, key = future.result()
+            row = None
+            if key is not None and summary is not None:
+                row = cache.get_metrics(key, summary)
+            if row is None:
+                row = evaluate_dicts([extract(output_file)],
+                                     demand_driven)[0]
+                if key is not None and summary is not None:
+                    cache.put_metrics(key, summary, row.tolist())
+            else:
+                row = np.array(tuple(row), dtype=METRICS)[()]
+            yield futures[future], output_file, row
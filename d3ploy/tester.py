@@ -9,6 +9,9 @@ import glob
 import sys
 import numpy as np
 import operator
+from collections import OrderedDict
+from d3ploy.expression import Expression
+from d3ploy.metrics import evaluate_dicts
 
 
 def get_cursor(file_name):
@@ -26,6 +29,115 @@ def get_cursor(file_name):
     return con.cursor()
 
 
+# the time series of the output files loaded by load_timeseries, keyed
+# by the path, modification time and size of the file they were loaded
+# from, in least recently used order
+TIMESERIES_CACHE = OrderedDict()
+
+# the number of output files kept in TIMESERIES_CACHE, the least
+# recently used one is dropped when another file is loaded
+TIMESERIES_CACHE_SIZE = 8
+
+# the number of tables read by one compound query, below the sqlite
+# limit on the number of terms of a compound select
+TABLES_PER_QUERY = 250
+
+
+def load_timeseries(file_name):
+    """ Loads all the time series tables of an sqlite output file,
+    summing the values recorded at each time. The tables are read with
+    one compound query and the result is cached, so later calls for the
+    same file do not read it again (unless the file changed). Only the
+    last TIMESERIES_CACHE_SIZE files used are cached.
+    Parameters
+    ----------
+    file_name: str
+        name of the sqlite file
+    Returns
+    -------
+    timeseries: dict
+        key: table name without the 'timeseries' prefix, e.g. supplyPOWER
+        value: tuple of two arrays, the times (increasing) and the
+        summed values at those times
+    """
+    path = os.path.abspath(file_name)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key in TIMESERIES_CACHE:
+        TIMESERIES_CACHE.move_to_end(key)
+        return TIMESERIES_CACHE[key]
+    con = lite.connect(path)
+    tables = [row[0] for row in con.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' " +
+        "AND name LIKE 'timeseries%'")]
+    rows = []
+    for start in range(0, len(tables), TABLES_PER_QUERY):
+        query = ' UNION ALL '.join(
+            'SELECT %d, time, sum(value) FROM "%s" GROUP BY time' %
+            (indx, table) for indx, table in
+            enumerate(tables[start:start + TABLES_PER_QUERY], start))
+        rows += con.execute(query).fetchall()
+    con.close()
+    timeseries = {}
+    if rows:
+        data = np.array(rows, dtype=float)
+        data = data[np.lexsort((data[:, 1], data[:, 0]))]
+        splits = np.flatnonzero(np.diff(data[:, 0])) + 1
+        for block in np.split(data, splits):
+            name = tables[int(block[0, 0])][len('timeseries'):]
+            timeseries[name] = (block[:, 1].astype(int), block[:, 2])
+    for table in tables:
+        timeseries.setdefault(table[len('timeseries'):],
+                              (np.zeros(0, dtype=int), np.zeros(0)))
+    for stale in [k for k in TIMESERIES_CACHE if k[0] == path]:
+        del TIMESERIES_CACHE[stale]
+    TIMESERIES_CACHE[key] = timeseries
+    while len(TIMESERIES_CACHE) > TIMESERIES_CACHE_SIZE:
+        TIMESERIES_CACHE.popitem(last=False)
+    return timeseries
+
+
+def timeseries_dict(timeseries, name):
+    """ Returns a time series loaded by load_timeseries as a dictionary
+    Parameters
+    ----------
+    timeseries: dict
+        the time series of an output file
+    name: str
+        table name without the 'timeseries' prefix
+    Returns
+    -------
+    dict: key => time, value => summed value at time
+    """
+    if name not in timeseries:
+        raise lite.OperationalError('no such table: timeseries' + name)
+    times, values = timeseries[name]
+    return dict(zip(times.tolist(), values.tolist()))
+
+
+def deployments(sqlite):
+    """ Returns the number of facilities of each prototype the
+    deployment institutions scheduled to build at each timestep
+    Parameters
+    ----------
+    sqlite: sql file to analyze
+    Returns
+    -------
+    dict: key => prototype, value => dict of time => number of builds
+    """
+    cur = get_cursor(sqlite)
+    if not cur.execute("SELECT name FROM sqlite_master WHERE " +
+                       "type = 'table' AND name = 'd3ploy_deployed'"
+                       ).fetchall():
+        return {}
+    deployed = {}
+    for row in cur.execute('SELECT prototype, time, sum(count) ' +
+                           'FROM d3ploy_deployed ' +
+                           'GROUP BY prototype, time'):
+        deployed.setdefault(row[0], {})[row[1]] = row[2]
+    return deployed
+
+
 def supply_demand_dict_driving(sqlite, demand_eq, commod):
     """ Puts supply, demand, calculated demand and
     calculated supply into a nice dictionary format
@@ -42,45 +154,14 @@ def supply_demand_dict_driving(sqlite, demand_eq, commod):
     returns 4 dicts: dictionaries of supply, demand, calculated
     demand and calculated supply
     """
-    cur = get_cursor(sqlite)
-    tables = {}
-    tables[0] = "timeseriessupply" + commod
-    tables[1] = "timeseriescalc_demand" + commod
-    tables[2] = "timeseriescalc_supply" + commod
-    fuel_supply = cur.execute(
-        "select time, sum(value) from " +
-        tables[0] +
-        " group by time").fetchall()
-    calc_fuel_demand = cur.execute(
-        "select time, sum(value) from " +
-        tables[1] +
-        " group by time").fetchall()
-    calc_fuel_supply = cur.execute(
-        "select time, sum(value) from " +
-        tables[2] +
-        " group by time").fetchall()
-    dict_demand = {}
-    dict_supply = {}
-    dict_calc_demand = {}
-    dict_calc_supply = {}
-    for x in range(0, len(fuel_supply)):
-        dict_supply[fuel_supply[x][0]] = fuel_supply[x][1]
-    for x in range(0, len(calc_fuel_demand)):
-        dict_calc_demand[calc_fuel_demand[x][0]] = calc_fuel_demand[x][1]
-    for x in range(0, len(calc_fuel_supply)):
-        dict_calc_supply[calc_fuel_supply[x][0]] = calc_fuel_supply[x][1]
-    oldt = np.fromiter(dict_supply.keys(), dtype=float)
-    t = np.arange(0, oldt[-1] + 1)
-    fuel_demand = eval(demand_eq)
-    if isinstance(fuel_demand, int):
-        fuel_demand = fuel_demand * np.ones(len(t))
-    for x in range(0, len(t)):
-        dict_demand[t[x]] = fuel_demand[x]
-    
-    # give dict supply zeros at timesteps 1 and 2 
-    for key in dict_demand.keys():
-        if key not in dict_supply:
-            dict_supply[key] = 0.0
+    timeseries = load_timeseries(sqlite)
+    dict_supply = timeseries_dict(timeseries, "supply" + commod)
+    dict_calc_demand = timeseries_dict(timeseries, "calc_demand" + commod)
+    dict_calc_supply = timeseries_dict(timeseries, "calc_supply" + commod)
+    oldt = timeseries["supply" + commod][0]
+    t = np.arange(0, oldt[-1] + 1, dtype=float)
+    fuel_demand = Expression(demand_eq).evaluate(t)
+    dict_demand = dict(zip(t, fuel_demand))
 
     # give dict supply zeros at timesteps 1 and 2
     for key in dict_demand.keys():
@@ -112,48 +193,19 @@ def supply_demand_dict_nondriving(sqlite, commod, demand_driven):
     returns 4 dicts: dictionaries of supply, demand, calculated
     demand and calculated supply
     """
-    cur = get_cursor(sqlite)
-    tables = {}
-    tables[0] = "timeseriessupply" + commod
-    tables[2] = "timeseriescalc_supply" + commod
-    tables[3] = "timeseriesdemand" + commod
+    timeseries = load_timeseries(sqlite)
     if demand_driven:
-        tables[1] = "timeseriescalc_demand" + commod
+        calc_demand = "calc_demand" + commod
     else:
-        tables[1] = "timeseriescalc_capacity" + commod
-    fuel_demand = cur.execute(
-        "select time, sum(value) from " +
-        tables[3] +
-        " group by time").fetchall()
-    fuel_supply = cur.execute(
-        "select time, sum(value) from " +
-        tables[0] +
-        " group by time").fetchall()
-    calc_fuel_demand = cur.execute(
-        "select time, sum(value) from " +
-        tables[1] +
-        " group by time").fetchall()
-    calc_fuel_supply = cur.execute(
-        "select time, sum(value) from " +
-        tables[2] +
-        " group by time").fetchall()
-    dict_demand = {}
-    dict_supply = {}
-    dict_calc_demand = {}
-    dict_calc_supply = {}
-    for x in range(0, len(fuel_supply)):
-        dict_supply[fuel_supply[x][0]] = fuel_supply[x][1]
-    for x in range(0, len(calc_fuel_demand)):
-        dict_calc_demand[calc_fuel_demand[x][0]] = calc_fuel_demand[x][1]
-    for x in range(0, len(calc_fuel_supply)):
-        dict_calc_supply[calc_fuel_supply[x][0]] = calc_fuel_supply[x][1]
-
-    t = np.fromiter(dict_supply.keys(), dtype=float)
-    for x in range(0, len(t)):
-        dict_demand[t[x]] = 0
-
-    for x in range(0, len(fuel_demand)):
-        dict_demand[fuel_demand[x][0]] = fuel_demand[x][1]
+        calc_demand = "calc_capacity" + commod
+    fuel_demand = timeseries_dict(timeseries, "demand" + commod)
+    dict_supply = timeseries_dict(timeseries, "supply" + commod)
+    dict_calc_demand = timeseries_dict(timeseries, calc_demand)
+    dict_calc_supply = timeseries_dict(timeseries, "calc_supply" + commod)
+
+    t = timeseries["supply" + commod][0].astype(float)
+    dict_demand = dict.fromkeys(t, 0)
+    dict_demand.update(fuel_demand)
 
     # give dict supply zeros at timesteps 1 and 2
     for key in dict_demand.keys():
@@ -181,36 +233,19 @@ def supply_demand_dict_nond3ploy(sqlite, commod, demand_eq=0):
     -------
     returns 2 dicts: dictionaries of supply and demand
     """
-    cur = get_cursor(sqlite)
-    tables = {}
+    timeseries = load_timeseries(sqlite)
     all_dict = {}
 
-    tables[0] = "timeseriessupply" + commod
-    fuel_supply = cur.execute(
-        "select time, sum(value) from " +
-        tables[0] +
-        " group by time").fetchall()
-    dict_supply = {}
-    for x in range(0, len(fuel_supply)):
-        dict_supply[fuel_supply[x][0]] = fuel_supply[x][1]
+    dict_supply = timeseries_dict(timeseries, "supply" + commod)
     all_dict['dict_supply'] = dict_supply
 
-    dict_demand = {}
     if commod.lower() == 'power':
-        oldt = np.fromiter(dict_supply.keys(), dtype=float)
-        t = np.arange(0, oldt[-1] + 1)
-        fuel_demand = eval(demand_eq)
-        if isinstance(fuel_demand, int):
-            fuel_demand = fuel_demand * np.ones(len(t))
-        for x in range(0, len(t)):
-            dict_demand[t[x]] = fuel_demand[x]
+        oldt = timeseries["supply" + commod][0]
+        t = np.arange(0, oldt[-1] + 1, dtype=float)
+        fuel_demand = Expression(demand_eq).evaluate(t)
+        dict_demand = dict(zip(t, fuel_demand))
     else:
-        tables[1] = "timeseriesdemand" + commod
-        fuel_demand = cur.execute(
-            "select time, sum(value) from " + tables[1] +
-            " group by time").fetchall()
-        for x in range(0, len(fuel_demand)):
-            dict_demand[fuel_demand[x][0]] = fuel_demand[x][1]
+        dict_demand = timeseries_dict(timeseries, "demand" + commod)
     all_dict['dict_demand'] = dict_demand
 
     return all_dict
@@ -230,18 +265,7 @@ def cumulative_undersupply(all_dict):
         The cumulative difference between demand and supply
         if demand is larger than supply. 0 otherwise.
     """
-    dict_demand = all_dict['dict_demand']
-    dict_supply = all_dict['dict_supply']
-
-    cumulative = 0
-    for step in set().union(dict_demand.keys(), dict_supply.keys()):
-        try:
-            if dict_supply[step] <= dict_demand[step]:
-                cumulative += (dict_demand[step] - dict_supply[step])
-        except KeyError:
-            cumulative += 0
-
-    return cumulative
+    return float(evaluate_dicts([all_dict])['undersupply'][0])
 
 
 def cumulative_oversupply(all_dict):
@@ -260,18 +284,7 @@ def cumulative_oversupply(all_dict):
         The cumulative difference between supply and demand
         if supply is larger than demand. 0 otherwise.
     """
-    dict_demand = all_dict['dict_demand']
-    dict_supply = all_dict['dict_supply']
-
-    cumulative = 0
-    for step in set().union(dict_demand.keys(), dict_supply.keys()):
-        try:
-            if dict_supply[step] > dict_demand[step]:
-                cumulative += (dict_supply[step] - dict_demand[step])
-        except KeyError:
-            cumulative += 0
-
-    return cumulative
+    return float(evaluate_dicts([all_dict])['oversupply'][0])
 
 
 def chi_goodness_test(all_dict):
@@ -285,20 +298,7 @@ def chi_goodness_test(all_dict):
     returns an int of the chi2 (goodness of fit value) for
     the two input timeseries dictionaries
     """
-
-    dict_demand = all_dict['dict_demand']
-    dict_supply = all_dict['dict_supply']
-
-    chi2 = 0
-    start = int(list(dict_demand.keys())[0])
-    for x in range(start - 1, len(dict_demand)):
-        y = x + 1
-        try:
-            chi2 += (dict_supply[y] - dict_demand[y])**2 / dict_demand[y]
-        except (ZeroDivisionError, KeyError) as e:
-            chi2 += 0
-
-    return chi2
+    return float(evaluate_dicts([all_dict])['chi2'][0])
 
 
 def supply_under_demand(all_dict, demand_driven):
@@ -313,26 +313,8 @@ def supply_under_demand(all_dict, demand_driven):
     returns an int of the number of time steps supply is
     under demand
     """
-
-    dict_demand = all_dict['dict_demand']
-    dict_supply = all_dict['dict_supply']
-
-    num_under = 0
-
-    for x in range(len(dict_demand)):
-        if demand_driven:
-            try:
-                if dict_supply[x] < dict_demand[x]:
-                    num_under = num_under + 1
-            except KeyError:
-                num_under += 0
-        else:
-            try:
-                if dict_supply[x] > dict_demand[x]:
-                    num_under = num_under + 1
-            except KeyError:
-                num_under += 0
-    return num_under
+    table = evaluate_dicts([all_dict], demand_driven)
+    return int(table['under_count'][0])
 
 
 def best_calc_method(in_dict, maximum):
@@ -368,49 +350,85 @@ def metrics(all_dict, metric_dict, calc_method, commod, demand_driven):
         #metric_dict[commod+'_chi2'] = {}
         metric_dict[commod + '_undersupply'] = {}
 
+    # all the metrics are computed in one pass
+    row = evaluate_dicts([all_dict], demand_driven)[0]
     metric_dict[commod + '_cumulative_undersupply'][calc_method] = \
-        cumulative_undersupply(all_dict)
+        float(row['undersupply'])
     metric_dict[commod + '_cumualtive_oversupply'][calc_method] = \
-        cumulative_oversupply(all_dict)
+        float(row['oversupply'])
     metric_dict[commod + '_undersupply'][calc_method] = \
-        supply_under_demand(all_dict, demand_driven)
+        int(row['under_count'])
 
     return metric_dict
 
 
+def agent_timeline(sqlite_file, prototype_list):
+    """ Counts the agents of prototypes `at play' at every timestep
+    Parameters
+    ----------
+    sqlite_file: str
+        name of the sqlite file
+    prototype_list: list of str
+        names of the prototypes
+    Returns
+    -------
+    timeline: array
+        number of agents of each prototype (rows, in the order of
+        prototype_list) at each timestep from 0 to the duration of the
+        simulation (columns)
+    """
+    cur = get_cursor(sqlite_file)
+    duration = cur.execute('SELECT duration FROM info').fetchone()[0]
+    protos = list(dict.fromkeys(prototype_list))
+    params = ', '.join('?' * len(protos))
+    entries = ('SELECT prototype, entertime AS time, 1 AS delta ' +
+               'FROM agententry WHERE prototype IN (%s)' % params)
+    exits = ('SELECT prototype, exittime AS time, -1 AS delta ' +
+             'FROM agentexit INNER JOIN agententry ' +
+             'ON agententry.agentid = agentexit.agentid ' +
+             'WHERE prototype IN (%s)' % params)
+    query = ('SELECT prototype, time, sum(delta) FROM (%s) ' +
+             'GROUP BY prototype, time')
+    try:
+        rows = cur.execute(query % (entries + ' UNION ALL ' + exits),
+                           protos * 2).fetchall()
+    except lite.OperationalError:
+        # no agent has exited the simulation
+        rows = cur.execute(query % entries, protos).fetchall()
+    index = {proto: i for i, proto in enumerate(protos)}
+    rows_protos = np.array([index[row[0]] for row in rows], dtype=int)
+    times = np.array([row[1] for row in rows], dtype=int)
+    deltas = np.array([row[2] for row in rows], dtype=int)
+    timeline = count_timeline(rows_protos, times, deltas, len(protos),
+                              duration)
+    return timeline[[index[proto] for proto in prototype_list]]
+
+
+def count_timeline(protos, times, deltas, n_protos, duration):
+    """ Sums the entries (positive deltas) and exits (negative deltas) of
+    agents into the number of agents of each prototype at each timestep
+    from 0 to duration. Events outside of this range are ignored. """
+    width = duration + 1
+    inside = (times >= 0) & (times < width)
+    events = np.bincount(protos[inside] * width + times[inside],
+                         weights=deltas[inside], minlength=n_protos * width)
+    return np.cumsum(events.reshape(n_protos, width), axis=1).astype(int)
+
+
 def get_agent_dict(sqlite_file, prototype_list):
     """ returns a dictionary of the number of prototypes `at play'
         at any given timestep """
-    cur = get_cursor(sqlite_file)
+    timeline = agent_timeline(sqlite_file, prototype_list)
     agent_dict = {}
-    duration = cur.execute('SELECT duration FROM info').fetchone()[0]
-    for proto in prototype_list:
-        agententry = cur.execute(
-            'SELECT entertime FROM agententry WHERE prototype = "%s"' %
-            proto).fetchall()
-        entertime_list = [item['entertime'] for item in agententry]
-        try:
-            agentexit = cur.execute(
-                'SELECT exittime FROM agentexit ' +
-                'INNER JOIN agententry ON agententry.agentid = agentexit.agentid ' +
-                'WHERE prototype = "%s"' %
-                proto).fetchall()
-            exittime_list = [item['exittime'] for item in agentexit]
-        except BaseException:
-            exittime_list = []
-        agent_dict[proto] = agents_at_play(
-            entertime_list, exittime_list, duration)
+    for proto, counts in zip(prototype_list, timeline):
+        agent_dict[proto] = dict(enumerate(counts.tolist()))
     return agent_dict
 
 
 def agents_at_play(entertime_list, exittime_list, duration):
-    time_array = np.zeros(duration + 1)
-    atplay = 0
-    atplay_dict = {}
-    for indx, n in enumerate(time_array):
-        if indx in entertime_list:
-            atplay += entertime_list.count(indx)
-        if indx in exittime_list:
-            atplay -= exittime_list.count(indx)
-        atplay_dict[indx] = atplay
-    return atplay_dict
+    times = np.array(list(entertime_list) + list(exittime_list), dtype=int)
+    deltas = np.ones(len(times), dtype=int)
+    deltas[len(entertime_list):] = -1
+    counts = count_timeline(np.zeros(len(times), dtype=int), times, deltas,
+                            1, duration)[0]
+    return dict(enumerate(counts.tolist()))
@@ -0,0 +1,301 @@
+"""
+This file contains the growable, NumPy-backed time series used by the
+deployment institutions to store the supply, demand and capacity
+histories of their commodities.
+"""
+import csv
+import numpy as np
+
+
+class HistoryError(LookupError):
+    """ Raised when values older than the retained history of a time
+    series are requested. """
+    pass
+
+
+class TimeSeries(object):
+    """
+    A time series of doubles keyed by (non-negative) integer timestep.
+
+    Values are stored in a contiguous NumPy array that grows by doubling,
+    so appending a new timestep is amortized O(1) and reading the last
+    `n` values returns a view instead of a copy. The read API mirrors
+    the `defaultdict(float)` histories it replaces: `in`, `len`, `keys`,
+    `values` and `items` only see the timesteps that have been set, and
+    reading a timestep that has not been set returns 0.0 and sets it.
+
+    If `retain` is positive, only the last `retain` timesteps are kept:
+    instead of growing, the array slides forward and the older values
+    are dropped (and appended to the CSV file `spill`, if given). `len`
+    and `is_dense` still describe the whole series, but reading a
+    dropped value raises a HistoryError.
+    """
+
+    def __init__(self, capacity=64, retain=0, spill=None):
+        self._data = np.zeros(capacity)
+        self._mask = np.zeros(capacity, dtype=bool)
+        # timestep of the first element of the arrays
+        self._offset = 0
+        self._first = 0
+        self._end = 0
+        self._count = 0
+        # number of set timesteps which have been dropped
+        self._dropped = 0
+        self.retain = 0
+        self.spill = None
+        self._spilled = False
+        if retain > 0:
+            self.set_retention(retain, spill)
+
+    def set_retention(self, retain, spill=None):
+        """ Only keeps the last `retain` timesteps from now on (all of
+        them if `retain` is 0), appending the dropped values, and the kept
+        ones when spill_all is called, to the CSV file `spill` if it is
+        given. Once values are dropped, the retention can only be
+        widened. """
+        widened = self.retain > 0 and (retain == 0 or retain >= self.retain)
+        if (self._dropped or self._offset) and not widened:
+            raise HistoryError('the retention of a time series can only '
+                               'be narrowed before values are dropped')
+        self.retain = retain
+        size = self._data.size
+        if size < 2 * retain:
+            self._resize(2 * retain)
+        if spill is not None:
+            self.spill = spill
+
+    def _resize(self, size):
+        end = max(self._end - self._offset, 0)
+        data = np.zeros(size)
+        data[:end] = self._data[:end]
+        mask = np.zeros(size, dtype=bool)
+        mask[:end] = self._mask[:end]
+        self._data = data
+        self._mask = mask
+
+    def _reserve(self, time):
+        if time < self._offset:
+            if time < 0:
+                raise KeyError(time)
+            raise HistoryError('timestep %i is older than the %i retained '
+                               'timesteps' % (time, self.retain))
+        size = self._data.size
+        if time < self._offset + size:
+            return
+        if self.retain > 0:
+            self._drop(time + 1 - self.retain)
+            return
+        while self._offset + size <= time:
+            size *= 2
+        self._resize(size)
+
+    def _drop(self, start):
+        """ Drops the timesteps before `start`, moving the kept ones to
+        the beginning of the arrays. """
+        n = start - self._offset
+        end = max(self._end - self._offset, 0)
+        dropped = min(n, end)
+        if self.spill is not None:
+            self._write(0, dropped)
+        self._dropped += int(np.count_nonzero(self._mask[:dropped]))
+        if n < end:
+            self._data[:end - n] = self._data[n:end]
+            self._mask[:end - n] = self._mask[n:end]
+            self._data[end - n:end] = 0.
+            self._mask[end - n:end] = False
+        else:
+            self._data[:end] = 0.
+            self._mask[:end] = False
+        self._offset = start
+
+    def _write(self, start, stop):
+        """ Appends the set values between the array indexes start and
+        stop to the spill file. """
+        mask = self._mask[start:stop]
+        times = np.flatnonzero(mask) + start + self._offset
+        if self._spilled:
+            mode = 'a'
+        else:
+            mode = 'w'
+        with open(self.spill, mode, newline='') as f:
+            writer = csv.writer(f)
+            if mode == 'w':
+                writer.writerow(['time', 'value'])
+            writer.writerows(zip(times.tolist(),
+                                 self._data[start:stop][mask].tolist()))
+        self._spilled = True
+
+    def spill_all(self):
+        """ Appends the retained values to the spill file, so that it
+        holds the whole series. """
+        self._write(0, max(self._end - self._offset, 0))
+
+    def _set(self, time):
+        i = time - self._offset
+        if not self._mask[i]:
+            self._mask[i] = True
+            if self._count == 0 or time < self._first:
+                self._first = time
+            self._end = max(self._end, time + 1)
+            self._count += 1
+
+    def __setitem__(self, time, value):
+        time = int(time)
+        self._reserve(time)
+        self._data[time - self._offset] = value
+        self._set(time)
+
+    def add(self, time, value):
+        """ Adds value to the value at time, like `ts[time] += value`
+        but without converting the value twice when time is set. """
+        i = time - self._offset
+        if 0 <= i < self._end - self._offset and self._mask[i]:
+            self._data[i] += value
+        else:
+            self[time] = self.get(time, 0.0) + value
+
+    @property
+    def offset(self):
+        """ The oldest timestep which can still be read. """
+        return self._offset
+
+    def __getitem__(self, time):
+        time = int(time)
+        if time not in self:
+            self[time] = 0.0
+            return 0.0
+        return float(self._data[time - self._offset])
+
+    def __contains__(self, time):
+        try:
+            time = int(time)
+        except (TypeError, ValueError):
+            return False
+        return (self._offset <= time < self._end and
+                bool(self._mask[time - self._offset]))
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __repr__(self):
+        return 'TimeSeries(%r)' % dict(zip(self._retained_keys(),
+                                           self._retained().tolist()))
+
+    def is_dense(self):
+        """ True if every timestep between the first and last
+        set timestep has been set. """
+        return self._count == self._end - self._first
+
+    def get(self, time, default=None):
+        if time in self:
+            return float(self._data[int(time) - self._offset])
+        return default
+
+    def _retained_dense(self):
+        start = max(self._first, self._offset)
+        return self._count - self._dropped == self._end - start
+
+    def _retained_keys(self):
+        if self._retained_dense():
+            return list(range(max(self._first, self._offset), self._end))
+        end = max(self._end - self._offset, 0)
+        return (np.flatnonzero(self._mask[:end]) + self._offset).tolist()
+
+    def _retained(self):
+        end = max(self._end - self._offset, 0)
+        if self._retained_dense():
+            start = max(self._first - self._offset, 0)
+            values = self._data[start:end]
+            values.flags.writeable = False
+            return values
+        return self._data[:end][self._mask[:end]]
+
+    def recent(self, n):
+        """ Returns a copy of the series which only retains its last `n`
+        set values (all the retained values if `n` is 0), e.g. to send
+        the values a predictor reads to another process. """
+        end = max(self._end - self._offset, 0)
+        if n <= 0:
+            start = 0
+        elif self._retained_dense():
+            start = max(end - n, self._first - self._offset, 0)
+        else:
+            kept = np.flatnonzero(self._mask[:end])
+            start = int(kept[-n]) if n < kept.size else 0
+        copy = TimeSeries(capacity=max(end - start, 1))
+        copy._data[:end - start] = self._data[start:end]
+        copy._mask[:end - start] = self._mask[start:end]
+        copy._offset = self._offset + start
+        copy._first = self._first
+        copy._end = self._end
+        copy._count = self._count
+        copy._dropped = self._dropped + int(
+            np.count_nonzero(self._mask[:start]))
+        copy.retain = end - start if start > 0 else self.retain
+        return copy
+
+    def _check_history(self):
+        if self._dropped:
+            raise HistoryError('only the last %i timesteps of the time '
+                               'series are retained' % self.retain)
+
+    def keys(self):
+        """ Returns the set timesteps in increasing order. """
+        self._check_history()
+        return self._retained_keys()
+
+    def values(self):
+        """ Returns the set values ordered by timestep. When the series
+        has no gaps this is a read-only view, not a copy. """
+        self._check_history()
+        return self._retained()
+
+    def items(self):
+        return zip(self.keys(), self.values().tolist())
+
+    def tail(self, n):
+        """ Returns the last `n` set values ordered by timestep. If `n`
+        is 0, all values are returned (like `values[-0:]`). """
+        if n <= 0:
+            return self.values()
+        values = self._retained()
+        if n > len(values) and self._dropped:
+            raise HistoryError('%i values requested, only the last %i '
+                               'timesteps of the time series are retained'
+                               % (n, self.retain))
+        return values[-n:]
+
+
+def as_array(ts):
+    """ Returns the values of a time series as a NumPy array, without
+    copying if `ts` is a TimeSeries.
+
+    Parameters
+    ----------
+    ts: TimeSeries or dict
+        key: time
+        value: value at time
+    """
+    if isinstance(ts, TimeSeries):
+        return ts.values()
+    return np.fromiter(ts.values(), dtype=float, count=len(ts))
+
+
+def window(ts, back_steps):
+    """ Returns the last `back_steps` values of a time series (all of
+    them if `back_steps` is 0) as a NumPy array.
+
+    Parameters
+    ----------
+    ts: TimeSeries or dict
+        key: time
+        value: value at time
+    back_steps: int
+        Number of values at the end of the time series to return.
+    """
+    if isinstance(ts, TimeSeries):
+        return ts.tail(back_steps)
+    return as_array(ts)[-1 * back_steps:]
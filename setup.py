@@ -1,5 +1,8 @@
 #!/usr/bin/env python
-from distutils.core import setup
+try:
+    from setuptools import setup
+except ImportError:
+    from distutils.core import setup
 
 
 VERSION = '0.0.1'
@@ -7,6 +10,7 @@ setup_kwargs = {
     "version": VERSION,
     "description": 'Demand Driven Archetypes',
     "author": 'Robert Flanagan',
+    "python_requires": '>=3.8',
     }
 
 if __name__ == '__main__':
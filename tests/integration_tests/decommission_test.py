@@ -2,6 +2,7 @@
 archetype.
 """
 
+import csv
 import json
 import re
 import subprocess
@@ -18,7 +19,8 @@ from nose.tools import assert_in, assert_true, assert_equals
 
 # Delete previously generated files
 direc = os.listdir('./')
-hit_list = glob.glob('*.sqlite') + glob.glob('*.json') + glob.glob('*.png') + glob.glob('*.txt')
+hit_list = glob.glob('*.sqlite') + glob.glob('*.json') + glob.glob('*.png') + glob.glob('*.txt') + \
+    glob.glob('*.csv')
 for file in hit_list:
     os.remove(file)
 
@@ -26,8 +28,16 @@ ENV = dict(os.environ)
 ENV['PYTHONPATH'] = ".:" + ENV.get('PYTHONPATH', '')
 
 
+def last_supply(commod):
+    """ Returns the supply of the last row recorded for a commodity """
+    output_ = glob.glob(commod + '_*.csv')[0]
+    with open(output_) as f:
+        rows = list(csv.DictReader(f))
+    os.remove(output_)
+    return float(rows[-1]['supply'])
+
+
 def test_decommission():
-    output_ = 'POWER.txt'
     input_path = os.path.abspath(__file__)
     find = 'd3ploy/'
     indx = input_path.rfind('d3ploy/')
@@ -35,16 +45,11 @@ def test_decommission():
         input_path[indx + len(find):], 'input/decommission.xml')
     s = subprocess.check_output(['cyclus', input_],
                                 universal_newlines=True, env=ENV)
-    with open('POWER.txt') as f:
-        lines = f.readlines()
-    f.close()
-    val = float(lines[-1].split(' ')[5])
+    val = last_supply('POWER')
     assert (val < 50.)
-    os.remove('POWER.txt')
 
 
 def test_backdecom():
-    output_ = 'POWER.txt'
     input_path = os.path.abspath(__file__)
     find = 'd3ploy/'
     indx = input_path.rfind('d3ploy/')
@@ -52,9 +57,5 @@ def test_backdecom():
         input_path[indx + len(find):], 'input/backdecom.xml')
     s = subprocess.check_output(['cyclus', input_],
                                 universal_newlines=True, env=ENV)
-    with open('fuel.txt') as f:
-        lines = f.readlines()
-    f.close()
-    val = float(lines[-1].split(' ')[5])
+    val = last_supply('fuel')
     assert (val < 50.)
-    os.remove('fuel.txt')
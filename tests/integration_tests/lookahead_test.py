@@ -0,0 +1,133 @@
+""" This python file contains lookahead tests for the
+DemandDrivenDeploymentInst archetype.
+"""
+
+import json
+import subprocess
+import os
+import copy
+import glob
+import d3ploy.tester as functions
+
+# Delete previously generated files
+direc = os.listdir('./')
+hit_list = glob.glob('lookahead*.sqlite') + glob.glob('lookahead*.json')
+for file in hit_list:
+    os.remove(file)
+
+ENV = dict(os.environ)
+ENV['PYTHONPATH'] = ".:" + ENV.get('PYTHONPATH', '')
+
+DURATION = 30
+LOOKAHEAD = 5
+# the demand grows by one reactor each timestep
+demand_eq = "1000*t"
+
+scenario_template = {
+    "simulation": {
+        "archetypes": {
+            "spec": [
+                    {"lib": "agents", "name": "NullRegion"},
+                    {"lib": "cycamore", "name": "Source"},
+                    {"lib": "cycamore", "name": "Reactor"},
+                    {"lib": "cycamore", "name": "Sink"},
+                    {"lib": "d3ploy.demand_driven_deployment_inst",
+                     "name": "DemandDrivenDeploymentInst"}
+            ]
+        },
+        "control": {"duration": str(DURATION), "startmonth": "1",
+                    "startyear": "2000"},
+        "recipe": [
+            {
+                "basis": "mass",
+                "name": "fresh_uox",
+                "nuclide": [{"comp": "0.711", "id": "U235"},
+                            {"comp": "99.289", "id": "U238"}]
+            },
+            {
+                "basis": "mass",
+                "name": "spent_uox",
+                "nuclide": [{"comp": "50", "id": "Kr85"},
+                            {"comp": "50", "id": "Cs137"}]
+            }
+        ],
+        "facility": [{
+            "config": {"Source": {"outcommod": "fuel",
+                                  "outrecipe": "fresh_uox",
+                                  "throughput": "3000"}},
+            "name": "source"
+        },
+            {
+            "config": {"Sink": {"in_commods": {"val": "spentfuel"},
+                                "max_inv_size": "1e6"}},
+            "name": "sink"
+        },
+            {
+            "config": {
+                "Reactor": {
+                    "assem_size": "1000",
+                    "cycle_time": "3",
+                    "fuel_incommods": {"val": "fuel"},
+                    "fuel_inrecipes": {"val": "fresh_uox"},
+                    "fuel_outcommods": {"val": "spentfuel"},
+                    "fuel_outrecipes": {"val": "spent_uox"},
+                    "n_assem_batch": "1",
+                    "n_assem_core": "3",
+                    "power_cap": "1000",
+                    "refuel_time": "1",
+                }
+            },
+            "name": "reactor"
+        }],
+        "region": {
+            "config": {"NullRegion": "\n      "},
+            "institution": [{
+                "config": {
+                    "DemandDrivenDeploymentInst": {
+                        "calc_method": "poly",
+                        "demand_eq": demand_eq,
+                        "driving_commod": "POWER",
+                        "facility_capacity": {"item": [
+                            {"capacity": "1000", "facility": "reactor"},
+                            {"capacity": "3000", "facility": "source"}]},
+                        "facility_commod": {"item": [
+                            {"commod": "POWER", "facility": "reactor"},
+                            {"commod": "fuel", "facility": "source"}]},
+                        "os_time": "3",
+                        "record": "0",
+                        "lookahead": "0"
+                    }
+                },
+                "name": "inst"
+            }],
+            "name": "SingleRegion"
+        }}}
+
+
+def reactor_builds(lookahead):
+    """ Runs the scenario with a lookahead horizon and returns the number
+    of reactors deployed """
+    scenario_input = copy.deepcopy(scenario_template)
+    inst = scenario_input["simulation"]["region"]["institution"][0]
+    inst["config"]["DemandDrivenDeploymentInst"]["lookahead"] = \
+        str(lookahead)
+    name = "lookahead%i" % lookahead
+    input_file = name + ".json"
+    output_file = name + ".sqlite"
+    with open(input_file, 'w') as f:
+        json.dump(scenario_input, f)
+    s = subprocess.check_output(['cyclus', '-o', output_file, input_file],
+                                universal_newlines=True, env=ENV)
+    cursor = functions.get_cursor(output_file)
+    return len(cursor.execute('SELECT entertime FROM agententry WHERE ' +
+                              'prototype == "reactor"').fetchall())
+
+
+def test_lookahead_builds():
+    """ Tests if planning for the lookahead horizon does not deploy the
+    reactors scheduled by the previous plans again: on a growing demand,
+    it deploys at most the reactors of the growth of the demand over the
+    horizon more than the institution without lookahead """
+    builds = reactor_builds(0)
+    assert (builds > 0)
+    assert (reactor_builds(LOOKAHEAD) <= builds + LOOKAHEAD)
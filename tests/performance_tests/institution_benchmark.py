@@ -0,0 +1,322 @@
+"""
+This python file benchmarks the cost per timestep of the deployment
+institutions themselves, without the cyclus kernel. The institutions are
+imported against stub cyclus modules (put on sys.modules before d3ploy is
+imported) and driven by a stub context: the facilities they deploy enter
+the simulation the next timestep, report their supply (or capacity)
+through synthetic time series listeners, and exit at the end of their
+lifetime.
+
+How to use:
+python [file name] [-o report.json] [--commods N] [--protos N]
+       [--children N] [--duration N] [--calc-methods ma poly ...]
+       [--lookahead N]
+
+For each institution and calc method, the time per timestep of each stage
+of decision() and of the listeners, and the peak memory of the run, are
+printed and written to a JSON report that can be compared between
+releases.
+"""
+
+import argparse
+import collections
+import copy
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import types
+import warnings
+import numpy as np
+
+
+class StubAgent(object):
+    """ Replaces the cyclus agents the institutions derive from """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def enter_notify(self):
+        pass
+
+    def id(self):
+        return 1
+
+
+class StateVar(object):
+    """ Replaces the cyclus state variable types, only keeps the default
+    value of the state variable """
+
+    def __init__(self, *args, **kwargs):
+        self.default = kwargs.get('default')
+
+
+class StubLib(object):
+    """ Replaces cyclus.lib: calls the listeners of the time series and
+    counts the calls. """
+
+    def __init__(self, context=None):
+        self.context = context
+        self.TIME_SERIES_LISTENERS = collections.defaultdict(list)
+        self.listener_calls = 0
+
+    def record_time_series(self, name, agent, value):
+        for listener in self.TIME_SERIES_LISTENERS[name]:
+            listener(agent, self.context.time, value, name)
+            self.listener_calls += 1
+
+
+def stub_cyclus():
+    """ Puts stub cyclus, cyclus.agents, cyclus.lib and cyclus.typesystem
+    modules on sys.modules """
+    agents = types.ModuleType('cyclus.agents')
+    agents.Agent = agents.Institution = agents.Facility = StubAgent
+    typesystem = types.ModuleType('cyclus.typesystem')
+    for name in ('Bool', 'Double', 'Int', 'String', 'MapStringDouble',
+                 'MapStringString', 'VectorString'):
+        setattr(typesystem, name, StateVar)
+    typesystem.INT, typesystem.DOUBLE, typesystem.STRING = \
+        'int', 'double', 'std::string'
+    cyclus = types.ModuleType('cyclus')
+    cyclus.agents = agents
+    cyclus.lib = StubLib()
+    cyclus.typesystem = typesystem
+    sys.modules.update({'cyclus': cyclus, 'cyclus.agents': agents,
+                        'cyclus.lib': cyclus.lib,
+                        'cyclus.typesystem': typesystem})
+
+
+stub_cyclus()
+
+import d3ploy.deployment_engine as engine  # noqa: E402
+from d3ploy.cache import d3ploy_version  # noqa: E402
+from d3ploy.demand_driven_deployment_inst import (  # noqa: E402
+    DemandDrivenDeploymentInst)
+from d3ploy.supply_driven_deployment_inst import (  # noqa: E402
+    SupplyDrivenDeploymentInst)
+
+warnings.simplefilter('ignore')
+
+INSTITUTIONS = {'demand_driven': DemandDrivenDeploymentInst,
+                'supply_driven': SupplyDrivenDeploymentInst}
+
+CALC_METHODS = ['ma', 'arma', 'arch', 'poly', 'exp_smoothing',
+                'holt_winters', 'fft', 'sw_seasonal']
+
+
+class StubDatum(object):
+    """ Replaces the cyclus datums, drops the values """
+
+    def add_val(self, field, value, shape=None, type=None):
+        pass
+
+    def record(self):
+        pass
+
+
+class StubContext(object):
+    def __init__(self, sim_dur):
+        self.time = 0
+        self.sim_dur = sim_dur
+        self.builds = []
+
+    def schedule_build(self, inst, proto):
+        self.builds.append(proto)
+
+    def new_datum(self, title):
+        return StubDatum()
+
+
+class StubFacility(object):
+    def __init__(self, agent_id, prototype, enter_time, lifetime):
+        self.agent_id = agent_id
+        self.prototype = prototype
+        self.enter_time = enter_time
+        self.lifetime = lifetime
+
+    def id(self):
+        return self.agent_id
+
+    @property
+    def exit_time(self):
+        return self.enter_time + self.lifetime - 1
+
+    def lifetime_force(self, lifetime):
+        self.lifetime = lifetime
+
+
+def state_vars(cls):
+    """ Returns the state variables of an institution class and of its
+    base classes """
+    return {name: getattr(cls, name) for name in dir(cls)
+            if isinstance(getattr(cls, name), StateVar)}
+
+
+def scenario(kind, n_commods, n_protos, calc_method, lookahead=0):
+    """ Returns the state variables of an institution and the capacity
+    and lifetime of its prototypes """
+    commods = ['commod%i' % i for i in range(n_commods)]
+    caps = {}
+    lifetimes = {}
+    facility_commod = {}
+    for commod in commods:
+        for p in range(n_protos):
+            proto = commod + '_proto%i' % p
+            facility_commod[proto] = commod
+            caps[proto] = 100. * (p + 1)
+            lifetimes[proto] = 20 + 10 * p
+    params = {'facility_commod': facility_commod,
+              'facility_capacity': dict(caps),
+              'facility_pref': {}, 'facility_constraintcommod': {},
+              'facility_constraintval': {}, 'facility_sharing': {},
+              'calc_method': calc_method, 'record': False,
+              'installed_cap': False, 'steps': 1, 'back_steps': 5,
+              'buffer_type': {}, 'degree': 1, 'os_time': 5, 'os_int': 1,
+              'refit_interval': 1, 'refit_tol': 0., 'parallel_workers': 0,
+              'deploy_method': 'greedy', 'lookahead': lookahead}
+    if kind == 'demand_driven':
+        params.update({'driving_commod': commods[0], 'supply_std_dev': 0.,
+                       'supply_buffer': {}, 'demand_horizon': 0})
+    else:
+        params.update({'capacity_std_dev': 0., 'capacity_buffer': {}})
+    return commods, caps, lifetimes, params
+
+
+def run(kind, calc_method, n_commods=10, n_protos=3, n_children=100,
+        duration=100, lookahead=0, seed=0, memory=False):
+    """ Runs an institution for duration timesteps and returns the time
+    spent in each stage of decision() and in the listeners """
+    rng = np.random.RandomState(seed)
+    commods, caps, lifetimes, params = scenario(kind, n_commods, n_protos,
+                                                calc_method, lookahead)
+    protos = list(caps)
+    # the amount required per commodity keeps about n_children
+    # facilities at play and grows by half over the run
+    scale = n_children * np.mean(list(caps.values())) / n_commods
+    if kind == 'demand_driven':
+        params['demand_eq'] = '%f*(1+t/%i)' % (scale, 2 * duration)
+        provided_ts, required_ts = 'supply', 'demand'
+    else:
+        provided_ts, required_ts = 'demand', 'supply'
+
+    context = StubContext(duration)
+    stub_lib = StubLib(context)
+    inst = INSTITUTIONS[kind]()
+    for name, var in state_vars(INSTITUTIONS[kind]).items():
+        setattr(inst, name, copy.deepcopy(params.get(name, var.default)))
+    inst.context = context
+    agent_ids = iter(range(1, sys.maxsize))
+    inst.children = [StubFacility(next(agent_ids), proto,
+                                  -int(rng.randint(lifetimes[proto])),
+                                  lifetimes[proto])
+                     for proto in rng.choice(protos, n_children)]
+
+    timings = collections.defaultdict(float)
+
+    def timed(name, stage):
+        def run_stage(step):
+            start = time.perf_counter()
+            stage(step)
+            timings[name] += time.perf_counter() - start
+        return run_stage
+
+    lib = engine.lib
+    engine.lib = stub_lib
+    if memory:
+        tracemalloc.start()
+    try:
+        inst.enter_notify()
+        inst.pipeline = [timed(name, stage)
+                         for name, stage in zip(inst.stages, inst.pipeline)]
+        builds = 0
+        for t in range(duration):
+            context.time = t
+            for proto in context.builds:
+                child = StubFacility(next(agent_ids), proto, t,
+                                     lifetimes[proto])
+                inst.children.append(child)
+                inst.build_notify(child)
+            builds += len(context.builds)
+            context.builds = []
+            start = time.perf_counter()
+            for child in inst.children:
+                stub_lib.record_time_series(
+                    provided_ts + inst.fac_commod[child.prototype], child,
+                    caps[child.prototype])
+            for commod in commods:
+                if kind == 'demand_driven' and commod == commods[0]:
+                    continue
+                stub_lib.record_time_series(
+                    required_ts + commod, inst,
+                    scale * (1 + t / (2. * duration)) *
+                    (1 + 0.1 * rng.randn()))
+            timings['listeners'] += time.perf_counter() - start
+            start = time.perf_counter()
+            inst.decision()
+            timings['decision'] += time.perf_counter() - start
+            exiting = [child for child in inst.children
+                       if child.exit_time == t]
+            for child in exiting:
+                inst.children.remove(child)
+                inst.decom_notify(child)
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if memory:
+            tracemalloc.stop()
+        engine.lib = lib
+    result = {'time_per_step': timings['decision'] / duration,
+              'stages': {name: timings[name] / duration
+                         for name in list(inst.stages) + ['listeners']},
+              'listener_calls': stub_lib.listener_calls,
+              'builds': builds,
+              'children': len(inst.children)}
+    if memory:
+        result['peak_memory'] = peak
+    return result
+
+
+def benchmark(calc_methods=CALC_METHODS, institutions=INSTITUTIONS,
+              **config):
+    """ Returns the report of the runs of the institutions with each
+    calc method """
+    report = {'d3ploy': d3ploy_version(),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'config': config,
+              'results': {}}
+    for kind in institutions:
+        report['results'][kind] = {}
+        for calc_method in calc_methods:
+            result = run(kind, calc_method, **config)
+            # tracemalloc slows the run down, memory is measured apart
+            result['peak_memory'] = run(kind, calc_method, memory=True,
+                                        **config)['peak_memory']
+            report['results'][kind][calc_method] = result
+            print(kind, calc_method, '%.3g s/step' % result['time_per_step'],
+                  ' '.join('%s %.3g' % item
+                           for item in result['stages'].items()),
+                  '%i kB' % (result['peak_memory'] // 1024))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-o', '--output',
+                        default='institution_benchmark.json')
+    parser.add_argument('--commods', type=int, default=10)
+    parser.add_argument('--protos', type=int, default=3)
+    parser.add_argument('--children', type=int, default=100)
+    parser.add_argument('--duration', type=int, default=100)
+    parser.add_argument('--calc-methods', nargs='+', default=CALC_METHODS)
+    parser.add_argument('--lookahead', type=int, default=0)
+    parser.add_argument('--institutions', nargs='+',
+                        default=list(INSTITUTIONS))
+    args = parser.parse_args()
+    report = benchmark(args.calc_methods, args.institutions,
+                       n_commods=args.commods, n_protos=args.protos,
+                       n_children=args.children, duration=args.duration,
+                       lookahead=args.lookahead)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
@@ -0,0 +1,62 @@
+"""
+This python file benchmarks the per timestep cost of the sw_seasonal calc
+method, refitting the stepwise search every timestep (stepwise_seasonal)
+against the throttled StepwiseSeasonal predictor.
+
+How to use:
+python [file name] [refit_interval]
+
+The demand curves of the algorithm_performance_tests scenarios are replayed
+as the series to predict for the duration of those scenarios. For each
+scenario the mean time per timestep and the largest relative difference of
+the predictions are printed and written to sw_seasonal_benchmark.csv.
+"""
+
+import sys
+import time
+import warnings
+import numpy as np
+import pandas as pd
+import d3ploy.ML_solvers as ml
+from d3ploy.expression import Expression
+from d3ploy.predictors import make_predictor
+from d3ploy.timeseries import TimeSeries
+
+warnings.simplefilter('ignore')
+
+duration = 100
+period = 1
+refit_interval = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+
+scenarios = {'scenario_1': "1000*t",
+             'scenario_2': "1000*t",
+             'scenario_3': "1000*t",
+             'scenario_4': "10*(1+1.5)**(t/12)"}
+
+results = {}
+for name, demand_eq in scenarios.items():
+    curve = Expression(demand_eq).evaluate(np.arange(duration))
+    series = TimeSeries()
+    predictor = make_predictor('sw_seasonal', series, degree=period,
+                               refit_interval=refit_interval)
+    before = 0.
+    after = 0.
+    diff = 0.
+    for t in range(duration):
+        series[t] = curve[t]
+        start = time.time()
+        x_before = ml.stepwise_seasonal(series, period=period)
+        before += time.time() - start
+        start = time.time()
+        x_after = predictor.predict()
+        after += time.time() - start
+        diff = max(diff, abs(x_after - x_before) / max(abs(x_before), 1.))
+    results[name] = {'demand_eq': demand_eq,
+                     'step_time_before': before / duration,
+                     'step_time_after': after / duration,
+                     'speedup': before / after,
+                     'max_rel_diff': diff}
+    print(name, results[name])
+
+df = pd.DataFrame(results).T
+df.to_csv('sw_seasonal_benchmark.csv')
@@ -0,0 +1,88 @@
+import collections
+import pytest
+from d3ploy.aggregator import aggregator, release
+from d3ploy.timeseries import TimeSeries, HistoryError
+
+
+def record(listeners, name, time, value):
+    for listener in listeners[name]:
+        listener(None, time, value, name)
+
+
+def test_aggregator():
+    """ Tests if the institutions share one listener per time series
+    and merge the totals into their own time series """
+    listeners = collections.defaultdict(list)
+    shared = aggregator(listeners)
+    assert (aggregator(listeners) is shared)
+    first, second = TimeSeries(), TimeSeries()
+    first_view = shared.view('supplyPOWER', 0)
+    record(listeners, 'supplyPOWER', 0, 1.)
+    second_view = shared.view('supplyPOWER', 0, counted=True)
+    assert (len(listeners['supplyPOWER']) == 1)
+    record(listeners, 'supplyPOWER', 0, 2.)
+    first_view.merge(first, 0)
+    second_view.merge(second, 0)
+    assert (first[0] == 3.)
+    # values reported before the view was made are not merged
+    assert (second[0] == 2.)
+    # values written by the institution are kept, and values reported
+    # after the decision are merged at the next one
+    first[1] = 10.
+    record(listeners, 'supplyPOWER', 0, 4.)
+    record(listeners, 'supplyPOWER', 1, 0.)
+    record(listeners, 'supplyPOWER', 1, 5.)
+    first_view.merge(first, 1)
+    second_view.merge(second, 1)
+    assert (list(first.items()) == [(0, 7.), (1, 15.)])
+    assert (list(second.items()) == [(0, 6.), (1, 5.)])
+    assert (second_view.calls() == 4)
+    assert (second_view.calls() == 0)
+    record(listeners, 'supplyPOWER', 3, 0.)
+    first_view.merge(first, 3)
+    assert (first.keys() == [0, 1, 3])
+    # a new simulation clears the listeners and resets the totals
+    listeners.clear()
+    view = shared.view('supplyPOWER', 0)
+    record(listeners, 'supplyPOWER', 0, 1.)
+    series = TimeSeries()
+    view.merge(series, 0)
+    assert (series[0] == 1.)
+    # the aggregator is dropped, with its listeners, once it is released
+    # by all its users
+    release(listeners)
+    assert (aggregator(listeners) is shared)
+    release(listeners)
+    assert (len(listeners['supplyPOWER']) == 1)
+    release(listeners)
+    assert (listeners['supplyPOWER'] == [])
+    assert (aggregator(listeners) is not shared)
+    release(listeners)
+
+
+def test_aggregator_history():
+    """ Tests if the totals keep the largest window of the institutions
+    following the time series, and the whole history if one of them
+    reads it """
+    listeners = collections.defaultdict(list)
+    shared = aggregator(listeners)
+    shared.view('supplyPOWER', 0, history=5)
+    shared.view('supplyPOWER', 0, history=40)
+    # a shorter window does not narrow the totals
+    shared.view('supplyPOWER', 0, history=10)
+    for t in range(200):
+        record(listeners, 'supplyPOWER', t, float(t))
+    series = TimeSeries()
+    shared.view('supplyPOWER', 160).merge(series, 199)
+    # the total at the time of the view was reported before it was made
+    assert (list(series.items()) ==
+            [(t, float(t)) for t in range(161, 200)])
+    with pytest.raises(HistoryError):
+        shared.view('supplyPOWER', 100).merge(TimeSeries(), 199)
+    shared.view('supplyPOWER', 200, history=0)
+    for t in range(200, 500):
+        record(listeners, 'supplyPOWER', t, float(t))
+    series = TimeSeries()
+    shared.view('supplyPOWER', 200).merge(series, 499)
+    assert (list(series.keys()) == list(range(201, 500)))
+    release(listeners)
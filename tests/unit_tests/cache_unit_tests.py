@@ -0,0 +1,59 @@
+import os
+import time
+from d3ploy.cache import Cache
+
+
+def write(file_name, size):
+    with open(file_name, 'wb') as f:
+        f.write(b'0' * size)
+    return file_name
+
+
+def test_key(tmpdir):
+    """ Tests if the keys only depend on the inputs and versions """
+    cache = Cache(str(tmpdir.join('cache')), versions={'d3ploy': '1'})
+    scenario = {'simulation': {'control': {'duration': '10'},
+                               'recipe': [{'name': 'a'}, {'name': 'b'}]}}
+    text = ('{"simulation": {"recipe": [{"name": "a"}, {"name": "b"}], ' +
+            '"control": {"duration": "10"}}}')
+    assert (cache.key(scenario) == cache.key(text))
+    assert (cache.key(scenario) != cache.key(
+        {'simulation': {'control': {'duration': '11'}}}))
+    xml = '<simulation>\n  <control><duration>10</duration></control>\n' + \
+        '</simulation>'
+    assert (cache.key(xml) == cache.key(
+        '<simulation><control><duration>10</duration></control>' +
+        '</simulation>'))
+    other = Cache(str(tmpdir.join('cache')), versions={'d3ploy': '2'})
+    assert (other.key(scenario) != cache.key(scenario))
+
+
+def test_get_put(tmpdir):
+    cache = Cache(str(tmpdir.join('cache')), versions={'d3ploy': '1'})
+    key = cache.key({'simulation': {}})
+    assert (cache.get(key) is None)
+    output_file = cache.put(key, write(str(tmpdir.join('out.sqlite')), 10))
+    assert (cache.get(key) == output_file)
+    assert (os.path.getsize(output_file) == 10)
+    assert (not os.path.exists(str(tmpdir.join('out.sqlite'))))
+    assert (cache.get_metrics(key, 'fuel') is None)
+    cache.put_metrics(key, 'fuel', [1., 2., 3., 4])
+    cache.put_metrics(key, 'power', [0., 0., 0., 0])
+    assert (cache.get_metrics(key, 'fuel') == [1., 2., 3., 4])
+
+
+def test_evict(tmpdir):
+    """ Tests if the least recently used outputs are removed """
+    cache = Cache(str(tmpdir.join('cache')), max_size=250,
+                  versions={'d3ploy': '1'})
+    keys = [cache.key({'run': i}) for i in range(3)]
+    for i, key in enumerate(keys[:2]):
+        cache.put(key, write(str(tmpdir.join('out%i' % i)), 100))
+        time.sleep(0.01)
+    cache.get(keys[0])
+    time.sleep(0.01)
+    cache.put(keys[2], write(str(tmpdir.join('out2')), 100))
+    assert (cache.get(keys[1]) is None)
+    assert (cache.get(keys[0]) is not None)
+    assert (cache.get(keys[2]) is not None)
+    assert (cache.size() == 200)
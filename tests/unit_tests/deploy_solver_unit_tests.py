@@ -1,9 +1,17 @@
+import collections
+import itertools
 import random
 import sys
 import os
 import pytest
 import d3ploy.solver as solver
+from d3ploy.registry import ChildRegistry
+from d3ploy.timeseries import TimeSeries
+from d3ploy.recorder import Recorder
+from d3ploy.profiler import Profiler
+import d3ploy.predictors as predictors
 import d3ploy.demand_driven_deployment_inst as ti
+import d3ploy.deployment_engine as engine
 
 
 def test_min_deploy_solver():
@@ -256,3 +264,312 @@ def test_some_pref_negative_and_share():
     else:
         raise ValueError('wrong deployment')
     assert(True)
+
+
+def test_pref_horizon():
+    """ Tests if the preferences looked up from the precomputed horizon
+        match the preference equations, also past the first horizon """
+    commod = {'1': {'cap': 2,
+                    'pref': '10 - (1*t)',
+                    'constraint_commod': '0',
+                    'constraint': 0,
+                    'share': 0},
+              '2': {'cap': 4,
+                    'pref': '3',
+                    'constraint_commod': '0',
+                    'constraint': 0,
+                    'share': 0}
+              }
+    for t in range(250):
+        pref = solver.evaluate_preference(commod, t)
+        assert(pref['1'] == 10 - t)
+        assert(pref['2'] == 3)
+    # the compiled equations are kept per prototype, and the precomputed
+    # values only reach PREF_HORIZON timesteps past the latest time
+    expr = commod['1']['pref_expr']
+    assert(expr.table_size == 200 + solver.PREF_HORIZON)
+    assert(solver.evaluate_preference(commod, 1000)['1'] == -990)
+    assert(commod['1']['pref_expr'] is expr)
+    assert(expr.table_size == 1000 + solver.PREF_HORIZON)
+
+
+def loop_preference_deploy(cap, diff):
+    """ Counts the prototypes deployed by preference_deploy one by one """
+    num = 0
+    if diff >= cap:
+        num = 1
+        diff -= cap
+        while diff > cap:
+            num += 1
+            diff -= cap
+        if diff != 0:
+            num += 1
+    elif diff > 0:
+        num = 1
+    return num
+
+
+def loop_minimize_deploy(caps, remainder):
+    """ Counts the prototypes deployed by minimize_number_of_deployment
+        one by one """
+    deploy_dict = {}
+    key_list = sorted(caps, key=caps.get, reverse=True)
+    for proto in key_list:
+        if remainder >= caps[proto]:
+            deploy_dict[proto] = 1
+            remainder -= caps[proto]
+            while remainder > caps[proto]:
+                deploy_dict[proto] += 1
+                remainder -= caps[proto]
+    if remainder == 0:
+        return deploy_dict
+    for proto in list(reversed(key_list)):
+        if remainder > caps[proto]:
+            continue
+        deploy_dict[proto] = deploy_dict.get(proto, 0) + 1
+        break
+    return deploy_dict
+
+
+def random_amounts():
+    """ Returns capacities and amounts, including exact multiples """
+    for i in range(2000):
+        if i % 2:
+            cap = float(random.randint(1, 10))
+            amount = cap * random.randint(0, 50) + \
+                random.choice([0., 1., -1., 0.5])
+        else:
+            cap = random.uniform(0.1, 9.9)
+            amount = random.uniform(-10., 500.)
+        yield cap, amount
+
+
+def test_preference_deploy_closed_form():
+    """ Tests if preference_deploy deploys as many prototypes as
+        deploying them one by one """
+    for cap, diff in random_amounts():
+        proto_commod = {'1': {'cap': cap}}
+        deploy_dict = solver.preference_deploy(proto_commod, {'1': 1.}, diff)
+        assert (deploy_dict.get('1', 0) == loop_preference_deploy(cap, diff))
+
+
+def test_minimize_deploy_closed_form():
+    """ Tests if minimize_number_of_deployment deploys as many prototypes
+        as deploying them one by one """
+    for cap, remainder in random_amounts():
+        caps = {'1': cap, '2': float(random.randint(1, 4)),
+                '3': random.uniform(0.1, 9.9)}
+        proto_commod = {proto: {'cap': c} for proto, c in caps.items()}
+        deploy_dict = solver.minimize_number_of_deployment(proto_commod,
+                                                           remainder)
+        assert (deploy_dict == loop_minimize_deploy(caps, remainder))
+
+
+def test_sharing_deploy_closed_form():
+    """ Tests if sharing_deploy deploys as many prototypes as
+        deploying them one by one """
+    for cap, remainder in random_amounts():
+        share = random.choice([20., 50., 100.])
+        proto_commod = {'1': {'cap': cap, 'share': share}}
+        remain = share * remainder / 100.0
+        num = 0
+        while remain > 0:
+            num += 1
+            remain -= cap
+        assert (solver.sharing_deploy(proto_commod, remainder) == {'1': num})
+
+
+def test_large_deficit():
+    """ Tests if a large deficit is met without deploying one by one """
+    proto_commod = {'1': {'cap': 1.}}
+    deploy_dict = solver.preference_deploy(proto_commod, {'1': 1.}, 1e11)
+    assert (deploy_dict == {'1': 100000000000})
+
+
+def test_optimal_deployment():
+    """ Tests if the optimal deployment has the least overshoot and then
+        the least number of facilities """
+    for i in range(100):
+        caps = [random.randint(2, 12) for j in range(3)]
+        remainder = random.uniform(0.5, 30.0)
+        commod = {}
+        for j, cap in enumerate(caps):
+            commod.update({str(j): {'cap': cap,
+                                    'pref': '0',
+                                    'constraint_commod': '0',
+                                    'constraint': 0,
+                                    'share': 0}})
+        deploy_dict, commodity_dict = solver.deploy_solver(
+            commodity_supply={}, commodity_dict={'commod': commod},
+            commod='commod', diff=-remainder, time=1, method='optimal')
+        best = None
+        for nums in itertools.product(range(16), repeat=3):
+            total = sum(num * cap for num, cap in zip(nums, caps))
+            if total >= remainder:
+                best = min(best or (total, sum(nums)), (total, sum(nums)))
+        total = sum(num * commod[proto]['cap']
+                    for proto, num in deploy_dict.items())
+        assert ((total, sum(deploy_dict.values())) == best)
+
+
+def test_optimal_deployment_fleet():
+    """ Tests if the optimal deployment of a fleet of prototypes meets
+        the lack in capacity with less overshoot than the greedy one """
+    rng = random.Random(11)
+    for i in range(30):
+        commod = {}
+        for j in range(20):
+            commod.update({str(j): {'cap': rng.uniform(50., 1200.)}})
+        remainder = rng.uniform(10000., 50000.)
+        optimal = solver.optimal_deployment(commod, remainder)
+        greedy = solver.minimize_number_of_deployment(commod, remainder)
+        overshoot = {}
+        for name, deploy_dict in [('optimal', optimal), ('greedy', greedy)]:
+            overshoot[name] = sum(num * commod[proto]['cap']
+                                  for proto, num in deploy_dict.items()) - \
+                remainder
+        assert (overshoot['optimal'] >= 0)
+        assert (overshoot['optimal'] <= overshoot['greedy'])
+
+
+class Facility(object):
+    """ Stands in for a facility deployed by an institution """
+
+    def __init__(self, agent_id, prototype, enter_time):
+        self.agent_id = agent_id
+        self.prototype = prototype
+        self.enter_time = enter_time
+        self.lifetime = 100
+
+    def id(self):
+        return self.agent_id
+
+    @property
+    def exit_time(self):
+        return self.enter_time + self.lifetime - 1
+
+    def lifetime_force(self, lifetime):
+        self.lifetime = lifetime
+
+
+def test_decommission_oldest():
+    """ Tests if the facilities are decommissioned oldest first, by id
+        for the same entry time, whatever the order of the children """
+    commod = {'small': {'cap': 2.}, 'large': {'cap': 5.}}
+    children = [Facility(1, 'large', 8), Facility(7, 'small', 3),
+                Facility(2, 'small', 5), Facility(4, 'large', 3),
+                Facility(3, 'small', 3)]
+    agent = ti.DemandDrivenDeploymentInst.__new__(
+        ti.DemandDrivenDeploymentInst)
+    agent.children = children
+    agent.registry = ChildRegistry()
+    # the facilities are registered when they are built
+    for child in sorted(children, key=lambda child: (child.enter_time,
+                                                     child.id())):
+        agent.registry.add(child)
+    agent.fac_commod = {'small': 'POWER', 'large': 'POWER'}
+    agent.commodity_dict = {'POWER': commod}
+    agent.installed_capacity = {'POWER': TimeSeries()}
+    agent.installed_capacity['POWER'][11] = 17.
+    solver.decommission_oldest(agent, commod, 10., 'POWER', 10)
+    # 3 (small), 4 (large) and 7 (small) entered at 3, then the
+    # remaining difference of 1 is below the smallest capacity
+    assert ([child.id() for child in children if child.exit_time == 10] ==
+            [7, 4, 3])
+    assert (all(child.lifetime == 100 for child in children
+                if child.id() in [1, 2]))
+    assert (agent.installed_capacity['POWER'][11] == 8.)
+
+
+def test_plan_diff_pending():
+    """ Tests if the capacity deployed during the lookahead horizon is
+        credited to the planned difference, as far as the installed
+        capacity exceeds the predicted amount """
+    agent = ti.DemandDrivenDeploymentInst.__new__(
+        ti.DemandDrivenDeploymentInst)
+    agent.lookahead = 3
+    agent.driving_commod = 'POWER'
+    agent.buffer_type_dict = {'fuel': 'abs'}
+    agent.buffer_dict = {'fuel': 0.}
+    agent.installed_capacity = {'fuel': TimeSeries()}
+    agent.installed_capacity['fuel'][10] = 10.
+    agent.pending = {'fuel': collections.deque([0., 4.], maxlen=3)}
+    retired = [0., 0., 2.]
+    # the facilities deployed at the last timestep provide nothing yet
+    assert (agent.plan_diff('fuel', 10, 6., 8., retired) == 0.)
+    # they are only credited as far as the installed capacity exceeds
+    # the predicted amount
+    agent.installed_capacity['fuel'][10] = 8.
+    assert (agent.plan_diff('fuel', 10, 6., 8., retired) == -2.)
+    agent.pending['fuel'].extend([0., 0., 0.])
+    assert (agent.plan_diff('fuel', 10, 6., 8., retired) == -4.)
+
+
+def test_engine_abstract_methods():
+    """ Tests if a subclass of the engine which does not override its
+    abstract methods fails when it is defined """
+    with pytest.raises(TypeError, match='buffer, std_dev'):
+        class Incomplete(engine.DeploymentEngine):
+            def provided_series(self, commod):
+                return self.commodity_supply[commod]
+
+            def required_series(self, commod):
+                return self.commodity_demand[commod]
+
+    with pytest.raises(TypeError, match='drive'):
+        class Driven(ti.DemandDrivenDeploymentInst):
+            drive = engine.DeploymentEngine.drive
+
+    # drive is only needed if the subclass drives commodities
+    class Undriven(engine.DeploymentEngine):
+        provided_series = ti.DemandDrivenDeploymentInst.provided_series
+        required_series = ti.DemandDrivenDeploymentInst.required_series
+        buffer = ti.DemandDrivenDeploymentInst.buffer
+        std_dev = ti.DemandDrivenDeploymentInst.std_dev
+
+
+class Context(object):
+    def __init__(self, time, sim_dur):
+        self.time = time
+        self.sim_dur = sim_dur
+
+
+def test_end_simulation(tmpdir, monkeypatch):
+    """ Tests if the records, the profile and the spilled histories are
+        written, and the worker processes shut down, after the decision
+        at the last timestep, not before """
+    monkeypatch.chdir(tmpdir)
+    agent = ti.DemandDrivenDeploymentInst.__new__(
+        ti.DemandDrivenDeploymentInst)
+    agent.pipeline = []
+    agent.ended = False
+    agent.executor = predictors.make_executor(1)
+    executor = agent.executor
+    agent.record = True
+    agent.recorder = Recorder('_1', ['time'], interval=0)
+    agent.recorder.append('POWER', [0])
+    agent.profile = True
+    agent.profiler = Profiler('profile.json')
+    agent.profiler.step()
+    agent.bounded_history = True
+    agent.spill_history = True
+    agent.commodity_supply = {'POWER': TimeSeries(retain=2,
+                                                  spill='history.csv')}
+    agent.commodity_demand = {'POWER': TimeSeries()}
+    agent.installed_capacity = {'POWER': TimeSeries()}
+    for t in range(5):
+        agent.commodity_supply['POWER'][t] = float(t)
+    files = ['POWER_1.csv', 'profile.json', 'history.csv']
+    agent.context = Context(8, 10)
+    agent.decision()
+    assert (not any(os.path.exists(name) for name in files[:2]))
+    agent.context = Context(9, 10)
+    agent.decision()
+    assert (all(os.path.exists(name) for name in files))
+    with open('history.csv') as f:
+        assert (len(f.readlines()) == 6)
+    assert (agent.ended)
+    # the worker processes are shut down
+    assert (agent.executor is None)
+    with pytest.raises(RuntimeError):
+        executor.submit(abs, -1)
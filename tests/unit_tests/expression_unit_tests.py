@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from d3ploy.expression import Expression, NAMESPACE
+
+
+def test_expression_matches_eval():
+    """ Tests that compiled equations give the same values as eval """
+    equations = ["1000*t", "3*t", "10000", "50-0.1*t", "10*(1+1.5)**(t/12)",
+                 "10000/(1+np.exp(t-40))+250*t/(1+np.exp(40-t))",
+                 "(1000*np.sin(np.pi*t/3)+10000)", "math.sqrt(t)"]
+    for equation in equations:
+        expr = Expression(equation)
+        times = np.arange(0, 100)
+        curve = expr.evaluate(times)
+        assert (curve.shape == times.shape)
+        for t in range(100):
+            expected = eval(equation, dict(NAMESPACE, t=t))
+            assert (expr(t) == pytest.approx(expected))
+            assert (curve[t] == pytest.approx(expected))
+        expr.precompute(50)
+        assert (expr(10) == pytest.approx(curve[10]))
+
+
+def test_expression_constant():
+    """ Tests that constant equations are recognized """
+    assert (Expression("10000").is_constant)
+    assert (Expression("-1").is_constant)
+    assert (not Expression("1*t").is_constant)
+
+
+def test_expression_rejects_unsafe():
+    """ Tests that equations can only use whitelisted operations """
+    for equation in ["__import__('os')", "np.load('x')", "t.__class__",
+                     "[t for t in ()]", "open('x')", "lambda: 1", "1 +"]:
+        with pytest.raises(ValueError):
+            Expression(equation)
@@ -0,0 +1,71 @@
+import random
+import numpy as np
+import pytest
+import d3ploy.metrics as metrics
+
+
+def random_dict(length=50):
+    """ Makes supply and demand dictionaries with missing timesteps,
+    equal values and zero demand """
+    all_dict = {'dict_supply': {}, 'dict_demand': {}}
+    start = random.randint(0, 3)
+    for t in range(start, length):
+        for key in ['dict_supply', 'dict_demand']:
+            if random.random() < 0.2:
+                continue
+            all_dict[key][t] = random.choice([0., 10., random.uniform(0, 20)])
+    return all_dict
+
+
+def loop_metrics(all_dict, demand_driven):
+    """ The metrics computed step by step """
+    dict_demand = all_dict['dict_demand']
+    dict_supply = all_dict['dict_supply']
+    under = 0
+    over = 0
+    for step in set().union(dict_demand.keys(), dict_supply.keys()):
+        if step in dict_demand and step in dict_supply:
+            under += max(dict_demand[step] - dict_supply[step], 0)
+            over += max(dict_supply[step] - dict_demand[step], 0)
+    chi2 = 0
+    start = int(list(dict_demand.keys())[0])
+    for y in range(start, len(dict_demand) + 1):
+        if y in dict_supply and dict_demand.get(y, 0) != 0:
+            chi2 += (dict_supply[y] - dict_demand[y])**2 / dict_demand[y]
+    count = 0
+    for x in range(len(dict_demand)):
+        if x in dict_demand and x in dict_supply:
+            if demand_driven:
+                count += dict_supply[x] < dict_demand[x]
+            else:
+                count += dict_supply[x] > dict_demand[x]
+    return under, over, chi2, count
+
+
+def test_evaluate_dicts():
+    """ Tests if the metrics of many runs are the ones of each run """
+    all_dicts = [random_dict(random.randint(5, 50)) for i in range(20)]
+    for demand_driven in [True, False]:
+        table = metrics.evaluate_dicts(all_dicts, demand_driven)
+        assert (len(table) == len(all_dicts))
+        for row, all_dict in zip(table, all_dicts):
+            under, over, chi2, count = loop_metrics(all_dict, demand_driven)
+            assert (row['undersupply'] == pytest.approx(under))
+            assert (row['oversupply'] == pytest.approx(over))
+            assert (row['chi2'] == pytest.approx(chi2))
+            assert (row['under_count'] == count)
+
+
+def test_evaluate():
+    """ Tests the metrics of aligned arrays """
+    supply = np.array([[1., 2., np.nan, 4.],
+                       [5., 5., 5., 5.]])
+    demand = np.array([[2., 2., 3., 1.],
+                       [4., 6., 0., np.nan]])
+    table = metrics.evaluate(supply, demand)
+    assert (list(table['undersupply']) == [1., 1.])
+    assert (list(table['oversupply']) == [3., 6.])
+    assert (table['chi2'] == pytest.approx([0.5 + 9., 0.25 + 1. / 6.]))
+    assert (list(table['under_count']) == [1, 1])
+    table = metrics.evaluate(supply, demand, demand_driven=False)
+    assert (list(table['under_count']) == [1, 2])
@@ -0,0 +1,361 @@
+import random
+import numpy as np
+import pytest
+from pmdarima.arima import ARIMA
+from d3ploy.timeseries import TimeSeries, HistoryError
+import d3ploy.predictors as predictors
+import d3ploy.solver as solver
+import d3ploy.NO_solvers as no
+import d3ploy.DO_solvers as do
+
+
+def test_incremental_ma():
+    """ Tests if the moving average predictor gives the same
+        prediction as predict_ma every timestep """
+    for back_steps in [0, 1, 5]:
+        series = TimeSeries()
+        predictor = predictors.make_predictor('ma', series,
+                                              back_steps=back_steps)
+        for t in range(200):
+            series[t] = 1000. * t + random.uniform(-50., 50.)
+            assert (predictor.predict() == pytest.approx(
+                no.predict_ma(series, back_steps=back_steps)))
+
+
+def test_incremental_poly():
+    """ Tests if the polynomial fit predictor gives the same
+        prediction as polyfit_regression every timestep """
+    for back_steps in [0, 2, 10]:
+        for degree in [1, 2]:
+            series = TimeSeries()
+            predictor = predictors.make_predictor('poly', series,
+                                                  back_steps=back_steps,
+                                                  degree=degree, steps=2)
+            for t in range(200):
+                series[t] = 3. * t**2 + random.uniform(-50., 50.)
+                expected = do.polyfit_regression(series,
+                                                 back_steps=back_steps,
+                                                 degree=degree, steps=2)
+                assert (predictor.predict() == pytest.approx(expected))
+
+
+def test_invalid_calc_method():
+    """ Tests if an unknown calc method is rejected """
+    with pytest.raises(ValueError):
+        predictors.make_predictor('not_a_method', TimeSeries())
+
+
+def test_refit_interval_arch():
+    """ Tests if the arch predictor gives the same prediction as
+        predict_arch when it is refitted every timestep and stays
+        close to it when it is refitted every 5 timesteps """
+    for refit_interval in [1, 5]:
+        series = TimeSeries()
+        predictor = predictors.make_predictor('arch', series, back_steps=20,
+                                              refit_interval=refit_interval)
+        for t in range(60):
+            series[t] = 500. + random.uniform(-30., 30.)
+            x = predictor.predict()
+            if refit_interval == 1:
+                assert (x == no.predict_arch(series, back_steps=20))
+            else:
+                assert (abs(x - 500.) < 30.)
+
+
+def harmonic_fft(x, degree=1, steps=1):
+    """ Restores the full signal harmonic by harmonic """
+    n = x.size
+    t = np.arange(0, n)
+    p = np.polyfit(t, x, degree)
+    x_freqdom = np.fft.fft(x - p[0] * t)
+    f = np.fft.fftfreq(n)
+    indexes = sorted(range(n), key=lambda i: np.absolute(f[i]))
+    t = np.arange(0, n + steps)
+    restored_sig = np.zeros(t.size)
+    for i in indexes[:1 + 100 * 2]:
+        ampli = np.absolute(x_freqdom[i]) / n
+        phase = np.angle(x_freqdom[i])
+        restored_sig += ampli * np.cos(2 * np.pi * f[i] * t + phase)
+    return restored_sig[-1] + p[0] * t[-1]
+
+
+def test_fft_batch():
+    """ Tests if the closed form fft gives the same prediction as
+        restoring the whole signal, for one and many time series """
+    windows = np.cumsum(np.random.uniform(-50., 150., (20, 300)), axis=1)
+    for steps in [1, 3]:
+        batch = do.fft_batch(windows, steps=steps)
+        for i, x in enumerate(windows):
+            expected = harmonic_fft(x, steps=steps)
+            assert (batch[i] == pytest.approx(expected))
+            series = {t: v for t, v in enumerate(x)}
+            assert (do.fft(series, back_steps=300, steps=steps) ==
+                    pytest.approx(expected))
+
+
+def test_predict_batch():
+    """ Tests if the batched predictions of many series are the same as
+        the predictions of each predictor """
+    for calc_method in ['ma', 'poly', 'fft']:
+        series = [TimeSeries() for i in range(12)]
+        batched = [predictors.make_predictor(calc_method, s, back_steps=8)
+                   for s in series]
+        single = [predictors.make_predictor(calc_method, s, back_steps=8)
+                  for s in series]
+        for t in range(20):
+            for i, s in enumerate(series):
+                # one series starts later, so its window is shorter
+                if i > 0 or t > 3:
+                    s[t] = 100. * i * t + random.uniform(-50., 50.)
+            if t <= 3:
+                continue
+            times = [0.] * len(batched)
+            predictions = predictors.predict_batch(batched, times=times)
+            for predictor, x in zip(single, predictions):
+                assert (x == pytest.approx(predictor.predict(),
+                                           nan_ok=True))
+            assert (all(seconds > 0. for seconds in times))
+
+
+@pytest.mark.parametrize('calc_method', ['exp_smoothing', 'holt_winters'])
+def test_predict_batch_smoothing(calc_method):
+    """ Tests if between refits the levels of the exponential smoothing
+        predictors are updated together, giving the same predictions as
+        each predictor """
+    if not fits(calc_method):
+        pytest.skip('statsmodels cannot fit ' + calc_method)
+    rng = random.Random(3)
+    series = [TimeSeries() for i in range(6)]
+    batched = [predictors.make_predictor(calc_method, s, back_steps=10,
+                                         refit_interval=4) for s in series]
+    single = [predictors.make_predictor(calc_method, s, back_steps=10,
+                                        refit_interval=4) for s in series]
+    batches = 0
+    for t in range(30):
+        for i, s in enumerate(series):
+            s[t] = 100. * (i + 1) + rng.uniform(-10., 10.)
+        keys = set(p.batch_key() for p in batched)
+        if None not in keys:
+            assert (len(keys) == 1)
+            batches += 1
+        predictions = predictors.predict_batch(batched)
+        for predictor, x in zip(single, predictions):
+            assert (x == pytest.approx(predictor.predict(), nan_ok=True))
+    assert (batches > 10)
+
+
+def test_predict_batch_parallel():
+    """ Tests if the predictions made in worker processes are the same
+        as the predictions made one by one """
+    series = [TimeSeries() for i in range(4)]
+    parallel = [predictors.make_predictor('arch', s, refit_interval=3)
+                for s in series]
+    serial = [predictors.make_predictor('arch', s, refit_interval=3)
+              for s in series]
+    executor = predictors.make_executor(2)
+    for t in range(12):
+        for i, s in enumerate(series):
+            s[t] = 1000. * (i + 1) * t + random.uniform(-50., 50.)
+        # the workers are only sent the window of the predictor
+        detached = parallel[0].detached()
+        assert (list(detached.series.tail(5)) == list(series[0].tail(5)))
+        if t > 5:
+            with pytest.raises(HistoryError):
+                detached.series.values()
+        times = [0.] * len(parallel)
+        predictions = predictors.predict_batch(parallel, executor, times)
+        assert (predictions == predictors.predict_batch(serial))
+        assert (all(p.series is s for p, s in zip(parallel, series)))
+        # the time of each prediction is measured in the worker
+        assert (all(seconds > 0. for seconds in times))
+    executor.shutdown()
+
+
+def fits(calc_method):
+    """ True if the installed statsmodels can fit the models of the
+        stateless calc method, which newer releases removed or changed """
+    series = TimeSeries()
+    for t in range(10):
+        series[t] = 100. + t % 3
+    try:
+        predictors.STATELESS[calc_method](series)
+    except (AttributeError, TypeError):
+        return False
+    return True
+
+
+class FixedArma(predictors.Arma):
+    """ Arma predictor whose fits always give the same parameters """
+
+    def __init__(self, series, **kwargs):
+        super().__init__(series, **kwargs)
+        self.fits = 0
+
+    def fit(self, v):
+        self.fits += 1
+        self.params = np.array([500., 0.5])
+        self.sigma2 = 4.
+        self.scale = 2.
+        return self.filter(v)
+
+
+def test_refit_schedule():
+    """ Tests if the forecasts filtered between refits are the same as
+        refitting every timestep when the parameters do not change, and
+        if the refits are only made every refit_interval timesteps or
+        when the drift exceeds refit_tol """
+    rng = random.Random(3)
+    series = TimeSeries()
+    every = FixedArma(series, back_steps=10, steps=3, std_dev=1.)
+    interval = FixedArma(series, back_steps=10, steps=3, std_dev=1.,
+                         refit_interval=5)
+    tol = FixedArma(series, back_steps=10, steps=3, std_dev=1.,
+                    refit_interval=1000, refit_tol=3.)
+    for t in range(60):
+        # an outlier at t = 40 drifts about 100 from the one step
+        # prediction, and the next value about 50, so both are refitted
+        series[t] = 500. + rng.uniform(-1., 1.) + (100. if t == 40
+                                                        else 0.)
+        x = every.predict()
+        assert (interval.predict() == pytest.approx(x))
+        assert (tol.predict() == pytest.approx(x))
+        assert (tol.fits == 1 + (t >= 40) + (t >= 41))
+    assert (every.fits == 60)
+    assert (interval.fits == 12)
+
+
+@pytest.mark.skipif(not fits('arma'), reason='statsmodels without ARMA')
+def test_refit_interval_arma():
+    """ Tests if the arma predictor gives the same prediction as
+        predict_arma when it is refitted every timestep and stays within
+        the range of the values when it is refitted every 5 timesteps """
+    rng = random.Random(5)
+    for refit_interval in [1, 5]:
+        series = TimeSeries()
+        predictor = predictors.make_predictor('arma', series, back_steps=20,
+                                              steps=2,
+                                              refit_interval=refit_interval)
+        for t in range(60):
+            series[t] = 500. + rng.uniform(-30., 30.)
+            x = predictor.predict()
+            if refit_interval == 1:
+                assert (x == pytest.approx(
+                    no.predict_arma(series, steps=2, back_steps=20)))
+            elif t > 20:
+                assert (470. <= x <= 530.)
+
+
+@pytest.mark.parametrize('calc_method', ['exp_smoothing', 'holt_winters'])
+def test_refit_interval_smoothing(calc_method):
+    """ Tests if the exponential smoothing predictors give the same
+        prediction as the stateless methods when they are refitted every
+        timestep, and if between refits the level is updated with the
+        fitted smoothing parameter, also when the latest value changes
+        after the prediction, and stays within the range of the values """
+    if not fits(calc_method):
+        pytest.skip('statsmodels cannot fit ' + calc_method)
+    stateless = predictors.STATELESS[calc_method]
+    rng = random.Random(7)
+    for refit_interval in [1, 5]:
+        series = TimeSeries()
+        predictor = predictors.make_predictor(calc_method, series,
+                                              back_steps=20,
+                                              refit_interval=refit_interval)
+        previous = None
+        for t in range(60):
+            series[t] = 500. + rng.uniform(-30., 30.)
+            x = predictor.predict()
+            if refit_interval == 1:
+                assert (x == pytest.approx(stateless(series, back_steps=20),
+                                           nan_ok=True))
+                continue
+            if predictor.fit_n != len(series):
+                alpha = predictor.alpha
+                assert (x == pytest.approx(alpha * series[t] +
+                                           (1 - alpha) * previous))
+                # a listener adds to the latest value after the decision
+                series[t] += 10.
+                assert (predictor.predict() ==
+                        pytest.approx(alpha * series[t] +
+                                      (1 - alpha) * previous))
+                x = predictor.predict()
+            if t > 20:
+                assert (470. <= x <= 530.)
+            previous = x
+
+
+def test_stepwise_seasonal_update():
+    """ Tests if between the model selections the sw_seasonal predictor
+        updates the selected model with the new values, forecasting
+        like a full refit of the same model """
+    rng = random.Random(9)
+    series = TimeSeries()
+    for t in range(20):
+        series[t] = (1000. + 100. * np.sin(2 * np.pi * t / 5) +
+                     rng.uniform(-5., 5.))
+    predictor = predictors.make_predictor('sw_seasonal', series, degree=5,
+                                          refit_interval=100)
+    predictor.predict()
+    assert (predictor.fit_n == 20)
+    for t in range(20, 30):
+        series[t] = (1000. + 100. * np.sin(2 * np.pi * t / 5) +
+                     rng.uniform(-5., 5.))
+        x = predictor.predict()
+        assert (predictor.fit_n == 20)
+        assert (predictor.n == len(series))
+        refit = ARIMA(order=predictor.model.order,
+                      seasonal_order=predictor.model.seasonal_order,
+                      suppress_warnings=True).fit(series.values())
+        assert (x == pytest.approx(refit.predict(n_periods=1)[-1],
+                                   rel=0.01))
+
+
+@pytest.mark.parametrize('calc_method', ['arma', 'arch', 'holt_winters',
+                                         'sw_seasonal'])
+def test_parallel_decisions(calc_method):
+    """ Tests if the deployments decided from the predictions made in
+        worker processes are the same as without worker processes """
+    if calc_method != 'sw_seasonal' and not fits(calc_method):
+        pytest.skip('statsmodels can not fit ' + calc_method)
+    rng = random.Random(5)
+    commods = ['POWER', 'fuel']
+    commodity_dict = {commod: {
+        commod + '_small': {'cap': 50., 'pref': '0', 'constraint_commod': '0',
+                            'constraint': 0., 'share': 0},
+        commod + '_large': {'cap': 400., 'pref': '0',
+                            'constraint_commod': '0', 'constraint': 0.,
+                            'share': 0}} for commod in commods}
+    supply = {commod: TimeSeries() for commod in commods}
+    demand = {commod: TimeSeries() for commod in commods}
+    kwargs = {'back_steps': 8, 'degree': 4, 'refit_interval': 4}
+    if calc_method == 'sw_seasonal':
+        kwargs['refit_interval'] = 6
+    runs = []
+    for workers in [0, 2]:
+        executor = predictors.make_executor(workers)
+        batch = [predictors.make_predictor(calc_method, series[commod],
+                                           **kwargs)
+                 for series in [supply, demand] for commod in commods]
+        runs.append((executor, batch, []))
+    duration = 14 if calc_method == 'sw_seasonal' else 24
+    for t in range(duration):
+        for i, commod in enumerate(commods):
+            demand[commod][t] = (1000. * (i + 1) + 40. * t +
+                                 100. * (t % 4) + rng.uniform(-20., 20.))
+            supply[commod][t] = demand[commod][t] + rng.uniform(-200., 100.)
+        if t < 10:
+            continue
+        for executor, batch, decisions in runs:
+            predictions = predictors.predict_batch(batch, executor)
+            for i, commod in enumerate(commods):
+                diff = predictions[i] - predictions[i + len(commods)]
+                deploy_dict = {}
+                if diff < 0:
+                    deploy_dict = solver.deploy_solver(
+                        {}, commodity_dict, commod, diff, t)[0]
+                decisions.append(deploy_dict)
+    for executor, batch, decisions in runs:
+        if executor is not None:
+            executor.shutdown()
+    assert (any(runs[0][2]))
+    assert (runs[1][2] == runs[0][2])
@@ -0,0 +1,36 @@
+import json
+import os
+import time
+from d3ploy.profiler import Profiler
+
+
+def test_profiler(tmpdir):
+    """ Tests if the stages and their commodities are timed and the
+    listener calls counted per timestep and in the summary """
+    file_name = str(tmpdir.join('profile.json'))
+    profiler = Profiler(file_name, {'calc_method': 'ma'})
+    stage = profiler.timed('forecast', lambda step: time.sleep(0.01))
+    profiler.write()
+    assert (not os.path.exists(file_name))
+    for t in range(3):
+        stage(None)
+        profiler.count('supplyPOWER', t)
+        profiler.count('demandfuel', 1)
+        profiler.add('deploy', 'POWER', 0.5)
+        profiler.add('deploy', 'POWER', 0.25)
+        times, commod_times, calls = profiler.step()
+        assert (times['forecast'] >= 0.01)
+        assert (commod_times == {('deploy', 'POWER'): 0.75})
+        assert (calls == {'supplyPOWER': t, 'demandfuel': 1}
+                if t else calls == {'demandfuel': 1})
+    profiler.write()
+    with open(file_name) as f:
+        summary = json.load(f)
+    assert (summary['calc_method'] == 'ma')
+    assert (summary['steps'] == 3)
+    assert (summary['listener_calls'] == {'supplyPOWER': 3, 'demandfuel': 3})
+    assert (summary['stages']['forecast']['total'] >= 0.03)
+    assert (summary['stages']['forecast']['mean'] ==
+            summary['stages']['forecast']['total'] / 3)
+    assert (summary['commodities'] ==
+            {'deploy': {'POWER': {'total': 2.25, 'mean': 0.75}}})
@@ -0,0 +1,46 @@
+import csv
+import os
+from d3ploy.recorder import Recorder
+
+
+def read_rows(name):
+    with open(name) as f:
+        return list(csv.reader(f))
+
+
+def test_recorder_interval(tmpdir):
+    """ Tests if the rows are written every interval timesteps and when
+        flushed, one file per commodity and institution """
+    os.chdir(str(tmpdir))
+    recorder = Recorder('_1', ['time', 'supply'], interval=10)
+    other = Recorder('_2', ['time', 'supply'], interval=10)
+    for t in range(25):
+        recorder.append('POWER', [t, 2. * t])
+        recorder.append('fuel', [t, 1.])
+        other.append('POWER', [t, 3. * t])
+        recorder.step(t)
+        other.step(t)
+        if t == 5:
+            assert (not os.path.exists('POWER_1.csv'))
+    rows = read_rows('POWER_1.csv')
+    assert (rows[0] == ['time', 'supply'])
+    assert (len(rows) == 1 + 21)
+    recorder.flush()
+    other.flush()
+    rows = read_rows('POWER_1.csv')
+    assert (len(rows) == 1 + 25)
+    assert (rows[-1] == ['24', '48.0'])
+    assert (len(read_rows('fuel_1.csv')) == 1 + 25)
+    assert (read_rows('POWER_2.csv')[-1] == ['24', '72.0'])
+
+
+def test_recorder_replaces_old_output(tmpdir):
+    """ Tests if the first write replaces the file of a previous run """
+    os.chdir(str(tmpdir))
+    with open('POWER_1.csv', 'w') as f:
+        f.write('old output\n')
+    recorder = Recorder('_1', ['time', 'supply'], interval=0)
+    recorder.append('POWER', [0, 1.])
+    recorder.step(0)
+    recorder.flush()
+    assert (read_rows('POWER_1.csv') == [['time', 'supply'], ['0', '1.0']])
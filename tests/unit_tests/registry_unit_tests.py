@@ -0,0 +1,64 @@
+import random
+from d3ploy.registry import ChildRegistry
+
+
+class Child(object):
+    """ Stands in for a facility deployed by an institution """
+    count = 0
+
+    def __init__(self, prototype, enter_time, lifetime):
+        Child.count += 1
+        self.agent_id = Child.count
+        self.prototype = prototype
+        self.enter_time = enter_time
+        self.lifetime = lifetime
+
+    def id(self):
+        return self.agent_id
+
+    @property
+    def exit_time(self):
+        if self.lifetime < 0:
+            return -1
+        return self.enter_time + self.lifetime - 1
+
+    def lifetime_force(self, lifetime):
+        self.lifetime = lifetime
+
+
+def make_registry():
+    children = [Child(random.choice(['a', 'b', 'c']), random.randint(0, 50),
+                      random.choice([-1, 10, 20, 60])) for i in range(300)]
+    registry = ChildRegistry()
+    for child in sorted(children, key=lambda child: child.enter_time):
+        registry.add(child)
+    return registry, children
+
+
+def test_exiting():
+    """ Tests if the registry finds the children exiting at each time,
+        also after their lifetime changed """
+    registry, children = make_registry()
+    for child in random.sample(children, 50):
+        child.lifetime_force(random.randint(1, 60))
+        registry.reschedule(child)
+    for t in range(120):
+        exiting = registry.exiting(t)
+        assert (sorted(child.id() for child in exiting) ==
+                sorted(child.id() for child in children
+                       if child.exit_time == t))
+        for child in exiting:
+            registry.remove(child)
+    assert (len(registry) == len([child for child in children
+                                  if child.exit_time < 0]))
+
+
+def test_oldest():
+    """ Tests if the children of prototypes are iterated oldest first """
+    registry, children = make_registry()
+    oldest = list(registry.oldest(['a', 'c']))
+    assert (len(oldest) == len([child for child in children
+                                if child.prototype in ['a', 'c']]))
+    enter_times = [child.enter_time for child in oldest]
+    assert (enter_times == sorted(enter_times))
+    assert (list(registry.oldest(['d'])) == [])
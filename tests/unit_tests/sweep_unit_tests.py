@@ -0,0 +1,118 @@
+import os
+import sys
+import pytest
+import d3ploy.sweep as sweep
+import d3ploy.tester as tester
+from d3ploy.cache import Cache
+
+TEMPLATE = {
+    "simulation": {
+        "control": {"duration": "10", "startmonth": "1", "startyear": "2000"},
+        "region": {
+            "config": {"NullRegion": "\n      "},
+            "institution": [
+                {"config": {"NullInst": "\n      "}, "name": "null_inst"},
+                {"config": {"DemandDrivenDeploymentInst": {
+                    "driving_commod": "fuel",
+                    "demand_eq": "10*t"}},
+                 "name": "source_inst"}],
+            "name": "SingleRegion"}}}
+
+# writes a supply time series depending on the steps of the institution,
+# and the number of runs in a file
+FAKE_CYCLUS = """
+import json
+import sqlite3
+import sys
+output_file, input_file = sys.argv[2], sys.argv[3]
+with open(input_file) as f:
+    scenario = json.load(f)
+config = scenario['simulation']['region']['institution'][1]['config']
+steps = int(config['DemandDrivenDeploymentInst']['steps'])
+con = sqlite3.connect(output_file)
+for name in ['supply', 'calc_supply', 'calc_demand']:
+    table = 'timeseries' + name + 'fuel'
+    con.execute('CREATE TABLE ' + table + ' (AgentId, Time, Value)')
+    for t in range(10):
+        con.execute('INSERT INTO ' + table + ' VALUES (1, ?, ?)',
+                    (t, 10 * (t - steps)))
+con.commit()
+with open(%r, 'a') as f:
+    f.write('run\\n')
+"""
+
+
+def test_parameter_grid():
+    grid = sweep.parameter_grid(calc_method=['ma', 'poly'],
+                                back_steps=[2, 5, 10])
+    assert (len(grid) == 6)
+    assert ({'calc_method': 'poly', 'back_steps': 5} in grid)
+
+
+def test_make_input():
+    scenario = sweep.make_input(TEMPLATE, {
+        'calc_method': 'fft', 'steps': 2, 'record': True,
+        'supply_buffer': {'fuel': 0.5}})
+    config = scenario['simulation']['region']['institution'][1]['config']
+    config = config['DemandDrivenDeploymentInst']
+    assert (config['calc_method'] == 'fft')
+    assert (config['steps'] == '2')
+    assert (config['record'] == '1')
+    assert (config['supply_buffer'] ==
+            {'item': [{'commod': 'fuel', 'buffer': '0.5'}]})
+    assert ('calc_method' not in TEMPLATE['simulation']['region'][
+        'institution'][1]['config']['DemandDrivenDeploymentInst'])
+    assert (sweep.input_hash(scenario) != sweep.input_hash(TEMPLATE))
+    with pytest.raises(ValueError):
+        sweep.make_input({'simulation': {}}, {'steps': 1})
+
+
+def test_sweep(tmpdir):
+    """ Tests if the runs are evaluated and not run again """
+    log = str(tmpdir.join('runs.log'))
+    script = str(tmpdir.join('fake_cyclus.py'))
+    with open(script, 'w') as f:
+        f.write(FAKE_CYCLUS % log)
+    output_dir = str(tmpdir.join('outputs'))
+    grid = sweep.parameter_grid(steps=[0, 1, 2, 3])
+
+    def extract(output_file):
+        return tester.supply_demand_dict_driving(output_file, '10*t', 'fuel')
+
+    for i in range(2):
+        results = list(sweep.sweep(TEMPLATE, grid, extract, output_dir,
+                                   workers=2, cyclus=[sys.executable, script]))
+        assert (len(results) == 4)
+        for params, output_file, row in results:
+            assert (os.path.dirname(output_file) == output_dir)
+            assert (row['undersupply'] == 10 * 10 * params['steps'])
+            assert (row['oversupply'] == 0)
+        with open(log) as f:
+            assert (len(f.readlines()) == 4)
+
+
+def test_sweep_cache(tmpdir):
+    """ Tests if the outputs and metrics are taken from the cache """
+    log = str(tmpdir.join('runs.log'))
+    script = str(tmpdir.join('fake_cyclus.py'))
+    with open(script, 'w') as f:
+        f.write(FAKE_CYCLUS % log)
+    cache = Cache(str(tmpdir.join('cache')), versions={'d3ploy': 'test'})
+    extracted = []
+
+    def extract(output_file):
+        extracted.append(output_file)
+        return tester.supply_demand_dict_driving(output_file, '10*t', 'fuel')
+
+    for steps in [[1, 2], [1, 2, 3]]:
+        grid = sweep.parameter_grid(steps=steps)
+        results = list(sweep.sweep(TEMPLATE, grid, extract, workers=2,
+                                   cyclus=[sys.executable, script],
+                                   cache=cache, summary='fuel'))
+        for params, output_file, row in results:
+            assert (cache.get(cache.key(sweep.make_input(
+                TEMPLATE, params))) == output_file)
+            assert (row['undersupply'] == 10 * 10 * params['steps'])
+    with open(log) as f:
+        assert (len(f.readlines()) == 3)
+    assert (len(extracted) == 3)
@@ -0,0 +1,160 @@
+import os
+import random
+import sqlite3 as lite
+import numpy as np
+import pytest
+import d3ploy.tester as tester
+
+
+def make_output(file_name, commods, duration=50):
+    """ Writes time series tables like the ones of a cyclus output """
+    con = lite.connect(file_name)
+    con.execute('CREATE TABLE info (duration INTEGER)')
+    con.execute('INSERT INTO info VALUES (?)', (duration,))
+    expected = {}
+    for commod in commods:
+        for name in ['supply', 'demand', 'calc_supply', 'calc_demand']:
+            table = 'timeseries' + name + commod
+            con.execute('CREATE TABLE ' + table +
+                        ' (AgentId INTEGER, Time INTEGER, Value REAL)')
+            sums = {}
+            for t in range(1, duration):
+                for agent in range(random.randint(0, 3)):
+                    value = random.uniform(0., 100.)
+                    con.execute('INSERT INTO ' + table + ' VALUES (?, ?, ?)',
+                                (agent, t, value))
+                    sums[t] = sums.get(t, 0.) + value
+            expected[name + commod] = sums
+    con.commit()
+    con.close()
+    return expected
+
+
+def test_load_timeseries(tmpdir):
+    """ Tests if all the time series tables are loaded and cached """
+    file_name = str(tmpdir.join('output.sqlite'))
+    expected = make_output(file_name, ['POWER', 'fuel', 'spent_fuel'])
+    timeseries = tester.load_timeseries(file_name)
+    assert (sorted(timeseries) == sorted(expected))
+    for name, sums in expected.items():
+        dict_ = tester.timeseries_dict(timeseries, name)
+        assert (sorted(dict_) == sorted(sums))
+        for t, value in sums.items():
+            assert (dict_[t] == pytest.approx(value))
+    assert (tester.load_timeseries(file_name) is timeseries)
+    with pytest.raises(lite.OperationalError):
+        tester.timeseries_dict(timeseries, 'supplyuranium')
+
+
+def test_load_timeseries_cache(tmpdir, monkeypatch):
+    """ Tests if the cache drops rewritten and least recently used files """
+    monkeypatch.setattr(tester, 'TIMESERIES_CACHE', tester.OrderedDict())
+    monkeypatch.setattr(tester, 'TIMESERIES_CACHE_SIZE', 2)
+    file_names = [str(tmpdir.join('output%i.sqlite' % i)) for i in range(3)]
+    for file_name in file_names:
+        make_output(file_name, ['POWER'], duration=5)
+    first = tester.load_timeseries(file_names[0])
+    tester.load_timeseries(file_names[1])
+    assert (tester.load_timeseries(file_names[0]) is first)
+    tester.load_timeseries(file_names[2])
+    assert (len(tester.TIMESERIES_CACHE) == 2)
+    assert (tester.load_timeseries(file_names[0]) is first)
+    assert ([key[0] for key in tester.TIMESERIES_CACHE] ==
+            [os.path.abspath(file_names[i]) for i in [2, 0]])
+    os.remove(file_names[0])
+    expected = make_output(file_names[0], ['POWER'], duration=20)
+    rewritten = tester.load_timeseries(file_names[0])
+    assert (rewritten is not first)
+    assert (len(tester.TIMESERIES_CACHE) == 2)
+    assert (sorted(tester.timeseries_dict(rewritten, 'supplyPOWER')) ==
+            sorted(expected['supplyPOWER']))
+
+
+def test_supply_demand_dict(tmpdir):
+    """ Tests if the supply and demand dictionaries are built from the
+        loaded time series """
+    file_name = str(tmpdir.join('output.sqlite'))
+    expected = make_output(file_name, ['POWER', 'fuel'])
+    all_dict = tester.supply_demand_dict_driving(file_name, '10*t', 'POWER')
+    for t in range(max(expected['supplyPOWER']) + 1):
+        assert (all_dict['dict_demand'][t] == 10 * t)
+        assert (all_dict['dict_supply'][t] == pytest.approx(
+            expected['supplyPOWER'].get(t, 0.)))
+    all_dict = tester.supply_demand_dict_nondriving(file_name, 'fuel', True)
+    for t in expected['supplyfuel']:
+        assert (all_dict['dict_demand'][t] == pytest.approx(
+            expected['demandfuel'].get(t, 0.)))
+    assert (all_dict['dict_calc_demand'] == pytest.approx(
+        expected['calc_demandfuel']))
+
+
+def loop_agents_at_play(entertime_list, exittime_list, duration):
+    """ The number of agents at play counted step by step """
+    atplay = 0
+    atplay_dict = {}
+    for indx in range(duration + 1):
+        atplay += entertime_list.count(indx)
+        atplay -= exittime_list.count(indx)
+        atplay_dict[indx] = atplay
+    return atplay_dict
+
+
+def test_agent_timeline(tmpdir):
+    """ Tests if the agents at play are counted from one query """
+    file_name = str(tmpdir.join('output.sqlite'))
+    duration = 40
+    con = lite.connect(file_name)
+    con.execute('CREATE TABLE info (duration INTEGER)')
+    con.execute('INSERT INTO info VALUES (?)', (duration,))
+    con.execute('CREATE TABLE agententry ' +
+                '(agentid INTEGER, prototype TEXT, entertime INTEGER)')
+    con.execute('CREATE TABLE agentexit (agentid INTEGER, exittime INTEGER)')
+    protos = ['reactor', 'source', 'sink "1"']
+    entries = {proto: [] for proto in protos}
+    exits = {proto: [] for proto in protos}
+    for agent in range(300):
+        proto = random.choice(protos)
+        enter = random.randint(0, duration + 5)
+        con.execute('INSERT INTO agententry VALUES (?, ?, ?)',
+                    (agent, proto, enter))
+        entries[proto].append(enter)
+        if random.random() < 0.5:
+            exit = enter + random.randint(1, 20)
+            con.execute('INSERT INTO agentexit VALUES (?, ?)', (agent, exit))
+            exits[proto].append(exit)
+    con.commit()
+    con.close()
+    agent_dict = tester.get_agent_dict(file_name, protos + ['other'])
+    for proto in protos:
+        expected = loop_agents_at_play(entries[proto], exits[proto],
+                                       duration)
+        assert (agent_dict[proto] == expected)
+        assert (tester.agents_at_play(entries[proto], exits[proto],
+                                      duration) == expected)
+    assert (set(agent_dict['other'].values()) == {0})
+    timeline = tester.agent_timeline(file_name, ['source', 'reactor'])
+    assert (timeline.shape == (2, duration + 1))
+    assert (list(timeline[1]) == list(agent_dict['reactor'].values()))
+
+
+def test_deployments(tmpdir):
+    """ Tests if the deployments are read from the table of the builds of
+    the institutions """
+    file_name = str(tmpdir.join('output.sqlite'))
+    make_output(file_name, ['POWER'])
+    assert (tester.deployments(file_name) == {})
+    con = lite.connect(file_name)
+    con.execute('CREATE TABLE d3ploy_deployed (SimId BLOB, ' +
+                'AgentId INTEGER, Time INTEGER, Prototype TEXT, ' +
+                'Count INTEGER)')
+    builds = {'reactor': {3: 2, 7: 1}, 'smr': {3: 5}}
+    for proto, events in builds.items():
+        for time, num in events.items():
+            # two institutions deploying the prototype
+            con.execute('INSERT INTO d3ploy_deployed VALUES ' +
+                        '(?, ?, ?, ?, ?)', (b'', 1, time, proto, num - 1))
+            con.execute('INSERT INTO d3ploy_deployed VALUES ' +
+                        '(?, ?, ?, ?, ?)', (b'', 2, time, proto, 1))
+    con.commit()
+    con.close()
+    assert (tester.deployments(file_name) == builds)
@@ -0,0 +1,140 @@
+import csv
+import random
+import numpy as np
+import pytest
+from collections import defaultdict
+from d3ploy.timeseries import TimeSeries, HistoryError, as_array, window
+from d3ploy.predictors import make_predictor
+import d3ploy.NO_solvers as no
+import d3ploy.DO_solvers as do
+
+
+def test_timeseries_matches_defaultdict():
+    """ Tests that TimeSeries reads and writes like the
+        defaultdict(float) histories it replaces """
+    series = TimeSeries(capacity=2)
+    ref = defaultdict(float)
+    for time in range(200):
+        value = random.uniform(0.0, 10.0)
+        series[time] += value
+        ref[time] += value
+        if time % 3 == 0:
+            series[time + 1] -= 1.0
+            ref[time + 1] -= 1.0
+        assert (time in series)
+        assert (time + 5 not in series)
+    assert (len(series) == len(ref))
+    assert (list(series.keys()) == list(ref.keys()))
+    assert (np.allclose(as_array(series), list(ref.values())))
+    assert (series[500] == 0.0)
+    assert (500 in series)
+    assert (not series.is_dense())
+
+
+def test_timeseries_tail_is_view():
+    """ Tests that the windows handed to the predictors are views
+        of the series, not copies """
+    series = TimeSeries()
+    for time in range(10):
+        series[time] = time
+    tail = series.tail(3)
+    assert (list(tail) == [7., 8., 9.])
+    assert (np.shares_memory(tail, series.values()))
+    assert (len(series.tail(0)) == 10)
+    assert (list(window(dict(series.items()), 3)) == [7., 8., 9.])
+
+
+def test_calc_methods_accept_timeseries():
+    """ Tests that the predictors give the same result for a
+        TimeSeries and a dictionary """
+    series = TimeSeries()
+    for time in range(20):
+        series[time] = 3. * time + random.uniform(0.0, 1.0)
+    ref = dict(series.items())
+    assert (no.predict_ma(series) == no.predict_ma(ref))
+    assert (do.polyfit_regression(series, back_steps=5) ==
+            do.polyfit_regression(ref, back_steps=5))
+    assert (do.fft(series, back_steps=8) == do.fft(ref, back_steps=8))
+
+
+def test_timeseries_retention(tmpdir):
+    """ Tests that a series with a bounded history predicts like the
+        whole series, spills the dropped values and raises an error when
+        more history is requested """
+    spill = str(tmpdir.join('spill.csv'))
+    series = TimeSeries(capacity=4, retain=8, spill=spill)
+    ref = TimeSeries()
+    predictor = make_predictor('poly', series, back_steps=6, degree=2)
+    ref_predictor = make_predictor('poly', ref, back_steps=6, degree=2)
+    for time in range(300):
+        value = time ** 1.5 + random.uniform(0.0, 1.0)
+        series[time] += value
+        ref[time] += value
+        if time % 7 == 0:
+            series[time + 1] = 1.
+            ref[time + 1] = 1.
+        assert (len(series) == len(ref))
+        assert (series[time] == ref[time])
+        assert (list(series.tail(6)) == list(ref.tail(6)))
+        assert (predictor.predict() == ref_predictor.predict())
+        assert (do.polyfit_regression(series, back_steps=5, degree=2) ==
+                do.polyfit_regression(ref, back_steps=5, degree=2))
+    assert (series._data.size == 16)
+    assert (series.is_dense())
+    with pytest.raises(HistoryError):
+        series.tail(20)
+    with pytest.raises(HistoryError):
+        series.values()
+    with pytest.raises(HistoryError):
+        series[10]
+    with pytest.raises(HistoryError):
+        as_array(series)
+    with pytest.raises(HistoryError):
+        no.predict_ma(series, back_steps=0)
+    series.spill_all()
+    with open(spill) as f:
+        rows = list(csv.reader(f))
+    assert (rows[0] == ['time', 'value'])
+    assert ([int(row[0]) for row in rows[1:]] == list(ref.keys()))
+    assert (np.allclose([float(row[1]) for row in rows[1:]],
+                        as_array(ref)))
+
+
+def test_timeseries_widen_retention():
+    """ Tests that once values are dropped the retention of a series can
+        be widened, or removed, but not narrowed """
+    series = TimeSeries(capacity=4, retain=4)
+    for time in range(10):
+        series[time] = float(time)
+    with pytest.raises(HistoryError):
+        series.set_retention(2)
+    series.set_retention(8)
+    for time in range(10, 20):
+        series[time] = float(time)
+    assert (list(series.tail(8)) == list(range(12, 20)))
+    with pytest.raises(HistoryError):
+        series.tail(20)
+    series.set_retention(0)
+    for time in range(20, 200):
+        series[time] = float(time)
+    assert (list(series.tail(188)) == list(range(12, 200)))
+    assert (len(series) == 200)
+
+
+def test_timeseries_recent():
+    """ Tests that a copy of the last values of a series gives the same
+        tails and length as the series, and no older values """
+    for gaps in [False, True]:
+        series = TimeSeries()
+        for time in range(3, 100):
+            if not gaps or time % 4:
+                series[time] = float(time)
+        for n in [1, 5, 30]:
+            recent = series.recent(n)
+            assert (len(recent) == len(series))
+            assert (list(recent.tail(n)) == list(series.tail(n)))
+            assert (recent.get(99) == 99.)
+            with pytest.raises(HistoryError):
+                recent.values()
+        assert (list(series.recent(0).values()) == list(series.values()))
+        assert (list(series.recent(500).values()) == list(series.values()))